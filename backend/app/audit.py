@@ -1,4 +1,5 @@
 import logging
+from datetime import datetime, timezone
 from typing import Optional
 from sqlalchemy.orm import Session
 from .models import AuditLog
@@ -8,34 +9,55 @@ auth_logger = logging.getLogger('auth')
 activity_logger = logging.getLogger('activity')
 system_logger = logging.getLogger('system')
 
-def log_audit(db: Session, user_id: Optional[int], action: str, details: str, hospital_id: Optional[int] = None):
+# High-volume, non-security actions written by the background AuditWriter instead of the
+# caller's transaction. Everything else (logins, deletions, role/config changes) stays durable.
+DEFERRED_ACTIONS = {"VIEW_DOCUMENT", "FILE_UPLOADED", "FILE_LINK_GENERATED"}
+
+def log_audit(
+    db: Session,
+    user_id: Optional[int],
+    action: str,
+    details: str,
+    hospital_id: Optional[int] = None,
+    durable: Optional[bool] = None
+):
+    """
+    durable=True: the row is added to `db` and commits (or rolls back) with the caller's
+    transaction. durable=False: the row is queued for a batched background insert and the
+    caller doesn't need to commit. Defaults to durable unless `action` is in DEFERRED_ACTIONS.
+    """
+    if durable is None:
+        durable = action not in DEFERRED_ACTIONS
+
     # 1. DB Audit (Always Source of Truth for Dashboard)
-    new_log = AuditLog(
-        user_id=user_id,
-        hospital_id=hospital_id,
-        action=action,
-        details=details
-    )
-    db.add(new_log)
-    
-    # 2. File Audit (Categorized)
+    if durable:
+        db.add(AuditLog(user_id=user_id, hospital_id=hospital_id, action=action, details=details))
+    else:
+        from .services.audit_writer import AuditWriter
+        # Stamped now: the batch may be inserted up to AUDIT_FLUSH_SECONDS later
+        AuditWriter.enqueue(dict(
+            user_id=user_id, hospital_id=hospital_id, action=action, details=details,
+            timestamp=datetime.now(timezone.utc)
+        ))
+
+    # 2. File Audit (Categorized; handlers run on a QueueListener thread, see logging_config)
     try:
         log_msg = f"User: {user_id} | Hosp: {hospital_id} | Action: {action} | {details}"
-        
+
         if any(x in action for x in ['LOGIN', 'LOGOUT', 'AUTH', 'PASSWORD', 'USER', 'ADMIN']):
             auth_logger.info(log_msg)
-            
+
         elif any(x in action for x in ['FILE', 'PATIENT', 'UPLOAD', 'DOWNLOAD', 'VIEW', 'PRINT', 'OCR']):
             activity_logger.info(log_msg)
-            
+
         elif any(x in action for x in ['SYSTEM', 'ERROR', 'CONFIG', 'HOSPITAL']):
             system_logger.info(log_msg)
-            
+
         else:
             # Fallback for unknown categories
             system_logger.info(log_msg)
-            
+
     except Exception as e:
         print(f"File Logging Error: {e}")
 
-    # db.commit() # Caller must commit to reduce transaction overhead
+    # db.commit() # Caller must commit durable rows to reduce transaction overhead
@@ -24,6 +24,8 @@ class Settings:
     AWS_SECRET_ACCESS_KEY: str = os.getenv("AWS_SECRET_ACCESS_KEY")
     AWS_REGION: str = os.getenv("AWS_REGION", "us-east-1")
     AWS_BUCKET_NAME: str = os.getenv("AWS_BUCKET_NAME", "digifort-labs-files")
+    AWS_S3_ENDPOINT_URL: str = os.getenv("AWS_S3_ENDPOINT_URL") # S3-compatible stand-in (MinIO, moto server)
+    S3_UPLOAD_STORAGE_CLASS: str = os.getenv("S3_UPLOAD_STORAGE_CLASS", "INTELLIGENT_TIERING")
 
     # Email / SMTP
     SMTP_SERVER: str = os.getenv("SMTP_SERVER", "smtp.gmail.com")
@@ -37,6 +39,83 @@ class Settings:
     CSRF_SECRET_KEY: str = os.getenv("CSRF_SECRET_KEY", "csrf-secret-key-change-in-prod")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "720"))
+
+    # Per-worker auth caches (see services/principal_cache.py)
+    PRINCIPAL_CACHE_TTL_SECONDS: int = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+    MAINTENANCE_FLAG_TTL_SECONDS: int = int(os.getenv("MAINTENANCE_FLAG_TTL_SECONDS", "15"))
+    LAST_ACTIVE_FLUSH_SECONDS: int = int(os.getenv("LAST_ACTIVE_FLUSH_SECONDS", "60"))
+
+    # Rate limiting: "redis" (shared by all workers), "local" (per worker) or "auto"
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "auto")
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1")) # Worker count, set by gunicorn_conf.py
+    # Database connections all web workers may hold together; split per worker in database.py
+    DB_MAX_CONNECTIONS: int = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+
+    # Bandwidth metering (see services/bandwidth_meter.py)
+    BANDWIDTH_FLUSH_SECONDS: int = int(os.getenv("BANDWIDTH_FLUSH_SECONDS", "5"))
+    BANDWIDTH_QUOTA_CACHE_SECONDS: int = int(os.getenv("BANDWIDTH_QUOTA_CACHE_SECONDS", "30"))
+
+    # Deferred audit rows (see services/audit_writer.py)
+    AUDIT_QUEUE_SIZE: int = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+    AUDIT_BATCH_SIZE: int = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+    AUDIT_FLUSH_SECONDS: float = float(os.getenv("AUDIT_FLUSH_SECONDS", "1"))
+
+    # Event-loop stall detector (see core/loop_monitor.py); 0 disables it
+    LOOP_BLOCK_THRESHOLD_MS: float = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+
+    # Per-request SQL counts / N+1 detection (see core/sql_instrumentation.py, /platform/perf).
+    # Off by default in production (per-statement overhead); set SQL_INSTRUMENTATION=true to opt in
+    SQL_INSTRUMENTATION: bool = os.getenv(
+        "SQL_INSTRUMENTATION", "false" if os.getenv("ENVIRONMENT", "development") == "production" else "true"
+    ).lower() == "true"
+    N_PLUS_ONE_THRESHOLD: int = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+    # Periodic jobs, leased per job so one worker runs each (see services/scheduler.py)
+    SCHEDULER_ENABLED: bool = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    SCHEDULER_POLL_SECONDS: int = int(os.getenv("SCHEDULER_POLL_SECONDS", "60"))
+
+    # Pick-list walking model for file retrievals (see services/pick_list.py)
+    PICK_WALK_SPEED_M_S: float = float(os.getenv("PICK_WALK_SPEED_M_S", "1.2"))
+    PICK_AISLE_SPACING_M: float = float(os.getenv("PICK_AISLE_SPACING_M", "3.0"))
+    PICK_RACK_WIDTH_M: float = float(os.getenv("PICK_RACK_WIDTH_M", "1.5"))
+    PICK_SECONDS_PER_STOP: int = int(os.getenv("PICK_SECONDS_PER_STOP", "45"))
+    PICK_SECONDS_PER_FILE: int = int(os.getenv("PICK_SECONDS_PER_FILE", "20"))
+
+    # Handheld scan ingestion (see services/scan_ingest.py)
+    SCAN_LABEL_CACHE_SECONDS: int = int(os.getenv("SCAN_LABEL_CACHE_SECONDS", "300"))
+    SCAN_CHUNK_SIZE: int = int(os.getenv("SCAN_CHUNK_SIZE", "500"))
+
+    # In-memory warehouse layout / occupancy model, rebuilt at most this often (see services/occupancy.py)
+    OCCUPANCY_CACHE_SECONDS: int = int(os.getenv("OCCUPANCY_CACHE_SECONDS", "60"))
+
+    # Retention cleanup batches and limits (see services/cleanup_service.py); 0 = unlimited
+    RETENTION_BATCH_SIZE: int = int(os.getenv("RETENTION_BATCH_SIZE", "200"))
+    RETENTION_DELETE_WORKERS: int = int(os.getenv("RETENTION_DELETE_WORKERS", "4"))
+    RETENTION_MAX_PATIENTS_PER_RUN: int = int(os.getenv("RETENTION_MAX_PATIENTS_PER_RUN", "20000"))
+    RETENTION_MAX_OBJECTS_PER_SECOND: float = float(os.getenv("RETENTION_MAX_OBJECTS_PER_SECOND", "0"))
+
+    # Access-driven storage tiering (see services/storage_tiering.py)
+    TIERING_WINDOW_DAYS: int = int(os.getenv("TIERING_WINDOW_DAYS", "90"))
+    TIERING_HOT_ACCESSES: int = int(os.getenv("TIERING_HOT_ACCESSES", "3"))
+    TIERING_WARM_DAYS: int = int(os.getenv("TIERING_WARM_DAYS", "30"))
+    TIERING_COLD_DAYS: int = int(os.getenv("TIERING_COLD_DAYS", "90"))
+    TIERING_ARCHIVE_DAYS: int = int(os.getenv("TIERING_ARCHIVE_DAYS", "365"))
+    TIERING_GROUP_HOT_RATIO: float = float(os.getenv("TIERING_GROUP_HOT_RATIO", "0.05"))
+    TIERING_RETRIEVAL_SLA_HOURS: float = float(os.getenv("TIERING_RETRIEVAL_SLA_HOURS", "6"))
+    TIERING_HISTORY_DAYS: int = int(os.getenv("TIERING_HISTORY_DAYS", "730"))
+    TIERING_MAX_TRANSITIONS_PER_RUN: int = int(os.getenv("TIERING_MAX_TRANSITIONS_PER_RUN", "5000"))
+    TIERING_WORKERS: int = int(os.getenv("TIERING_WORKERS", "4"))
+
+    # Archive restore tracking and delivery (see services/restore_tracker.py)
+    RESTORE_POLL_SECONDS: int = int(os.getenv("RESTORE_POLL_SECONDS", "60"))
+    RESTORE_POLL_BATCH: int = int(os.getenv("RESTORE_POLL_BATCH", "500"))
+    RESTORE_POLL_WORKERS: int = int(os.getenv("RESTORE_POLL_WORKERS", "8"))
+    RESTORE_BACKOFF_MIN_SECONDS: int = int(os.getenv("RESTORE_BACKOFF_MIN_SECONDS", "60"))
+    RESTORE_BACKOFF_MAX_SECONDS: int = int(os.getenv("RESTORE_BACKOFF_MAX_SECONDS", "1800"))
+    RESTORE_GIVE_UP_HOURS: int = int(os.getenv("RESTORE_GIVE_UP_HOURS", "72"))
+    RESTORE_DELIVERY_WORKERS: int = int(os.getenv("RESTORE_DELIVERY_WORKERS", "2"))
+    RESTORE_DELIVERY_ATTEMPTS: int = int(os.getenv("RESTORE_DELIVERY_ATTEMPTS", "3"))
     
     @property
     def IS_UNSAFE_SECRET_KEY(self) -> bool:
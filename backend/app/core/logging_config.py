@@ -1,11 +1,16 @@
 import os
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Define standard formats
 STANDARD_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 formatter = logging.Formatter(STANDARD_FORMAT)
 
+# Started by setup_logging; file writes happen on their threads, not the request thread
+_listeners = []
+
 def setup_logger(name: str, log_file: str, level=logging.INFO):
     """Function to setup as many loggers as you want"""
     
@@ -17,9 +22,15 @@ def setup_logger(name: str, log_file: str, level=logging.INFO):
     handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5) # 10MB per file, keep 5
     handler.setFormatter(formatter)
 
+    # Callers only enqueue the record; a QueueListener thread does the (rotating) file I/O
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    logger.addHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
     
     return logger
 
@@ -38,4 +49,11 @@ def setup_logging():
     # 3. System Logger (Startup, Errors, Config)
     setup_logger('system', os.path.join(base_dir, "system.log"))
     
+    atexit.register(stop_logging)
+
     print(f"✅ Logging initialized. Logs writing to: {base_dir}")
+
+def stop_logging():
+    """Flushes queued records to the files (registered at exit)."""
+    while _listeners:
+        _listeners.pop().stop()
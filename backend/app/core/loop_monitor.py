@@ -0,0 +1,117 @@
+"""
+Event-loop blocking detector.
+
+A heartbeat scheduled on the loop every `interval` records when it last ran; a watchdog
+thread notices when it is overdue by more than `threshold_ms`, samples the loop thread's
+stack and attributes the block to the route endpoint on it (or the innermost app frame).
+The heartbeat then measures the real stall once the loop is free again and records it.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LoopBlockMonitor:
+    def __init__(self, threshold_ms: float = 100, interval_ms: float = 20, history: int = 100):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.blocks = deque(maxlen=history)
+        self.by_endpoint: Dict[str, dict] = {}
+        self._endpoints = {}  # endpoint code object -> "METHOD /path"
+        self._lock = threading.Lock()
+        self._sample: Optional[dict] = None
+        self._loop = None
+        self._loop_thread_id = None
+        self._handle = None
+        self._last_beat = 0.0
+        self._stopped = threading.Event()
+
+    def register_routes(self, app, prefix: str = ""):
+        """Map endpoint functions to their routes so blocks can be attributed by path."""
+        for route in getattr(app, "routes", []):
+            included = getattr(route, "original_router", None)
+            if included is not None:
+                # Newer FastAPI keeps included routers nested instead of copying their routes
+                self.register_routes(included, prefix + route.include_context.prefix)
+                continue
+            endpoint = getattr(route, "endpoint", None)
+            code = getattr(endpoint, "__code__", None)
+            if code is not None:
+                methods = ",".join(sorted(getattr(route, "methods", None) or [])) or "*"
+                self._endpoints[code] = f"{methods} {prefix}{route.path}"
+
+    def start(self):
+        """Call from the event loop's thread (e.g. a startup handler)."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _beat(self):
+        now = time.monotonic()
+        stalled = now - self._last_beat - self.interval
+        self._last_beat = now
+        with self._lock:
+            sample, self._sample = self._sample, None
+        if stalled >= self.threshold:
+            self._record(stalled, sample)
+        if not self._stopped.is_set():
+            self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue >= self.threshold and self._sample is None:
+                sample = self._sample_stack()
+                with self._lock:
+                    self._sample = sample
+
+    def _sample_stack(self) -> dict:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        endpoint, location = None, None
+        while frame is not None:
+            code = frame.f_code
+            if location is None and code.co_filename.startswith(_APP_DIR) and code.co_filename != __file__:
+                location = f"{os.path.relpath(code.co_filename, _APP_DIR)}:{frame.f_lineno} in {code.co_name}"
+            if code in self._endpoints:
+                endpoint = self._endpoints[code]
+                break
+            frame = frame.f_back
+        return {"endpoint": endpoint, "location": location}
+
+    def _record(self, stalled: float, sample: Optional[dict]):
+        sample = sample or {}
+        endpoint = sample.get("endpoint") or "unknown"
+        duration_ms = round(stalled * 1000, 1)
+        self.blocks.append({
+            "endpoint": endpoint,
+            "location": sample.get("location"),
+            "duration_ms": duration_ms,
+            "at": time.time()
+        })
+        stats = self.by_endpoint.setdefault(endpoint, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] += duration_ms
+        stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        print(f"🐢 Event loop blocked {duration_ms:.0f} ms by {endpoint} ({sample.get('location') or 'no sample'})")
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "by_endpoint": self.by_endpoint,
+            "recent": list(self.blocks)
+        }
@@ -0,0 +1,173 @@
+"""
+Per-request SQL instrumentation.
+
+Engine events count and time every statement into the trace of the request that ran it
+(a context variable, so it follows sync handlers into the threadpool). At the end of the
+request the trace is folded into per-route totals; a statement shape repeated
+`n_plus_one_threshold` times in one request is flagged as an N+1 (typically a lazy
+relationship loaded inside a loop).
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+|:\w+|\?")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Statement with parameters (and IN-list lengths) normalised away."""
+    shape = _PLACEHOLDER.sub("?", statement)
+    shape = _PLACEHOLDER_LIST.sub("?, ...", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class QueryTrace:
+    __slots__ = ("queries", "db_ms", "shapes")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.shapes: Dict[str, list] = {}  # shape -> [count, ms]
+
+    def add(self, statement: str, ms: float):
+        self.queries += 1
+        self.db_ms += ms
+        entry = self.shapes.get(statement)
+        if entry is None:
+            self.shapes[statement] = [1, ms]
+        else:
+            entry[0] += 1
+            entry[1] += ms
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """Statement shapes run at least `threshold` times (N+1 candidates)."""
+        if self.queries < threshold:
+            return {}
+        counts = {}
+        for statement, (count, _) in self.shapes.items():
+            shape = statement_shape(statement)
+            counts[shape] = counts.get(shape, 0) + count
+        return {shape: count for shape, count in counts.items() if count >= threshold}
+
+
+_current: ContextVar[Optional[QueryTrace]] = ContextVar("sql_trace", default=None)
+
+
+class QueryStats:
+    n_plus_one_threshold = 5
+    _instrumented = set()
+    _captures: List[QueryTrace] = []
+    _routes: Dict[str, dict] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def instrument(cls, engine):
+        """Attach the timing events to a (sync) Engine; use `async_engine.sync_engine` for async ones."""
+        if id(engine) in cls._instrumented:
+            return
+        cls._instrumented.add(id(engine))
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info["query_start"].pop()
+            trace = _current.get()
+            if trace is None and not cls._captures:
+                return
+            ms = (time.perf_counter() - started) * 1000
+            if trace is not None:
+                trace.add(statement, ms)
+            for capture in cls._captures:
+                capture.add(statement, ms)
+
+        @event.listens_for(engine, "handle_error")
+        def _error(exception_context):
+            conn = exception_context.connection
+            if conn is not None and conn.info.get("query_start"):
+                conn.info["query_start"].pop()
+
+    @staticmethod
+    def begin() -> QueryTrace:
+        """Start tracing the current request (task / context)."""
+        trace = QueryTrace()
+        _current.set(trace)
+        return trace
+
+    @classmethod
+    @contextmanager
+    def capture(cls):
+        """Every statement run by any thread while the block is open (tests, benchmarks)."""
+        trace = QueryTrace()
+        cls._captures.append(trace)
+        try:
+            yield trace
+        finally:
+            cls._captures.remove(trace)
+
+    @classmethod
+    def record(cls, route: str, trace: QueryTrace, elapsed_ms: float) -> Dict[str, int]:
+        """Fold a finished request into the per-route totals. Returns its N+1 shapes."""
+        repeated = trace.repeated(cls.n_plus_one_threshold)
+        with cls._lock:
+            stats = cls._routes.get(route)
+            if stats is None:
+                stats = cls._routes[route] = {
+                    "requests": 0, "queries": 0, "max_queries": 0,
+                    "db_ms": 0.0, "total_ms": 0.0, "n_plus_one": {}
+                }
+            stats["requests"] += 1
+            stats["queries"] += trace.queries
+            stats["max_queries"] = max(stats["max_queries"], trace.queries)
+            stats["db_ms"] += trace.db_ms
+            stats["total_ms"] += elapsed_ms
+            new_shapes = {}
+            for shape, count in repeated.items():
+                seen = stats["n_plus_one"].get(shape)
+                if seen is None:
+                    new_shapes[shape] = count
+                    seen = stats["n_plus_one"][shape] = {"requests": 0, "max_repeats": 0}
+                seen["requests"] += 1
+                seen["max_repeats"] = max(seen["max_repeats"], count)
+        return new_shapes
+
+    @classmethod
+    def summary(cls, top: int = 20) -> dict:
+        with cls._lock:
+            routes = []
+            for route, stats in cls._routes.items():
+                requests = stats["requests"]
+                routes.append({
+                    "route": route,
+                    "requests": requests,
+                    "avg_queries": round(stats["queries"] / requests, 1),
+                    "max_queries": stats["max_queries"],
+                    "avg_db_ms": round(stats["db_ms"] / requests, 2),
+                    "avg_total_ms": round(stats["total_ms"] / requests, 2),
+                    "total_db_ms": round(stats["db_ms"], 1),
+                    "n_plus_one": [
+                        {"statement": shape[:500], **seen}
+                        for shape, seen in sorted(stats["n_plus_one"].items(), key=lambda i: -i[1]["max_repeats"])
+                    ],
+                })
+        return {
+            "n_plus_one_threshold": cls.n_plus_one_threshold,
+            "by_db_time": sorted(routes, key=lambda r: -r["total_db_ms"])[:top],
+            "n_plus_one": sorted(
+                (r for r in routes if r["n_plus_one"]), key=lambda r: -r["n_plus_one"][0]["max_repeats"]
+            )[:top],
+        }
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._routes.clear()
@@ -2,37 +2,89 @@ import os
 
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from .core.config import settings
+
 load_dotenv(override=True)
 
 # Use local PostgreSQL by default if env not set
 SQLALCHEMY_DATABASE_URL = os.getenv(
-    "DATABASE_URL", 
+    "DATABASE_URL",
     "sqlite:///./digifortlabs.db"
 )
 
 # DEBUG: Print the loaded URL (masking password)
 print(f"SQLAlchemy connecting to: {SQLALCHEMY_DATABASE_URL.split('@')[-1]}")
 
+IS_SQLITE = "sqlite" in SQLALCHEMY_DATABASE_URL
+
+
+def pool_limits(share: int):
+    """(pool_size, max_overflow) keeping half of `share` warm and the rest as overflow."""
+    pool_size = max(1, (share + 1) // 2)
+    return pool_size, max(0, share - pool_size)
+
+
+# Each worker gets an equal share of DB_MAX_CONNECTIONS (gunicorn runs 2N+1 of them),
+# half for the sync engine (writes, background tasks) and half for the async hot-read engine
+WORKER_CONNECTIONS = max(4, settings.DB_MAX_CONNECTIONS // max(1, settings.WEB_CONCURRENCY))
+ASYNC_CONNECTIONS = WORKER_CONNECTIONS // 2
+SYNC_CONNECTIONS = WORKER_CONNECTIONS - ASYNC_CONNECTIONS
+
+sync_pool_size, sync_max_overflow = pool_limits(SYNC_CONNECTIONS)
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
+    SQLALCHEMY_DATABASE_URL,
     connect_args={
-        "check_same_thread": False, 
+        "check_same_thread": False,
         "timeout": 15
-    } if "sqlite" in SQLALCHEMY_DATABASE_URL else {
+    } if IS_SQLITE else {
         "connect_timeout": 10,
         "options": "-c statement_timeout=10000" # 10 seconds query timeout
     },
     pool_pre_ping=True,
     pool_recycle=300,
-    pool_size=20,          # Increased to handle heavier concurrent OCR tasks
-    max_overflow=30,       # Bumped to 30 to prevent QueuePool limits
+    pool_size=sync_pool_size,
+    max_overflow=sync_max_overflow,
     pool_timeout=120,      # Let background OCR tasks queue for heavily loaded servers
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def async_database_url(url: str) -> str:
+    """Same database through an asyncio driver (asyncpg / aiosqlite)."""
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    url = "postgresql+asyncpg://" + url.split("://", 1)[1]
+    # asyncpg takes `ssl`, not libpq's `sslmode`
+    return url.replace("sslmode=", "ssl=")
+
+
+async_pool_size, async_max_overflow = pool_limits(ASYNC_CONNECTIONS)
+async_engine = create_async_engine(
+    async_database_url(SQLALCHEMY_DATABASE_URL),
+    connect_args={
+        "timeout": 15
+    } if IS_SQLITE else {
+        "timeout": 10,
+        "server_settings": {"statement_timeout": "10000"}
+    },
+    pool_pre_ping=True,
+    pool_recycle=300,
+    pool_size=async_pool_size,
+    max_overflow=async_max_overflow,
+    pool_timeout=30,
+)
+if settings.SQL_INSTRUMENTATION:
+    from .core.sql_instrumentation import QueryStats
+    QueryStats.n_plus_one_threshold = settings.N_PLUS_ONE_THRESHOLD
+    QueryStats.instrument(engine)
+    QueryStats.instrument(async_engine.sync_engine)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -41,3 +93,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    """Session for async read endpoints; no connection is checked out until the first query."""
+    async with AsyncSessionLocal() as db:
+        yield db
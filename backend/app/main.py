@@ -1,15 +1,12 @@
 from fastapi import FastAPI, HTTPException
 
 from .core.config import settings
-from .database import Base, engine
 from .routers import auth, hospitals, patients
 from .core.logging_config import setup_logging
 
 # Initialize Logging
 setup_logging()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
 
 # --- SECURITY CHECKS ---
 if settings.ENVIRONMENT == "production" and settings.IS_UNSAFE_SECRET_KEY:
@@ -22,183 +19,14 @@ if settings.ENVIRONMENT == "production" and settings.IS_UNSAFE_SECRET_KEY:
     # Based on user feedback: "make sure website should not crash or data both"
     # We will log a critical warning but allow the application to proceed.
 
-# --- AUTO MIGRATION (Fix for UndefinedColumn Errors) ---
-from sqlalchemy import text
-def run_migrations():
-    print("🐘 Running auto-migrations...")
-    try:
-        with engine.connect() as conn:
-            # 1. Add download_request_count to pdf_files
-            conn.execute(text("ALTER TABLE pdf_files ADD COLUMN IF NOT EXISTS download_request_count INTEGER DEFAULT 0"))
-            
-            # 2. Add missing columns to users
-            # full_name is NOT NULL, so we need a default for existing records
-            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name VARCHAR NOT NULL DEFAULT 'Legacy User'"))
-            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR"))
-            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT 0"))
-            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_login_at TIMESTAMP"))
-            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS previous_login_at TIMESTAMP"))
-            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS known_devices TEXT DEFAULT '[]'"))
-            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"))
-            
-            # Security Fix: Drop plain_password column if it exists
-            try:
-                conn.execute(text("ALTER TABLE users DROP COLUMN IF EXISTS plain_password"))
-            except Exception as drop_e:
-                print(f"Notice: Could not drop plain_password column (maybe it doesn't exist): {drop_e}")
-
-            # 3. Add Medical Fields to Patients
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS doctor_name VARCHAR"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS weight VARCHAR"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS diagnosis TEXT"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS operative_notes TEXT"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS mediclaim VARCHAR"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS medical_summary TEXT"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS remarks TEXT"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS mother_record_id INTEGER"))
-
-            # 5. Dental & Genericization
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS specialty VARCHAR DEFAULT 'General'"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS terminology JSON DEFAULT '{}'"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS enabled_modules JSON DEFAULT '[\"core\"]'"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS ai_settings JSON DEFAULT '{\"enabled\": false, \"api_key\": \"\"}'"))
-            
-            # Additional hospital columns
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS director_name VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS registration_number VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS established_year INTEGER"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS address VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS address_line2 VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS city VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS state VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pincode VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS country VARCHAR DEFAULT 'India'"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS phone VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS alternate_phone VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS secondary_email VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS landline VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS google_maps_url TEXT"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS price_per_file FLOAT DEFAULT 100.0"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS included_pages INTEGER DEFAULT 20"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS price_per_extra_page FLOAT DEFAULT 1.0"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS custom_pricing JSON DEFAULT '{}'"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pricing_effective_date TIMESTAMP"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pricing_notes TEXT"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS expected_monthly_volume INTEGER"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS expected_users INTEGER"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS storage_requirements VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS special_requirements TEXT"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS accept_marketing BOOLEAN DEFAULT false"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS max_users INTEGER DEFAULT 10"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS per_user_price FLOAT DEFAULT 500.0"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS registration_fee FLOAT DEFAULT 0.0"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS is_reg_fee_paid BOOLEAN DEFAULT true"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS gst_number VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS bank_name VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS bank_account_no VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS bank_ifsc VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pan_number VARCHAR"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"))
-            conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"))
-            conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS specialty_data JSON DEFAULT '{}'"))
-            
-            # 5b. Dental Patient Enhanced Fields
-            conn.execute(text("ALTER TABLE dental_patients ADD COLUMN IF NOT EXISTS clinical_data JSON DEFAULT '{}'"))
-            conn.execute(text("ALTER TABLE dental_patients ADD COLUMN IF NOT EXISTS habits JSON DEFAULT '{}'"))
-
-            # 6. Accounting Config Enhancements
-            conn.execute(text("ALTER TABLE accounting_config ADD COLUMN IF NOT EXISTS company_phone VARCHAR"))
-            conn.execute(text("ALTER TABLE accounting_config ADD COLUMN IF NOT EXISTS company_pan VARCHAR"))
-            conn.execute(text("ALTER TABLE accounting_config ADD COLUMN IF NOT EXISTS company_bank_branch VARCHAR"))
-
-            # 7. System Settings
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS system_settings (
-                    id SERIAL PRIMARY KEY,
-                    key VARCHAR UNIQUE NOT NULL,
-                    value TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """))
-
-            # 8. System Error Logs
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS system_error_logs (
-                    id SERIAL PRIMARY KEY,
-                    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    error_type VARCHAR NOT NULL,
-                    error_message TEXT NOT NULL,
-                    stack_trace TEXT,
-                    endpoint VARCHAR,
-                    user_id INTEGER REFERENCES users(user_id),
-                    method VARCHAR,
-                    status VARCHAR DEFAULT 'unresolved',
-                    notes TEXT
-                )
-            """))
-
-            # 9. MFA Login OTPs
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS login_otps (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES users(user_id) NOT NULL,
-                    device_id VARCHAR NOT NULL,
-                    otp_code VARCHAR NOT NULL,
-                    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            """))
-
-            # 10. User Trusted Devices (Skip MFA)
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS user_trusted_devices (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES users(user_id) NOT NULL,
-                    device_token_hash VARCHAR NOT NULL,
-                    device_name VARCHAR,
-                    last_used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            """))
-            
-            # Index for performance
-            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_trusted_device_token ON user_trusted_devices(device_token_hash)"))
-            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_trusted_device_user ON user_trusted_devices(user_id)"))
-
-            # 11. Dental Treatment Plans & Phases (fixes UndefinedColumn: phase_id)
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS dental_treatment_plans (
-                    plan_id SERIAL PRIMARY KEY,
-                    patient_id INTEGER REFERENCES dental_patients(patient_id) NOT NULL,
-                    name VARCHAR NOT NULL,
-                    status VARCHAR DEFAULT 'proposed',
-                    priority VARCHAR DEFAULT 'normal',
-                    estimated_cost FLOAT DEFAULT 0.0,
-                    notes TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            """))
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS dental_treatment_phases (
-                    phase_id SERIAL PRIMARY KEY,
-                    plan_id INTEGER REFERENCES dental_treatment_plans(plan_id) NOT NULL,
-                    name VARCHAR NOT NULL,
-                    phase_order INTEGER DEFAULT 1,
-                    status VARCHAR DEFAULT 'pending',
-                    estimated_duration_days INTEGER
-                )
-            """))
-            # Add phase_id to dental_treatments if not present
-            conn.execute(text("ALTER TABLE dental_treatments ADD COLUMN IF NOT EXISTS phase_id INTEGER REFERENCES dental_treatment_phases(phase_id)"))
-
-            conn.commit()
-            print("✅ Auto-migrations completed successfully.")
-    except Exception as e:
-        print(f"⚠️ Auto-migration skipped or failed: {e}")
+# --- SCHEMA ---
+# Migrations run once per deploy before workers start (python -m app.migrations);
+# workers only check the schema version here.
+from .migrations import ensure_schema
+ensure_schema()
 
-run_migrations()
+# Session listeners keeping denormalized storage counters in sync, whichever router changes them
+from .services import box_fill, occupancy, rack_slots, sequence_service  # noqa: F401
 
 from fastapi_csrf_protect import CsrfProtect
 from fastapi_csrf_protect.exceptions import CsrfProtectError
@@ -236,33 +64,31 @@ app = FastAPI(
     dependencies=[Depends(verify_csrf)]
 )
 
-import time
 from datetime import datetime
 app.state.startup_time = datetime.utcnow()
 app.state.total_requests = 0
 app.state.total_latency = 0.0
 
-@app.middleware("http")
-async def latency_middleware(request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    
-    # Update global stats
-    app.state.total_requests += 1
-    app.state.total_latency += process_time
-    
-    return response
-
 from fastapi.middleware.cors import CORSMiddleware
 
-from .middleware.bandwidth import BandwidthMiddleware
-from .middleware.security import RateLimitMiddleware, SecurityHeadersMiddleware
-
-# Add security middleware
-app.add_middleware(SecurityHeadersMiddleware)
-app.add_middleware(RateLimitMiddleware, requests_per_minute=300, auth_requests_per_minute=60)
-app.add_middleware(BandwidthMiddleware)
+from .middleware.bandwidth import BandwidthHook
+from .middleware.pipeline import LatencyHook, MiddlewarePipeline
+from .middleware.query_stats import QueryStatsHook
+from .middleware.security import RateLimitHook, SecurityHeadersHook
+
+# Request pipeline: one pure-ASGI middleware running ordered hooks.
+# on_request runs top to bottom (a hook may short-circuit with a response);
+# response hooks run bottom to top.
+pipeline_hooks = [
+    BandwidthHook(),
+    RateLimitHook(requests_per_minute=300, auth_requests_per_minute=60),
+    SecurityHeadersHook(),
+    LatencyHook(app.state),
+]
+if settings.SQL_INSTRUMENTATION:
+    # First, so the queries of the other hooks (quota lookups) are counted too
+    pipeline_hooks.insert(0, QueryStatsHook(server_timing=settings.ENVIRONMENT != "production"))
+app.add_middleware(MiddlewarePipeline, hooks=pipeline_hooks)
 
 # IMPORTANT: CORS must be added LAST to be the outermost middleware 
 # and handle preflight requests before security headers or rate limits.
@@ -297,6 +123,7 @@ app.add_middleware(
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError, ResponseValidationError
+from starlette.concurrency import run_in_threadpool
 
 @app.exception_handler(CsrfProtectError)
 async def csrf_protect_exception_handler(request: Request, exc: CsrfProtectError):
@@ -311,7 +138,7 @@ async def global_exception_handler(request: Request, exc: Exception):
     traceback.print_exc()
     
     # Try to log to System Error Log DB
-    try:
+    def write_error_log():
         from .database import SessionLocal
         from .models import SystemErrorLog
         db = SessionLocal()
@@ -326,7 +153,10 @@ async def global_exception_handler(request: Request, exc: Exception):
         db.add(err_log)
         db.commit()
         db.close()
-        
+
+    try:
+        # Blocking DB write: keep it off the event loop
+        await run_in_threadpool(write_error_log)
     except Exception as dbe:
         print(f"⚠️ Failed to write to system_error_logs: {dbe}")
     except Exception as e:
@@ -457,33 +287,19 @@ app.mount("/local_storage", StaticFiles(directory=local_path), name="local_stora
 
 @app.on_event("startup")
 async def startup_event():
-    # Start periodic background tasks
-    import asyncio
-    from .services.storage_service import StorageService
-    from .database import SessionLocal
-
-    async def retention_cleanup_loop():
-        loop = asyncio.get_event_loop()
-        def run_cleanup_task():
-            try:
-                db = SessionLocal()
-                from .services.cleanup_service import CleanupService
-                CleanupService.run_retention_policy(db)
-                db.close()
-            except Exception as e:
-                print(f"Retention Cleanup Error: {e}")
-
-        while True:
-            try:
-                # Run every 24 hours
-                await loop.run_in_executor(None, run_cleanup_task)
-            except Exception as e:
-                print(f"Retention Cleanup Loop Error: {e}")
-            
-            await asyncio.sleep(86400) # 24 hours
-
-
-    asyncio.create_task(retention_cleanup_loop())
+    # Periodic jobs: every worker polls, but each due job runs in only one of them
+    if settings.SCHEDULER_ENABLED:
+        import asyncio
+        from .services.scheduler import Scheduler, register_default_jobs
+        register_default_jobs()
+        app.state.scheduler_task = asyncio.create_task(Scheduler.loop())
+
+    # Report async endpoints that stall the event loop (see /platform/loop-blocks)
+    if settings.LOOP_BLOCK_THRESHOLD_MS > 0:
+        from .core.loop_monitor import LoopBlockMonitor
+        app.state.loop_monitor = LoopBlockMonitor(threshold_ms=settings.LOOP_BLOCK_THRESHOLD_MS)
+        app.state.loop_monitor.register_routes(app)
+        app.state.loop_monitor.start()
 
 @app.get("/")
 def read_root():
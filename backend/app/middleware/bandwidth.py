@@ -1,81 +1,47 @@
-from datetime import datetime
-
-from sqlalchemy.orm import Session
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse
 
-from jose import jwt, JWTError
-from ..database import SessionLocal
-from ..models import BandwidthUsage
-from ..core.config import settings
+from ..services.bandwidth_meter import BandwidthMeter, MB
+from .pipeline import MiddlewareHook, RequestContext
 
-class BandwidthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Only track download/upload endpoints
-        if request.method not in ["POST", "GET"] or "patients" not in request.url.path:
-             return await call_next(request)
 
-        # Extract hospital_id strictly from the authenticated JWT token to prevent spoofing.
-        hospital_id = None
-        token = request.cookies.get("access_token") or request.headers.get("Authorization")
-        if token:
-            token = token.replace("Bearer ", "")
-            try:
-                payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-                hospital_id = payload.get("hospital_id")
-            except JWTError:
-                pass
+class BandwidthHook(MiddlewareHook):
+    """
+    Meters request and response bytes per hospital on patient endpoints and enforces the
+    monthly quota. Bytes are counted by the pipeline's send/receive wrappers, so streamed
+    bodies (file downloads) are included; accounting is write-behind through BandwidthMeter
+    (no DB work on the request path except a cached quota lookup).
+    """
 
+    async def on_request(self, ctx: RequestContext):
+        # Only track download/upload endpoints
+        if ctx.method not in ["POST", "GET"] or "patients" not in ctx.path:
+            return None
+
+        # hospital_id strictly from the authenticated JWT token to prevent spoofing.
+        hospital_id = (ctx.claims or {}).get("hospital_id")
         if not hospital_id:
             # Skip tracking if no authenticated hospital context
-            return await call_next(request)
-
-        # Calculate Request Size (Approximate)
-        content_length = request.headers.get('content-length')
-        size_mb = int(content_length) / (1024 * 1024) if content_length else 0.0
+            return None
 
-        # Check Quota
-        db: Session = SessionLocal()
+        # Check Quota (declared upload size against cached usage)
+        content_length = ctx.request.headers.get('content-length')
+        size_mb = int(content_length) / MB if content_length and content_length.isdigit() else 0.0
         try:
-            current_month = datetime.now().strftime("%Y-%m")
-            usage_record = db.query(BandwidthUsage).filter(
-                BandwidthUsage.hospital_id == hospital_id,
-                BandwidthUsage.month_year == current_month
-            ).first()
-
-            if not usage_record:
-                # Create if new month
-                usage_record = BandwidthUsage(
-                    hospital_id=hospital_id,
-                    month_year=current_month,
-                    used_mb=0.0,
-                    quota_limit_mb=1000.0 # 1GB Hard Limit
-                )
-                db.add(usage_record)
-            
-            # Check Limit
-            if usage_record.used_mb + size_mb > usage_record.quota_limit_mb:
+            usage = BandwidthMeter.cached_usage(hospital_id) or await run_in_threadpool(BandwidthMeter.load_usage, hospital_id)
+            used_mb, quota_mb = usage
+            if used_mb + size_mb > quota_mb:
                 return JSONResponse(
                     status_code=429,
                     content={"detail": "Monthly bandwidth quota exceeded (1GB Limit)."}
                 )
-
-            # Process Request
-            response = await call_next(request)
-            
-            # Post-processing: Add response size to usage
-            # (Note: Streaming responses are harder to measure)
-            response_length = response.headers.get('content-length')
-            if response_length:
-                 size_mb += int(response_length) / (1024 * 1024)
-            
-            usage_record.used_mb += size_mb
-            db.commit()
-            
-            return response
         except Exception as e:
             print(f"Bandwidth Middleware Error: {e}")
-            return await call_next(request)
-        finally:
-            db.close()
+
+        ctx.state["bandwidth_hospital_id"] = hospital_id
+        return None
+
+    async def on_complete(self, ctx: RequestContext):
+        hospital_id = ctx.state.get("bandwidth_hospital_id")
+        if hospital_id:
+            BandwidthMeter.record(hospital_id, ctx.bytes_in + ctx.bytes_out)
@@ -0,0 +1,132 @@
+"""
+Single pure-ASGI middleware with ordered hooks.
+
+Replaces a stack of BaseHTTPMiddleware layers (each of which spawns a task and pipes the
+response through a memory stream) with one wrapper around send/receive. Streaming
+responses and background tasks pass straight through.
+"""
+import time
+from typing import List, Optional
+
+from jose import jwt, JWTError
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+from ..core.config import settings
+
+
+class RequestContext:
+    """Per-request state shared by all hooks."""
+
+    __slots__ = ("scope", "started_at", "status_code", "bytes_in", "bytes_out", "state", "_request", "_claims")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.started_at = time.perf_counter()
+        self.status_code: Optional[int] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.state = {}
+        self._request = None
+        self._claims = False
+
+    @property
+    def request(self) -> Request:
+        if self._request is None:
+            self._request = Request(self.scope)
+        return self._request
+
+    @property
+    def path(self) -> str:
+        return self.scope["path"]
+
+    @property
+    def method(self) -> str:
+        return self.scope["method"]
+
+    @property
+    def claims(self) -> Optional[dict]:
+        """Access-token payload (signature verified, no DB lookup), decoded once per request."""
+        if self._claims is False:
+            self._claims = None
+            token = self.request.cookies.get("access_token") or self.request.headers.get("Authorization")
+            if token:
+                try:
+                    self._claims = jwt.decode(
+                        token.replace("Bearer ", ""), settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
+                    )
+                except JWTError:
+                    pass
+        return self._claims
+
+
+class MiddlewareHook:
+    """
+    Override any of these. Hooks run in list order for `on_request` (the first one
+    returning a Response short-circuits the request) and in reverse order for
+    `on_response_start` / `on_complete`, like a conventional middleware stack.
+    """
+
+    async def on_request(self, ctx: RequestContext) -> Optional[Response]:
+        return None
+
+    def on_response_start(self, ctx: RequestContext, headers: MutableHeaders):
+        pass
+
+    async def on_complete(self, ctx: RequestContext):
+        pass
+
+
+class MiddlewarePipeline:
+    def __init__(self, app, hooks: List[MiddlewareHook]):
+        self.app = app
+        self.hooks = list(hooks)
+        self.reversed_hooks = list(reversed(self.hooks))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        ctx = RequestContext(scope)
+
+        async def hooked_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                ctx.bytes_in += len(message.get("body", b""))
+            return message
+
+        async def hooked_send(message):
+            if message["type"] == "http.response.start":
+                ctx.status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                for hook in self.reversed_hooks:
+                    hook.on_response_start(ctx, headers)
+            elif message["type"] == "http.response.body":
+                ctx.bytes_out += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            for hook in self.hooks:
+                response = await hook.on_request(ctx)
+                if response is not None:
+                    return await response(scope, hooked_receive, hooked_send)
+            await self.app(scope, hooked_receive, hooked_send)
+        finally:
+            for hook in self.reversed_hooks:
+                try:
+                    await hook.on_complete(ctx)
+                except Exception as e:
+                    print(f"Middleware hook error ({type(hook).__name__}): {e}")
+
+
+class LatencyHook(MiddlewareHook):
+    """Request count / cumulative latency on app.state (shown on the platform dashboard)."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def on_response_start(self, ctx: RequestContext, headers: MutableHeaders):
+        # Time to response headers, not including a streamed body
+        self.state.total_requests += 1
+        self.state.total_latency += time.perf_counter() - ctx.started_at
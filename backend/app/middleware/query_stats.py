@@ -0,0 +1,59 @@
+import re
+import time
+
+from starlette.datastructures import MutableHeaders
+
+from ..core.sql_instrumentation import QueryStats
+from .pipeline import MiddlewareHook, RequestContext
+
+
+_PARAM = re.compile(r"{(\w+)(?::\w+)?}")
+
+
+def route_template(scope) -> str:
+    """
+    "/patients/{patient_id}" for "/patients/12". The matched route's own path may lack the
+    prefix of the router it was included from, so the prefix is taken from the request path.
+    """
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    params = scope.get("path_params", {})
+    rendered = _PARAM.sub(lambda m: str(params.get(m.group(1), m.group(0))), route.path)
+    path = scope["path"]
+    prefix = path[:-len(rendered)] if rendered and path.endswith(rendered) else ""
+    return prefix + route.path
+
+
+class QueryStatsHook(MiddlewareHook):
+    """
+    Per-request query count / DB time (see core/sql_instrumentation.py), aggregated per
+    route for /platform/perf. Outside production the numbers are also sent as a
+    `Server-Timing` header, so they show up in the browser's network panel.
+    """
+
+    def __init__(self, server_timing: bool = True):
+        self.server_timing = server_timing
+
+    async def on_request(self, ctx: RequestContext):
+        ctx.state["sql"] = QueryStats.begin()
+
+    def on_response_start(self, ctx: RequestContext, headers: MutableHeaders):
+        trace = ctx.state.get("sql")
+        if self.server_timing and trace is not None:
+            elapsed_ms = (time.perf_counter() - ctx.started_at) * 1000
+            headers.append(
+                "Server-Timing",
+                f'db;dur={trace.db_ms:.1f};desc="{trace.queries} queries", app;dur={elapsed_ms:.1f}'
+            )
+
+    async def on_complete(self, ctx: RequestContext):
+        trace = ctx.state.get("sql")
+        if trace is None:
+            return
+        key = f"{ctx.method} {route_template(ctx.scope)}"
+        elapsed_ms = (time.perf_counter() - ctx.started_at) * 1000
+        for shape, count in QueryStats.record(key, trace, elapsed_ms).items():
+            # Printed the first time a route shows this pattern; counts keep going to /platform/perf
+            print(f"🔁 N+1 suspected on {key}: {count}x {shape[:200]}")
+
@@ -1,88 +1,189 @@
 """
-Security middleware for rate limiting and security headers.
+Security hooks for rate limiting and security headers (run by middleware/pipeline.py).
 """
-from fastapi import Request, HTTPException
-from fastapi.responses import Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from collections import defaultdict
-from datetime import datetime, timedelta
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import math
 import time
 from ..core.config import settings
+from .pipeline import MiddlewareHook, RequestContext
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+class RateLimitRule(NamedTuple):
     """
-    Rate limiting middleware to prevent brute force attacks.
-    Limits requests per IP address per time window.
+    One limit: `limit` requests per `window` seconds for each key of `scope`
+    ("ip", "user" or "tenant"), applied to paths starting with one of `paths` (None = all).
+    """
+    name: str
+    scope: str
+    limit: int
+    window: int = 60
+    paths: Optional[Tuple[str, ...]] = None
+
+
+class LocalRateLimitStore:
+    """
+    Per-process sliding-window counters: two fixed-window counts per key, so a hit is O(1).
+    Keys idle for two windows are evicted by a periodic sweep.
+    """
+
+    def __init__(self, sweep_interval: int = 60):
+        self.counters: Dict[str, list] = {}  # key -> [window_index, previous_count, current_count, window]
+        self.sweep_interval = sweep_interval
+        self.next_sweep = time.time() + sweep_interval
+
+    async def hit(self, key: str, limit: int, window: int, now: float) -> bool:
+        index = int(now // window)
+        counter = self.counters.get(key)
+        if counter is None or counter[0] < index - 1:
+            counter = [index, 0, 0, window]
+        elif counter[0] == index - 1:
+            counter = [index, counter[2], 0, window]
+        self.counters[key] = counter
+
+        weight = 1 - (now % window) / window
+        if counter[1] * weight + counter[2] >= limit:
+            return False
+        counter[2] += 1
+
+        if now >= self.next_sweep:
+            self.evict_idle(now)
+        return True
+
+    def evict_idle(self, now: float):
+        self.counters = {
+            key: c for key, c in self.counters.items() if c[0] >= int(now // c[3]) - 1
+        }
+        self.next_sweep = now + self.sweep_interval
+
+
+class RedisRateLimitStore:
+    """
+    Sliding-window counters shared by every worker. Check-and-increment is one Lua
+    script (atomic, one round trip); counters expire on their own, so idle keys vanish.
+    """
+
+    SCRIPT = """
+    local prev = tonumber(redis.call('GET', KEYS[2]) or '0')
+    local curr = tonumber(redis.call('GET', KEYS[1]) or '0')
+    if prev * tonumber(ARGV[2]) + curr >= tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis_asyncio
+
+        self.client = redis_asyncio.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: int, now: float) -> bool:
+        index = int(now // window)
+        weight = 1 - (now % window) / window
+        # Hash tag keeps both windows of a key on the same cluster slot
+        keys = [f"rl:{{{key}}}:{index}", f"rl:{{{key}}}:{index - 1}"]
+        return bool(await self.script(keys=keys, args=[limit, weight, window * 2]))
+
+
+class RateLimitHook(MiddlewareHook):
+    """
+    Rate limiting hook to prevent brute force attacks and noisy tenants.
+    Limits per IP (auth endpoints), per user and per tenant (hospital), taken from the JWT
+    without touching the database. Counters live in Redis so the limit holds across all
+    gunicorn workers; without Redis each worker enforces its share of the limit locally.
     """
     
-    def __init__(self, app, requests_per_minute: int = 60, auth_requests_per_minute: int = 5):
-        super().__init__(app)
-        self.requests_per_minute = requests_per_minute
-        self.auth_requests_per_minute = auth_requests_per_minute
-        self.request_counts = defaultdict(list)
-        self.auth_paths = ["/auth/token", "/auth/login", "/auth/verify-otp", "/auth/forgot-password", "/auth/request-password-reset"]
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        auth_requests_per_minute: int = 5,
+        tenant_requests_per_minute: Optional[int] = None,
+        rules: Optional[List[RateLimitRule]] = None,
+        backend: Optional[str] = None,
+    ):
+        self.auth_paths = ("/auth/token", "/auth/login", "/auth/verify-otp", "/auth/forgot-password", "/auth/request-password-reset")
+        self.rules = rules or [
+            RateLimitRule("auth", "ip", auth_requests_per_minute, paths=self.auth_paths),
+            RateLimitRule("user", "user", requests_per_minute),
+            RateLimitRule("tenant", "tenant", tenant_requests_per_minute or requests_per_minute * 10),
+        ]
+        self.local_store = LocalRateLimitStore()
+        self.redis_store = None
+        self.redis_retry_at = 0.0
+
+        backend = backend or settings.RATE_LIMIT_BACKEND
+        if backend in ("redis", "auto"):
+            try:
+                self.redis_store = RedisRateLimitStore(settings.REDIS_URL)
+            except Exception as e:
+                print(f"⚠️ Rate limiter: Redis unavailable ({e}), using per-worker limits")
+
+    async def hit(self, key: str, limit: int, window: int, now: float) -> bool:
+        if self.redis_store and now >= self.redis_retry_at:
+            try:
+                return await self.redis_store.hit(key, limit, window, now)
+            except Exception as e:
+                # Fail over to local counters, retry Redis in 30s
+                print(f"⚠️ Rate limiter: Redis error ({e}), using per-worker limits for 30s")
+                self.redis_retry_at = now + 30
+        # Each worker only enforces its share so the total stays close to the limit
+        local_limit = max(1, math.ceil(limit / max(1, settings.WEB_CONCURRENCY)))
+        return await self.local_store.hit(key, local_limit, window, now)
     
-    async def dispatch(self, request: Request, call_next):
+    async def on_request(self, ctx: RequestContext):
         # Skip rate limiting for preflight requests
-        if request.method == "OPTIONS":
-            return await call_next(request)
+        if ctx.method == "OPTIONS":
+            return None
             
-        client_ip = request.client.host
-            
-        path = request.url.path
-        current_time = time.time()
-        
-        # Determine rate limit based on path
-        is_auth_endpoint = any(path.startswith(auth_path) for auth_path in self.auth_paths)
-        limit = self.auth_requests_per_minute if is_auth_endpoint else self.requests_per_minute
-        window = 60  # 1 minute window
-        
-        # Clean old requests
-        self.request_counts[client_ip] = [
-            req_time for req_time in self.request_counts[client_ip]
-            if current_time - req_time < window
-        ]
-        
-        # Check rate limit
-        if len(self.request_counts[client_ip]) >= limit:
-            raise HTTPException(
-                status_code=429,
-                detail=f"Rate limit exceeded. Maximum {limit} requests per minute."
-            )
-        
-        # Record this request
-        self.request_counts[client_ip].append(current_time)
-        
-        response = await call_next(request)
-        return response
+        path = ctx.path
+        now = time.time()
+        client = ctx.scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        claims = ctx.claims or {}
+        user, tenant = claims.get("sub"), claims.get("hospital_id")
+        scopes = {"ip": client_ip, "user": f"u:{user}" if user else f"ip:{client_ip}", "tenant": str(tenant) if tenant else None}
 
+        for rule in self.rules:
+            if rule.paths and not path.startswith(rule.paths):
+                continue
+            scope_key = scopes.get(rule.scope)
+            if not scope_key:
+                continue
+            if not await self.hit(f"{rule.name}:{scope_key}", rule.limit, rule.window, now):
+                return JSONResponse(
+                    status_code=429,
+                    content={"detail": f"Rate limit exceeded. Maximum {rule.limit} requests per minute."},
+                    headers={"Retry-After": str(math.ceil(rule.window - now % rule.window))}
+                )
+        return None
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+
+class SecurityHeadersHook(MiddlewareHook):
     """
     Adds security headers to all responses.
     """
+
+    # Content Security Policy (Relaxed for production stabilization)
+    CSP = (
+        "default-src * 'unsafe-inline' 'unsafe-eval' data: blob:; "
+        "connect-src * 'unsafe-inline'; "
+        "frame-ancestors 'none';"
+    )
     
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        
+    def on_response_start(self, ctx: RequestContext, headers: MutableHeaders):
         # Security Headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
+        headers["X-Content-Type-Options"] = "nosniff"
+        headers["X-Frame-Options"] = "DENY"
+        headers["X-XSS-Protection"] = "1; mode=block"
+        headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+        headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
         
         # HSTS (HTTP Strict Transport Security) - only in production with HTTPS
-        if request.url.scheme == "https":
-            response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        
-        # Content Security Policy (Relaxed for production stabilization)
-        csp = (
-            "default-src * 'unsafe-inline' 'unsafe-eval' data: blob:; "
-            "connect-src * 'unsafe-inline'; "
-            "frame-ancestors 'none';"
-        )
-        response.headers["Content-Security-Policy"] = csp
+        if ctx.scope.get("scheme") == "https":
+            headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
         
-        return response
+        headers["Content-Security-Policy"] = self.CSP
@@ -0,0 +1,360 @@
+"""
+Versioned schema migrations.
+
+Run once per deploy, before any worker starts (start_prod.sh; a failure exits non-zero):
+
+    python -m app.migrations
+
+Each version runs in its own transaction and is recorded in `schema_version`; a Postgres
+advisory lock keeps concurrent runs from interleaving. Workers only compare versions at
+boot (one query) instead of replaying every ALTER TABLE.
+
+To change the schema: add the column/table to models.py, then append a new version here
+(use IF NOT EXISTS: databases created by create_all already have the new objects). New
+tables are created by create_all, but still need a version so workers notice the change.
+"""
+import sys
+
+from sqlalchemy import func, insert, select, text
+
+from .core.config import settings
+from .database import Base, engine
+from .models import SchemaVersion
+
+# pg_advisory_lock key for migration runs
+LOCK_KEY = 7_340_021
+
+
+def _v1_baseline(conn):
+    # 1. Add download_request_count to pdf_files
+    conn.execute(text("ALTER TABLE pdf_files ADD COLUMN IF NOT EXISTS download_request_count INTEGER DEFAULT 0"))
+
+    # 2. Add missing columns to users
+    # full_name is NOT NULL, so we need a default for existing records
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name VARCHAR NOT NULL DEFAULT 'Legacy User'"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT 0"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_login_at TIMESTAMP"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS previous_login_at TIMESTAMP"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS known_devices TEXT DEFAULT '[]'"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"))
+
+    # Security Fix: Drop plain_password column if it exists
+    try:
+        conn.execute(text("ALTER TABLE users DROP COLUMN IF EXISTS plain_password"))
+    except Exception as drop_e:
+        print(f"Notice: Could not drop plain_password column (maybe it doesn't exist): {drop_e}")
+
+    # 3. Add Medical Fields to Patients
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS doctor_name VARCHAR"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS weight VARCHAR"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS diagnosis TEXT"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS operative_notes TEXT"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS mediclaim VARCHAR"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS medical_summary TEXT"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS remarks TEXT"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS mother_record_id INTEGER"))
+
+    # 5. Dental & Genericization
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS specialty VARCHAR DEFAULT 'General'"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS terminology JSON DEFAULT '{}'"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS enabled_modules JSON DEFAULT '[\"core\"]'"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS ai_settings JSON DEFAULT '{\"enabled\": false, \"api_key\": \"\"}'"))
+
+    # Additional hospital columns
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS director_name VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS registration_number VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS established_year INTEGER"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS address VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS address_line2 VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS city VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS state VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pincode VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS country VARCHAR DEFAULT 'India'"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS phone VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS alternate_phone VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS secondary_email VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS landline VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS google_maps_url TEXT"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS price_per_file FLOAT DEFAULT 100.0"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS included_pages INTEGER DEFAULT 20"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS price_per_extra_page FLOAT DEFAULT 1.0"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS custom_pricing JSON DEFAULT '{}'"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pricing_effective_date TIMESTAMP"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pricing_notes TEXT"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS expected_monthly_volume INTEGER"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS expected_users INTEGER"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS storage_requirements VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS special_requirements TEXT"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS accept_marketing BOOLEAN DEFAULT false"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS max_users INTEGER DEFAULT 10"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS per_user_price FLOAT DEFAULT 500.0"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS registration_fee FLOAT DEFAULT 0.0"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS is_reg_fee_paid BOOLEAN DEFAULT true"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS gst_number VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS bank_name VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS bank_account_no VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS bank_ifsc VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS pan_number VARCHAR"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"))
+    conn.execute(text("ALTER TABLE hospitals ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"))
+    conn.execute(text("ALTER TABLE patients ADD COLUMN IF NOT EXISTS specialty_data JSON DEFAULT '{}'"))
+
+    # 5b. Dental Patient Enhanced Fields
+    conn.execute(text("ALTER TABLE dental_patients ADD COLUMN IF NOT EXISTS clinical_data JSON DEFAULT '{}'"))
+    conn.execute(text("ALTER TABLE dental_patients ADD COLUMN IF NOT EXISTS habits JSON DEFAULT '{}'"))
+
+    # 6. Accounting Config Enhancements
+    conn.execute(text("ALTER TABLE accounting_config ADD COLUMN IF NOT EXISTS company_phone VARCHAR"))
+    conn.execute(text("ALTER TABLE accounting_config ADD COLUMN IF NOT EXISTS company_pan VARCHAR"))
+    conn.execute(text("ALTER TABLE accounting_config ADD COLUMN IF NOT EXISTS company_bank_branch VARCHAR"))
+
+    # 7. System Settings
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS system_settings (
+            id SERIAL PRIMARY KEY,
+            key VARCHAR UNIQUE NOT NULL,
+            value TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+    # 8. System Error Logs
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS system_error_logs (
+            id SERIAL PRIMARY KEY,
+            timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            error_type VARCHAR NOT NULL,
+            error_message TEXT NOT NULL,
+            stack_trace TEXT,
+            endpoint VARCHAR,
+            user_id INTEGER REFERENCES users(user_id),
+            method VARCHAR,
+            status VARCHAR DEFAULT 'unresolved',
+            notes TEXT
+        )
+    """))
+
+    # 9. MFA Login OTPs
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS login_otps (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id) NOT NULL,
+            device_id VARCHAR NOT NULL,
+            otp_code VARCHAR NOT NULL,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+    # 10. User Trusted Devices (Skip MFA)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_trusted_devices (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id) NOT NULL,
+            device_token_hash VARCHAR NOT NULL,
+            device_name VARCHAR,
+            last_used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+    # Index for performance
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_trusted_device_token ON user_trusted_devices(device_token_hash)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_trusted_device_user ON user_trusted_devices(user_id)"))
+
+    # 11. Dental Treatment Plans & Phases (fixes UndefinedColumn: phase_id)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dental_treatment_plans (
+            plan_id SERIAL PRIMARY KEY,
+            patient_id INTEGER REFERENCES dental_patients(patient_id) NOT NULL,
+            name VARCHAR NOT NULL,
+            status VARCHAR DEFAULT 'proposed',
+            priority VARCHAR DEFAULT 'normal',
+            estimated_cost FLOAT DEFAULT 0.0,
+            notes TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dental_treatment_phases (
+            phase_id SERIAL PRIMARY KEY,
+            plan_id INTEGER REFERENCES dental_treatment_plans(plan_id) NOT NULL,
+            name VARCHAR NOT NULL,
+            phase_order INTEGER DEFAULT 1,
+            status VARCHAR DEFAULT 'pending',
+            estimated_duration_days INTEGER
+        )
+    """))
+    # Add phase_id to dental_treatments if not present
+    conn.execute(text("ALTER TABLE dental_treatments ADD COLUMN IF NOT EXISTS phase_id INTEGER REFERENCES dental_treatment_phases(phase_id)"))
+
+
+def _v2_file_billing_state(conn):
+    # 12. File Billing State (replaces NOT IN invoice_items scans)
+    conn.execute(text("ALTER TABLE pdf_files ADD COLUMN IF NOT EXISTS hospital_id INTEGER REFERENCES hospitals(hospital_id)"))
+    conn.execute(text("ALTER TABLE pdf_files ADD COLUMN IF NOT EXISTS billing_status VARCHAR DEFAULT 'UNBILLED'"))
+    conn.execute(text("ALTER TABLE pdf_files ADD COLUMN IF NOT EXISTS invoice_id INTEGER REFERENCES invoices(invoice_id)"))
+    # Backfill (idempotent: only touches rows that are still missing state)
+    conn.execute(text("""
+        UPDATE pdf_files SET hospital_id = patients.hospital_id
+        FROM patients WHERE patients.record_id = pdf_files.record_id AND pdf_files.hospital_id IS NULL
+    """))
+    conn.execute(text("""
+        UPDATE pdf_files SET billing_status = 'INVOICED', invoice_id = invoice_items.invoice_id
+        FROM invoice_items WHERE invoice_items.file_id = pdf_files.file_id AND pdf_files.invoice_id IS NULL
+    """))
+    conn.execute(text("UPDATE pdf_files SET billing_status = 'PAID' WHERE is_paid = true AND billing_status <> 'PAID'"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_pdf_files_unbilled ON pdf_files(hospital_id, upload_date)
+        WHERE billing_status = 'UNBILLED' AND upload_status = 'confirmed'
+    """))
+
+
+def _v3_ledger_party_index(conn):
+    # 13. Ledger statements (balance snapshots table is created by create_all)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_accounting_txn_party_date ON accounting_transactions(party_type, party_id, date)"))
+
+
+def _v4_email_lower_index(conn):
+    # 14. Case-insensitive email lookups (auth)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_users_email_lower ON users (lower(email))"))
+
+
+def _v5_scheduled_jobs(conn):
+    # New table only: created by create_all in `migrate`
+    pass
+
+
+def _v6_rack_slot_index(conn):
+    # Racks rebuild their bitmap on first use (see services/rack_slots.py)
+    conn.execute(text("ALTER TABLE physical_racks ADD COLUMN IF NOT EXISTS slot_bitmap BYTEA"))
+    conn.execute(text("ALTER TABLE physical_racks ADD COLUMN IF NOT EXISTS free_slots INTEGER"))
+
+
+def _v7_box_fill_counts(conn):
+    conn.execute(text("ALTER TABLE physical_boxes ADD COLUMN IF NOT EXISTS current_count INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text("""
+        UPDATE physical_boxes SET current_count = (
+            SELECT COUNT(*) FROM patients WHERE patients.physical_box_id = physical_boxes.box_id
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_physical_boxes_fill ON physical_boxes (hospital_id, status, category, current_count)"))
+
+
+def _v8_sequence_counters(conn):
+    # New table only; counters seed themselves from existing identifiers on first use
+    # (see services/sequence_service.py)
+    pass
+
+
+def _v9_scan_batches(conn):
+    conn.execute(text("ALTER TABLE physical_movement_logs ADD COLUMN IF NOT EXISTS device_id VARCHAR"))
+    conn.execute(text("ALTER TABLE physical_movement_logs ADD COLUMN IF NOT EXISTS batch_id VARCHAR"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_physical_movement_logs_batch_id ON physical_movement_logs (batch_id)"))
+
+
+def _v10_retention_runs(conn):
+    # New table only: created by create_all in `migrate`
+    pass
+
+
+def _v11_storage_tiering(conn):
+    # file_access_events is created by create_all in `migrate`
+    conn.execute(text("ALTER TABLE pdf_files ADD COLUMN IF NOT EXISTS storage_class VARCHAR"))
+    conn.execute(text("ALTER TABLE pdf_files ADD COLUMN IF NOT EXISTS storage_class_changed_at TIMESTAMP WITH TIME ZONE"))
+
+
+def _v12_pending_restores(conn):
+    # New table only: created by create_all in `migrate`
+    pass
+
+
+MIGRATIONS = [
+    # (version, description, apply(conn)); Postgres DDL - see `migrate` for other dialects
+    (1, "Columns and tables added before versioned migrations", _v1_baseline),
+    (2, "File billing state on pdf_files", _v2_file_billing_state),
+    (3, "Ledger party/date index", _v3_ledger_party_index),
+    (4, "Case-insensitive email index", _v4_email_lower_index),
+    (5, "Scheduled job leases", _v5_scheduled_jobs),
+    (6, "Rack slot occupancy index", _v6_rack_slot_index),
+    (7, "Box fill counters", _v7_box_fill_counts),
+    (8, "Identifier sequence counters", _v8_sequence_counters),
+    (9, "Scan batch columns on movement logs", _v9_scan_batches),
+    (10, "Retention run checkpoints", _v10_retention_runs),
+    (11, "Storage classes and file access events", _v11_storage_tiering),
+    (12, "Pending archive restores", _v12_pending_restores),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(bind=None) -> int:
+    """Applied schema version (0 if never migrated)."""
+    try:
+        with (bind or engine).connect() as conn:
+            return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+    except Exception:
+        return 0
+
+
+def migrate(bind=None) -> int:
+    """Create missing tables and apply pending versions. Returns the resulting version."""
+    bind = bind or engine
+    is_postgres = bind.dialect.name == "postgresql"
+
+    with bind.connect() as conn:
+        if is_postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+            conn.commit()
+        try:
+            Base.metadata.create_all(bind=conn)
+            conn.commit()
+
+            version = conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+            for number, description, apply in MIGRATIONS:
+                if number <= version:
+                    continue
+                if is_postgres:
+                    apply(conn)
+                # Other dialects (local SQLite): the ALTERs are Postgres syntax and
+                # create_all above already built the current schema, so just record them
+                conn.execute(insert(SchemaVersion).values(version=number, description=description))
+                conn.commit()
+                print(f"🐘 Applied migration {number}: {description}")
+                version = number
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if is_postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+                conn.commit()
+    return version
+
+
+def ensure_schema():
+    """
+    Worker boot check. Outside production a stale schema is migrated in place (local
+    `uvicorn --reload` has no pre-start step); in production it is only reported.
+    """
+    version = current_version()
+    if version >= LATEST_VERSION:
+        return
+    if settings.ENVIRONMENT != "production":
+        try:
+            migrate()
+        except Exception as e:
+            print(f"⚠️ Auto-migration skipped or failed: {e}")
+        return
+    print(f"⚠️ Database schema is at version {version}, this build expects {LATEST_VERSION}. "
+          f"Run `python -m app.migrations` before starting workers.")
+
+
+if __name__ == "__main__":
+    try:
+        print(f"✅ Schema at version {migrate()} (latest {LATEST_VERSION}).")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
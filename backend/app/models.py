@@ -6,12 +6,17 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     JSON,
+    LargeBinary,
     String,
     Text,
     UniqueConstraint,
+    case,
+    text,
 )
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -172,6 +177,11 @@ class User(Base):
     audit_logs = relationship("AuditLog", back_populates="user")
     qa_entries = relationship("QAEntry", back_populates="reviewer")
 
+    __table_args__ = (
+        # get_current_user / login match on lower(email)
+        Index("idx_users_email_lower", func.lower(email)),
+    )
+
 class Patient(Base):
     __tablename__ = "patients"
 
@@ -271,6 +281,11 @@ class PDFFile(Base):
     
     is_paid = Column(Boolean, default=False) # Link to invoicing
     
+    # Billing state (maintained by generate/delete invoice and receive-payment)
+    hospital_id = Column(Integer, ForeignKey("hospitals.hospital_id"), nullable=True) # Denormalized from patient
+    billing_status = Column(String, default="UNBILLED") # UNBILLED, INVOICED, PAID
+    invoice_id = Column(Integer, ForeignKey("invoices.invoice_id"), nullable=True)
+    
     # Tracking
     upload_date = Column(DateTime(timezone=True), server_default=func.now())
     confirmed_at = Column(DateTime(timezone=True), nullable=True)
@@ -287,12 +302,45 @@ class PDFFile(Base):
     payment_date = Column(DateTime(timezone=True), nullable=True)
     tags = Column(String, nullable=True) # comma separated
     download_request_count = Column(Integer, default=0)
+
+    # Storage tiering (see services/storage_tiering.py); NULL = class set at upload
+    storage_class = Column(String, nullable=True)
+    storage_class_changed_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        # Partial index backing the monthly billing screen (confirmed, not yet invoiced files)
+        Index(
+            "idx_pdf_files_unbilled", "hospital_id", "upload_date",
+            postgresql_where=text("billing_status = 'UNBILLED' AND upload_status = 'confirmed'"),
+            sqlite_where=text("billing_status = 'UNBILLED' AND upload_status = 'confirmed'")
+        ),
+    )
     
     # Relationships
     patient = relationship("Patient", back_populates="files")
     box = relationship("PhysicalBox", back_populates="files")
     extraction_data = relationship("AIExtraction", back_populates="file", uselist=False)
 
+    @hybrid_property
+    def billing_cost(self):
+        """Base price + extra pages x extra rate, from the historical price snapshot."""
+        base_price = self.price_per_file if self.price_per_file is not None else 100.0
+        included = self.included_pages if self.included_pages is not None else 20
+        extra_rate = self.price_per_extra_page if self.price_per_extra_page is not None else 1.0
+        extra_pages = max(0, (self.page_count or 0) - included)
+        return base_price + (extra_pages * extra_rate)
+
+    @billing_cost.expression
+    def billing_cost(cls):
+        # Same formula as above, evaluated by the database so totals can be aggregated in SQL
+        pages = func.coalesce(cls.page_count, 0)
+        included = func.coalesce(cls.included_pages, 20)
+        extra_rate = func.coalesce(cls.price_per_extra_page, 1.0)
+        return func.coalesce(cls.price_per_file, 100.0) + case(
+            (pages > included, (pages - included) * extra_rate),
+            else_=0.0
+        )
+
 class AIExtraction(Base):
     """Stores metadata extracted by Google Gemini / OCR."""
     __tablename__ = "ai_extractions"
@@ -331,6 +379,97 @@ class AuditLog(Base):
     user = relationship("User", back_populates="audit_logs")
     hospital = relationship("Hospital", back_populates="audit_logs")
 
+class SchemaVersion(Base):
+    """Applied versioned migrations (see app/migrations.py)."""
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String, nullable=True)
+    applied_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ScheduledJob(Base):
+    """Lease and last-run record of a periodic job (see services/scheduler.py). Times are UTC."""
+    __tablename__ = "scheduled_jobs"
+    name = Column(String, primary_key=True)
+    next_run_at = Column(DateTime, nullable=False)
+
+    # Whoever holds an unexpired lease is the only worker running the job
+    lease_owner = Column(String, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True)
+    last_status = Column(String, nullable=True) # success, failed
+    last_error = Column(Text, nullable=True)
+    last_duration_ms = Column(Integer, nullable=True)
+    run_count = Column(Integer, default=0, nullable=False)
+
+class RetentionRun(Base):
+    """Progress checkpoint of a retention cleanup run (see services/cleanup_service.py)."""
+    __tablename__ = "retention_runs"
+    run_id = Column(Integer, primary_key=True)
+    status = Column(String, default="running", nullable=False) # running, paused (hit the run limit), completed, failed
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Keyset cursor: every patient up to (hospital_id, record_id) has been handled
+    cursor_hospital_id = Column(Integer, nullable=True)
+    cursor_record_id = Column(Integer, nullable=True)
+
+    patients_deleted = Column(Integer, default=0, nullable=False)
+    files_deleted = Column(Integer, default=0, nullable=False)
+    patients_skipped = Column(Integer, default=0, nullable=False) # Storage delete failed; retried next pass
+    last_error = Column(Text, nullable=True)
+
+class FileAccessEvent(Base):
+    """One read of a stored file (serve, download, OCR); feeds storage tiering (see services/storage_tiering.py)."""
+    __tablename__ = "file_access_events"
+    event_id = Column(Integer, primary_key=True)
+    file_id = Column(Integer, nullable=False) # No FK: rows of deleted files are pruned by the tiering run
+    hospital_id = Column(Integer, nullable=True)
+    source = Column(String, nullable=False) # serve, download, ocr, restore
+    accessed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_file_access_events_file_time", "file_id", "accessed_at"),
+        Index("ix_file_access_events_time", "accessed_at"),
+    )
+
+class PendingRestore(Base):
+    """Archive restore awaiting completion and email delivery (see services/restore_tracker.py). Times are UTC."""
+    __tablename__ = "pending_restores"
+    restore_id = Column(Integer, primary_key=True)
+    file_id = Column(Integer, nullable=False, index=True) # No FK: a file deleted meanwhile just fails the delivery
+    s3_key = Column(String, nullable=False)
+    tier = Column(String, default="Standard", nullable=False) # Expedited, Standard, Bulk
+    recipient_email = Column(String, nullable=False)
+    requested_by = Column(Integer, ForeignKey("users.user_id"), nullable=True)
+    status = Column(String, default="pending", nullable=False) # pending, ready (queued for delivery), delivered, failed, expired
+    requested_at = Column(DateTime, nullable=False)
+    next_check_at = Column(DateTime, nullable=False)
+    check_count = Column(Integer, default=0, nullable=False)
+    delivery_attempts = Column(Integer, default=0, nullable=False)
+    completed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_pending_restores_due", "status", "next_check_at"),
+    )
+
+class SequenceCounter(Base):
+    """Last issued number of an identifier series (see services/sequence_service.py)."""
+    __tablename__ = "sequence_counters"
+    counter_id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, nullable=False, default=0) # hospital_id, 0 = platform-wide
+    namespace = Column(String, nullable=False) # box_label, mrd, dental_uhid, dental_opd
+    period = Column(String, nullable=False, default="") # series key, e.g. label prefix or year
+    last_value = Column(Integer, nullable=False, default=0)
+    last_label = Column(String, nullable=True) # identifier that set last_value (keeps its prefix)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'namespace', 'period', name='uq_sequence_counter'),
+    )
+
 class SystemSetting(Base):
     __tablename__ = "system_settings"
     id = Column(Integer, primary_key=True)
@@ -357,6 +496,9 @@ class PhysicalRack(Base):
     capacity = Column(Integer, default=500)
     total_rows = Column(Integer, default=5)
     total_columns = Column(Integer, default=10)
+    # Occupied-slot bitmap and free count (see services/rack_slots.py); NULL = rebuild on use
+    slot_bitmap = Column(LargeBinary, nullable=True)
+    free_slots = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     warehouse = relationship("Warehouse", back_populates="racks")
@@ -376,6 +518,7 @@ class PhysicalBox(Base):
     category = Column(String, default="GENERAL") # GENERAL, MLC, BIRTH, DEATH
     rack_row = Column(Integer, nullable=True)
     rack_column = Column(Integer, nullable=True)
+    current_count = Column(Integer, default=0, server_default="0", nullable=False) # Patients in the box (see services/box_fill.py)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     sealed_date = Column(DateTime, nullable=True)
     
@@ -384,6 +527,11 @@ class PhysicalBox(Base):
     files = relationship("PDFFile", back_populates="box")
     patients = relationship("Patient", back_populates="box")
 
+    __table_args__ = (
+        # Boxes with room left, per hospital / status / category (BoxFill.pick_box)
+        Index("idx_physical_boxes_fill", "hospital_id", "status", "category", "current_count"),
+    )
+
 class PhysicalMovementLog(Base):
     __tablename__ = "physical_movement_logs"
     log_id = Column(Integer, primary_key=True, index=True)
@@ -394,6 +542,9 @@ class PhysicalMovementLog(Base):
     performed_by_user_id = Column(Integer, ForeignKey("users.user_id"), nullable=True)
     status = Column(String, default="Success")
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Handheld scan batches (see services/scan_ingest.py)
+    device_id = Column(String, nullable=True)
+    batch_id = Column(String, nullable=True, index=True)
 
 class FileRequest(Base):
     __tablename__ = "file_requests"
@@ -505,6 +656,48 @@ class AccountingTransaction(Base):
     date = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("idx_accounting_txn_party_date", "party_type", "party_id", "date"),
+    )
+
+class LedgerBalanceSnapshot(Base):
+    """
+    Monthly closing checkpoint of a party's ledger.
+    Cumulative debit/credit of every transaction dated before period_end, so statements
+    only need to sum vouchers after the latest checkpoint.
+    """
+    __tablename__ = "ledger_balance_snapshots"
+    snapshot_id = Column(Integer, primary_key=True, index=True)
+    party_type = Column(String, nullable=False) # HOSPITAL, VENDOR, INTERNAL
+    party_id = Column(Integer, nullable=False, default=0) # 0 when the transaction has no party_id
+    period_end = Column(DateTime, nullable=False) # Exclusive: first instant of the next month
+    total_debit = Column(Float, default=0.0)
+    total_credit = Column(Float, default=0.0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('party_type', 'party_id', 'period_end', name='uix_ledger_snapshot_period'),
+    )
+
+class BillingRun(Base):
+    """
+    One batch invoice run across all hospitals (month-end close).
+    idempotency_key makes a retried run return the original result instead of billing twice.
+    """
+    __tablename__ = "billing_runs"
+    run_id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String, unique=True, index=True, nullable=False)
+    period_end = Column(DateTime, nullable=False) # Files uploaded before this instant are billed
+    is_gst_bill = Column(Boolean, default=True)
+    status = Column(String, default="RUNNING") # RUNNING, COMPLETED, FAILED
+    invoice_count = Column(Integer, default=0)
+    total_amount = Column(Float, default=0.0)
+    result = Column(JSON, nullable=True) # Per-hospital summary returned to the caller
+    error = Column(Text, nullable=True)
+    created_by = Column(Integer, ForeignKey("users.user_id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
 class AccountingConfig(Base):
     __tablename__ = "accounting_config"
     config_id = Column(Integer, primary_key=True, index=True)
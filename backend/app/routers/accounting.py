@@ -1,18 +1,22 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import List, Optional
 from pydantic import BaseModel
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, not_
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func
 
-from ..database import get_db
+from ..database import SessionLocal, get_db
 from ..models import (
-    Invoice, InvoiceItem, PDFFile, Hospital, User, Patient,
+    Invoice, InvoiceItem, PDFFile, Hospital, User, BillingRun,
     AccountingVendor, AccountingExpense, AccountingTransaction, AccountingConfig, UserRole
 )
 from .auth import get_current_user
 from ..services.email_service import EmailService
+from ..services.billing_service import BillingService
+from ..services.invoice_run_service import InvoiceRunService, previous_month_end
+from ..services.numbering_service import NumberingService, invoice_series
 from ..audit import log_audit
 
 router = APIRouter()
@@ -85,6 +89,7 @@ class CustomItem(BaseModel):
 class GenerateInvoiceRequest(BaseModel):
     hospital_id: int
     file_ids: List[int] = []
+    all_unbilled: bool = False # Bill every unbilled file of the hospital (select-all); file_ids is ignored
     custom_items: List[CustomItem] = []
     due_date: Optional[datetime] = None
     bill_date: Optional[datetime] = None
@@ -93,6 +98,16 @@ class GenerateInvoiceRequest(BaseModel):
     is_gst_bill: bool = True # Toggle for GST vs Bill of Supply
     custom_invoice_number: Optional[str] = None # Semi-auto numbering
 
+class BillingRunRequest(BaseModel):
+    period_end: Optional[date] = None # Inclusive; defaults to the last day of previous month
+    dry_run: bool = True
+    idempotency_key: Optional[str] = None # Required for a real run, e.g. "2026-09-gst"
+    is_gst_bill: bool = True
+    include_registration_fee: bool = True
+    bill_date: Optional[datetime] = None
+    due_date: Optional[datetime] = None
+    send_emails: bool = True
+
 class ReceivePaymentRequest(BaseModel):
     transaction_id: str
     payment_method: str
@@ -333,13 +348,18 @@ def update_invoice(
 
         # 3. Update Items (Complete Replacement for simplicity/safety)
         if req.items is not None:
-            # Note: We don't restore PDFFile.is_paid here because usually items are removed 
-            # and added back, or just modified. If an item is PERMANENTLY removed, 
-            # the user should use the dedicated item delete endpoint to handle file cleanup.
-            # However, for 'Manage Invoice' UI, we might need a sync logic.
+            # Items keep their file link when the client sends back their item_id; files whose
+            # items were dropped are released to the unbilled pool.
+            existing_links = {
+                i.item_id: i.file_id
+                for i in db.query(InvoiceItem.item_id, InvoiceItem.file_id).filter(InvoiceItem.invoice_id == invoice_id)
+            }
+            kept_file_ids = {existing_links.get(item.item_id) for item in req.items if item.item_id} - {None}
+            dropped_file_ids = [fid for fid in existing_links.values() if fid and fid not in kept_file_ids]
             
             # Simple approach: Delete existing and add new
             db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice_id).delete()
+            BillingService.release_files(db, invoice_id, dropped_file_ids)
             
             subtotal = 0.0
             for item in req.items:
@@ -348,6 +368,7 @@ def update_invoice(
                 
                 inv_item = InvoiceItem(
                     invoice_id=invoice_id,
+                    file_id=existing_links.get(item.item_id) if item.item_id else None,
                     amount=item.amount,
                     discount=item.discount,
                     description=item.description,
@@ -424,9 +445,9 @@ def delete_invoice_item(
     if invoice.status == "PAID":
         raise HTTPException(status_code=400, detail="Cannot edit a paid invoice")
         
-    # Mark file as unpaid if applicable
-    if item.pdf_file:
-        item.pdf_file.is_paid = False
+    # Mark file as unbilled/unpaid if applicable
+    if item.file_id:
+        BillingService.release_files(db, invoice.invoice_id, [item.file_id])
         
     # Reset reg fee status if it was a reg fee item
     if item.description == "One-time Registration Fee" and invoice.hospital:
@@ -494,6 +515,7 @@ def generate_invoice(
     current_user: User = Depends(get_current_user)
 ):
     """Generate a new invoice for a set of files."""
+    allocated, series, saved = [], None, False
     try:
         if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
             raise HTTPException(status_code=403, detail="Only Super Admins can generate invoices")
@@ -503,21 +525,22 @@ def generate_invoice(
             raise HTTPException(status_code=404, detail="Hospital not found")
             
         # Check if files belong to this hospital and are not already billed/paid
-        files = db.query(PDFFile).join(Patient).filter(
-            PDFFile.file_id.in_(req.file_ids),
-            Patient.hospital_id == req.hospital_id,
-            PDFFile.is_paid == False
-        ).all()
+        # (cost and patient fields come back as columns, computed by BillingService in SQL)
+        if req.all_unbilled:
+            # Same set as GET /unbilled/{hospital_id}, without the client holding every id
+            files = BillingService.file_rows(
+                db, hospital_id=req.hospital_id, confirmed_only=True, unbilled_only=True
+            ).all()
+        else:
+            files = BillingService.file_rows(
+                db, hospital_id=req.hospital_id, file_ids=req.file_ids, unbilled_only=True
+            ).all()
         
         if not files and not req.custom_items and not (req.include_registration_fee and hospital and not hospital.is_reg_fee_paid):
             raise HTTPException(status_code=400, detail="No valid, unpaid files, custom items, or registration fee to bill for this invoice")
             
-        # Get Accounting Config for Numbering
+        # Config is only read here (company details for the response)
         config = db.query(AccountingConfig).first()
-        if not config:
-            config = AccountingConfig()
-            db.add(config)
-            db.flush()
             
         # Generate or Use Custom Invoice Number
         if req.custom_invoice_number:
@@ -525,47 +548,13 @@ def generate_invoice(
             # We do NOT increment the auto-counter if manual override is used, 
             # to prevent gaps/jumps unless explicitly handled. 
             # User must manually update config if they want to skip ahead.
+            if db.query(Invoice).filter(Invoice.invoice_number == invoice_number).first():
+                raise HTTPException(status_code=400, detail=f"Invoice number '{invoice_number}' already exists!")
         else:
-            # Determine prefix and current counter based on GST vs Non-GST
-            if req.is_gst_bill:
-                prefix = config.invoice_prefix
-                current_counter = config.next_invoice_number
-                invoice_type = 'gst'
-            else:
-                prefix = config.invoice_prefix_nongst or "BOS"
-                current_counter = config.next_invoice_number_nongst or 1
-                invoice_type = 'nongst'
-            
-            # OPTIMIZED: Check cache table for available numbers (O(1) instead of O(n))
-            from ..models import AvailableInvoiceNumber
-            available = db.query(AvailableInvoiceNumber).filter(
-                AvailableInvoiceNumber.invoice_type == invoice_type,
-                AvailableInvoiceNumber.financial_year == config.current_fy
-            ).order_by(AvailableInvoiceNumber.number).first()
-            
-            if available:
-                # Reuse deleted invoice number
-                next_number = available.number
-                db.delete(available)  # Remove from available pool
-            else:
-                # No gaps, use next counter
-                next_number = current_counter
-                # Increment counter
-                if req.is_gst_bill:
-                    config.next_invoice_number += 1
-                else:
-                    config.next_invoice_number_nongst = (config.next_invoice_number_nongst or 1) + 1
-            
-            # Generate the invoice number
-            invoice_number = config.number_format.format(
-                prefix=prefix,
-                fy=config.current_fy,
-                number=next_number
-            )
-        
-        # Check for collision (Manual or Auto)
-        if db.query(Invoice).filter(Invoice.invoice_number == invoice_number).first():
-            raise HTTPException(status_code=400, detail=f"Invoice number '{invoice_number}' already exists!")
+            # Reserved outside this transaction (gap pool first, then the counter);
+            # returned to the pool below if the invoice cannot be saved
+            series = invoice_series(req.is_gst_bill)
+            allocated, (invoice_number,) = NumberingService.next_invoice_numbers(db, series)
             
         # Calculate total and items
         total_amount = 0.0
@@ -594,27 +583,17 @@ def generate_invoice(
             hospital.is_reg_fee_paid = True 
 
         for f in files:
-            # Calculate cost logic
-            # Use pricing from PDFFile (historical capture) or fall back to defaults
-            base_price = f.price_per_file if f.price_per_file is not None else 100.0
-            included = f.included_pages if f.included_pages is not None else 20
-            extra_rate = f.price_per_extra_page if f.price_per_extra_page is not None else 1.0
-            page_count = f.page_count or 0
-            extra_pages = max(0, page_count - included)
-            file_cost = base_price + (extra_pages * extra_rate)
-            
+            file_cost = f.cost
             total_amount += file_cost
             
-            description = f"Processing of patient record: {f.filename}"
-            if f.patient:
-                description = f"Processing MRD: {f.patient.patient_u_id} - {f.patient.full_name} ({f.filename})"
-                detailed_patient_records.append({
-                    "mrd_id": f.patient.patient_u_id,
-                    "name": f.patient.full_name,
-                    "admission_date": f.patient.admission_date.strftime("%Y-%m-%d") if f.patient.admission_date else "N/A",
-                    "file_id": f.file_id,
-                    "pages": f.page_count
-                })
+            description = f"Processing MRD: {f.patient_u_id} - {f.patient_name} ({f.filename})"
+            detailed_patient_records.append({
+                "mrd_id": f.patient_u_id,
+                "name": f.patient_name,
+                "admission_date": f.admission_date.strftime("%Y-%m-%d") if f.admission_date else "N/A",
+                "file_id": f.file_id,
+                "pages": f.page_count
+            })
                 
             invoice_items.append({
                 "file_id": f.file_id,
@@ -666,6 +645,8 @@ def generate_invoice(
                 hsn_code=item.get("hsn_code")
             )
             db.add(inv_item)
+
+        BillingService.mark_invoiced(db, new_invoice.invoice_id, [f.file_id for f in files])
             
         # Create Ledger Entry (Debit)
         ledger_entry = AccountingTransaction(
@@ -681,6 +662,7 @@ def generate_invoice(
         db.add(ledger_entry)
             
         db.commit()
+        saved = True
         db.refresh(new_invoice)
         
         # Send Email automatically with detailed info
@@ -743,6 +725,8 @@ def generate_invoice(
         
     except Exception as e:
         db.rollback()
+        if allocated and not saved:
+            NumberingService.release(db, series, allocated)
         error_msg = f"ERROR in generate_invoice: {type(e).__name__}: {str(e)}"
         print(f"--- FAILED TO GENERATE INVOICE ---")
         print(error_msg)
@@ -757,6 +741,129 @@ def generate_invoice(
         raise HTTPException(status_code=500, detail=error_msg)
         
 
+def deliver_invoice_emails(invoice_ids: List[int]):
+    """
+    Background Task: email a batch of freshly generated invoices.
+    Runs after the billing transaction has committed, with its own session.
+    """
+    db = SessionLocal()
+    try:
+        invoices = db.query(Invoice).options(
+            selectinload(Invoice.hospital), selectinload(Invoice.items)
+        ).filter(Invoice.invoice_id.in_(invoice_ids)).all()
+
+        sent = 0
+        for invoice in invoices:
+            hospital = invoice.hospital
+            if not hospital or not hospital.email:
+                continue
+            try:
+                if EmailService.send_invoice_email(
+                    recipient_email=hospital.email,
+                    hospital_name=hospital.legal_name,
+                    invoice_number=invoice.invoice_number,
+                    amount=invoice.total_amount,
+                    items=[{
+                        "description": item.description or f"File #{item.file_id}",
+                        "amount": item.amount,
+                        "hsn": item.hsn_code
+                    } for item in invoice.items],
+                    bank_details={
+                        "name": hospital.bank_name,
+                        "account": hospital.bank_account_no,
+                        "ifsc": hospital.bank_ifsc,
+                        "gst": hospital.gst_number
+                    },
+                    extra_details={"amount_in_words": number_to_words(invoice.total_amount)}
+                ):
+                    sent += 1
+            except Exception as e:
+                print(f"❌ Invoice email failed for {invoice.invoice_number}: {e}")
+        print(f"📧 Invoice emails sent: {sent}/{len(invoices)}")
+    finally:
+        db.close()
+
+@router.post("/billing-run")
+def run_monthly_billing(
+    req: BillingRunRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Month-end batch invoicing for every active hospital with unbilled confirmed files.
+    dry_run (default) only previews; a real run needs an idempotency_key, and repeating
+    a completed key returns the original result instead of billing again.
+    """
+    if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
+        raise HTTPException(status_code=403, detail="Only Super Admins can generate invoices")
+
+    period_end = req.period_end or previous_month_end()
+
+    if req.dry_run:
+        preview = InvoiceRunService.preview(
+            db, period_end, is_gst_bill=req.is_gst_bill, include_registration_fee=req.include_registration_fee
+        )
+        return {"dry_run": True, **preview}
+
+    if not req.idempotency_key:
+        raise HTTPException(status_code=400, detail="idempotency_key is required for a billing run")
+
+    run = db.query(BillingRun).filter(BillingRun.idempotency_key == req.idempotency_key).first()
+    if run and run.status == "COMPLETED":
+        return {"dry_run": False, "replayed": True, **InvoiceRunService.summary(run)}
+    if run and run.status == "RUNNING":
+        raise HTTPException(status_code=409, detail="A billing run with this key is already in progress")
+
+    # Claim the key (unique constraint decides between concurrent callers)
+    if run:
+        run.status = "RUNNING"
+        run.error = None
+        run.period_end = datetime.combine(period_end + timedelta(days=1), datetime.min.time())
+        run.is_gst_bill = req.is_gst_bill
+    else:
+        run = BillingRun(
+            idempotency_key=req.idempotency_key,
+            period_end=datetime.combine(period_end + timedelta(days=1), datetime.min.time()),
+            is_gst_bill=req.is_gst_bill,
+            status="RUNNING",
+            created_by=current_user.user_id
+        )
+        db.add(run)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="A billing run with this key is already in progress")
+
+    try:
+        summary = InvoiceRunService.execute(
+            db, run,
+            include_registration_fee=req.include_registration_fee,
+            bill_date=req.bill_date,
+            due_date=req.due_date
+        )
+    except Exception as e:
+        db.rollback()
+        run.status = "FAILED"
+        run.error = f"{type(e).__name__}: {str(e)}"
+        db.commit()
+        print(f"❌ [BILLING RUN] {req.idempotency_key} failed: {run.error}")
+        raise HTTPException(status_code=500, detail=f"Billing run failed: {run.error}")
+
+    if req.send_emails and summary["hospitals"]:
+        background_tasks.add_task(deliver_invoice_emails, [h["invoice_id"] for h in summary["hospitals"]])
+
+    log_audit(
+        db,
+        user_id=current_user.user_id,
+        action="BILLING_RUN_COMPLETED",
+        details=f"Billing run {run.idempotency_key}: {summary['invoice_count']} invoices (Amount: {summary['total_amount']})"
+    )
+    db.commit()
+
+    return {"dry_run": False, "replayed": False, **summary}
+
 @router.post("/{invoice_id}/receive-payment")
 def receive_payment(
     invoice_id: int,
@@ -781,13 +888,7 @@ def receive_payment(
     invoice.payment_date = req.payment_date or datetime.now()
     
     # Mark all associated files as PAID
-    items = db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice_id).all()
-    file_ids = [item.file_id for item in items if item.file_id is not None] # Only include actual file_ids
-    
-    db.query(PDFFile).filter(PDFFile.file_id.in_(file_ids)).update({
-        "is_paid": True,
-        "payment_date": datetime.now()
-    }, synchronize_session=False)
+    BillingService.mark_paid(db, invoice_id, datetime.now())
 
     # Create Ledger Entry (Credit)
     ledger_entry = AccountingTransaction(
@@ -816,39 +917,46 @@ def receive_payment(
     return {"message": "Payment recorded successfully", "invoice_number": invoice.invoice_number}
 
 @router.get("/unbilled/{hospital_id}")
-async def get_unbilled_files(hospital_id: int, db: Session = Depends(get_db)):
-    """Retrieve all unpaid files for a specific hospital that are ready for billing."""
-    # Find files belonging to hospital that are NOT in any InvoiceItem
-    billed_file_ids = db.query(InvoiceItem.file_id).filter(InvoiceItem.file_id.isnot(None)).subquery()
-
-    pfiles = db.query(PDFFile).join(Patient).filter(
-        Patient.hospital_id == hospital_id,
-        PDFFile.upload_status == 'confirmed',  # Only confirmed files (not drafts)
-        not_(PDFFile.file_id.in_(billed_file_ids))
-    ).all()
+def get_unbilled_files(
+    hospital_id: int,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(200, ge=1, le=1000),
+    include_totals: bool = True,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Retrieve a page of unbilled files for a specific hospital that are ready for billing.
+    Pass include_totals=false for later pages to skip the summary aggregate.
+    """
+    if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    # Only confirmed files (not drafts) still in UNBILLED state; served by idx_pdf_files_unbilled
+    filters = {"hospital_id": hospital_id, "confirmed_only": True, "unbilled_only": True}
+    pfiles = BillingService.file_rows(db, **filters)\
+        .order_by(PDFFile.upload_date, PDFFile.file_id)\
+        .offset(skip).limit(limit).all()
+    summary = BillingService.summary(db, **filters) if include_totals else None
     
-    results = []
-    for f in pfiles:
-        # Calculate cost logic (mirroring reports logic)
-        # Use pricing from PDFFile (snapshot) or defaults
-        base_price = f.price_per_file if f.price_per_file is not None else 100.0
-        included = f.included_pages if f.included_pages is not None else 20
-        extra_rate = f.price_per_extra_page if f.price_per_extra_page is not None else 1.0
-        page_count = f.page_count or 0
-        extra_pages = max(0, page_count - included)
-        file_cost = base_price + (extra_pages * extra_rate)
-        
-        results.append({
-            "file_id": f.file_id,
-            "filename": f.filename,
-            "patient_name": f.patient.full_name if f.patient else "Unknown",
-            "mrd_id": f.patient.patient_u_id if f.patient else "N/A",
-            "page_count": f.page_count,
-            "created_at": f.upload_date,
-            "suggested_amount": file_cost
-        })
-        
-    return results
+    return {
+        "items": [
+            {
+                "file_id": f.file_id,
+                "filename": f.filename,
+                "patient_name": f.patient_name or "Unknown",
+                "mrd_id": f.patient_u_id or "N/A",
+                "page_count": f.page_count,
+                "created_at": f.upload_date,
+                "suggested_amount": f.cost
+            }
+            for f in pfiles
+        ],
+        "total": summary["total_files"] if summary else None,
+        "total_amount": summary["total_cost"] if summary else None,
+        "skip": skip,
+        "limit": limit
+    }
 
 @router.post("/{invoice_id}/send-email")
 def send_invoice_email(
@@ -913,61 +1021,35 @@ def delete_invoice(
         if invoice.hospital:
             invoice.hospital.is_reg_fee_paid = False
 
-    # Delete associated Ledger Entry
-    db.query(AccountingTransaction).filter(
+    # Delete associated Ledger Entry (per row, so closed ledger periods are invalidated)
+    for txn in db.query(AccountingTransaction).filter(
         AccountingTransaction.voucher_type == "INVOICE",
         AccountingTransaction.voucher_id == invoice_id
-    ).delete()
+    ).all():
+        db.delete(txn)
 
     # Reset File Statuses
-    items = db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice_id).all()
-    file_ids = [item.file_id for item in items if item.file_id is not None]
-    
-    if file_ids:
-        db.query(PDFFile).filter(PDFFile.file_id.in_(file_ids)).update({
-            "is_paid": False,
-            "payment_date": None
-        }, synchronize_session=False)
+    BillingService.release_files(db, invoice_id)
+
+    config = db.query(AccountingConfig).first()
+    invoice_number = invoice.invoice_number
+
+    # Delete Invoice (Cascade will delete items)
+    db.delete(invoice)
+    db.commit()
 
     # --- GAP FILLING LOGIC ---
-    # Recycle the invoice number for reuse
+    # Recycle the invoice number for reuse (once the delete is committed)
     try:
-        config = db.query(AccountingConfig).first()
-        if config and invoice.invoice_number:
-            # Format: PREFIX/FY/NUMBER
-            parts = invoice.invoice_number.split('/')
-            if len(parts) == 3:
-                raw_number = int(parts[2])
-                fy = parts[1]
-                
-                # Determine type by prefix
-                inv_type = 'gst'
-                if parts[0] == config.invoice_prefix_nongst or parts[0] == "BOS":
-                    inv_type = 'nongst'
-                
-                from ..models import AvailableInvoiceNumber
-                # Add to pool if not already there
-                exists = db.query(AvailableInvoiceNumber).filter(
-                    AvailableInvoiceNumber.number == raw_number,
-                    AvailableInvoiceNumber.invoice_type == inv_type,
-                    AvailableInvoiceNumber.financial_year == fy
-                ).first()
-                
-                if not exists:
-                    pool_entry = AvailableInvoiceNumber(
-                        number=raw_number,
-                        invoice_type=inv_type,
-                        financial_year=fy
-                    )
-                    db.add(pool_entry)
-                    db.commit()
+        parsed = NumberingService.parse(db, invoice_number)
+        if parsed:
+            series, fy, raw_number = parsed
+            if series not in ("gst", "nongst"):
+                series = "gst"
+            NumberingService.release(db, series, [raw_number], financial_year=fy)
     except Exception as e:
         print(f"Non-critical error recycling invoice number: {e}")
     # -------------------------
-
-    # Delete Invoice (Cascade will delete items)
-    db.delete(invoice)
-    db.commit()
     
     # Check if table is empty, if so, reset pool and counters
     if db.query(Invoice).count() == 0:
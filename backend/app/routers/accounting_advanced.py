@@ -7,8 +7,10 @@ from sqlalchemy import func, desc
 
 from ..database import get_db
 from ..models import (
-    User, Hospital, AccountingVendor, AccountingExpense, AccountingTransaction, Invoice, AccountingConfig, UserRole
+    User, Hospital, AccountingVendor, AccountingExpense, AccountingTransaction, Invoice, UserRole
 )
+from ..services.ledger_service import LedgerService
+from ..services.numbering_service import NumberingService
 from .auth import get_current_user
 
 router = APIRouter()
@@ -45,6 +47,7 @@ class TransactionResponse(BaseModel):
     credit: float
     description: Optional[str]
     date: datetime
+    running_balance: Optional[float] = None
 
     class Config:
         from_attributes = True
@@ -53,6 +56,9 @@ class LedgerResponse(BaseModel):
     party_name: str
     opening_balance: float = 0.0
     closing_balance: float
+    total_debit: float = 0.0
+    total_credit: float = 0.0
+    total_count: int = 0
     transactions: List[TransactionResponse]
 
 class FinancialOverview(BaseModel):
@@ -87,22 +93,10 @@ def create_receipt_voucher(
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
          raise HTTPException(status_code=403, detail="Access denied")
 
-    # Get Config
-    config = db.query(AccountingConfig).first()
-    if not config:
-        config = AccountingConfig()
-        db.add(config)
-        db.flush()
-
-    # Generate Receipt Number if not provided
+    # Generate Receipt Number if not provided (reserved in this transaction, so a failed insert rolls it back)
     voucher_number = req.reference_number
     if not voucher_number:
-        voucher_number = config.number_format.format(
-            prefix=config.receipt_prefix,
-            fy=config.current_fy,
-            number=config.next_receipt_number
-        )
-        config.next_receipt_number += 1
+        voucher_number = NumberingService.next_numbers(db, "receipt", same_transaction=True)[0]
 
     # Create Ledger Entry (Credit)
     ledger_entry = AccountingTransaction(
@@ -124,10 +118,18 @@ def create_receipt_voucher(
 def get_ledger(
     party_type: str, 
     party_id: int, 
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Retrieve full Statement of Account for a Hospital or Vendor."""
+    """
+    Statement of Account for a Hospital or Vendor.
+    Opening balance is the balance before start_date; each row carries its running balance.
+    Without start_date/end_date/limit the full history is returned.
+    """
     # Restricted to Super Admin / Platform Staff
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -140,26 +142,28 @@ def get_ledger(
         v = db.query(AccountingVendor).filter(AccountingVendor.vendor_id == party_id).first()
         party_name = v.name if v else "Unknown Vendor"
 
-    query = db.query(AccountingTransaction).filter(AccountingTransaction.party_type == party_type)
-    
-    if party_id == 0:
-        query = query.filter(AccountingTransaction.party_id.is_(None))
-    else:
-        query = query.filter(AccountingTransaction.party_id == party_id)
-        
-    transactions = query.order_by(AccountingTransaction.date.asc()).all()
+    statement = LedgerService.statement(
+        db, party_type, party_id,
+        start_date=start_date, end_date=end_date, skip=skip, limit=limit
+    )
 
-    # Calculate balances
-    total_debit = sum(t.debit for t in transactions)
-    total_credit = sum(t.credit for t in transactions)
-    closing_balance = total_debit - total_credit
+    return {"party_name": party_name, **statement}
 
-    return {
-        "party_name": party_name,
-        "opening_balance": 0.0,
-        "closing_balance": closing_balance,
-        "transactions": transactions
-    }
+@router.post("/ledger/close-period")
+def close_ledger_period(
+    period_end: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Checkpoint every party's balance at the start of the month containing period_end
+    (default: current month, i.e. closes last month). Safe to re-run.
+    """
+    if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
+         raise HTTPException(status_code=403, detail="Access denied")
+
+    parties = LedgerService.close_period(db, period_end)
+    return {"message": "Ledger period closed", "parties": parties}
 
 @router.post("/expenses", response_model=ExpenseCreate)
 def create_expense(
@@ -171,22 +175,10 @@ def create_expense(
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
          raise HTTPException(status_code=403, detail="Access denied")
 
-    # Get Config
-    config = db.query(AccountingConfig).first()
-    if not config:
-        config = AccountingConfig()
-        db.add(config)
-        db.flush()
-
-    # Generate Expense Number if not provided
+    # Generate Expense Number if not provided (reserved in this transaction, so a failed insert rolls it back)
     voucher_number = req.reference_number
     if not voucher_number:
-        voucher_number = config.number_format.format(
-            prefix=config.expense_prefix,
-            fy=config.current_fy,
-            number=config.next_expense_number
-        )
-        config.next_expense_number += 1
+        voucher_number = NumberingService.next_numbers(db, "expense", same_transaction=True)[0]
 
     new_expense = AccountingExpense(
         description=req.description,
@@ -242,9 +234,10 @@ def get_accounting_overview(
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
          raise HTTPException(status_code=403, detail="Access denied")
 
-    # 1. Total Receivables (Balance from all Hospital Ledgers)
-    h_transactions = db.query(AccountingTransaction).filter(AccountingTransaction.party_type == "HOSPITAL").all()
-    total_receivables = sum(t.debit for t in h_transactions) - sum(t.credit for t in h_transactions)
+    # 1. Total Receivables / Payables (Balance from all Hospital / Vendor Ledgers)
+    party_totals = LedgerService.totals_by_party_type(db)
+    h_debit, h_credit = party_totals.get("HOSPITAL", (0.0, 0.0))
+    total_receivables = h_debit - h_credit
 
     # 2. Sales MTD (Current Month)
     current_month = datetime.now().month
@@ -273,9 +266,9 @@ def get_accounting_overview(
         AccountingTransaction.voucher_type == "EXPENSE"
     ).scalar() or 0.0
 
-    # 1.5 Total Payables (Balance from all Vendor Ledgers)
-    v_transactions = db.query(AccountingTransaction).filter(AccountingTransaction.party_type == "VENDOR").all()
-    total_payables = sum(t.credit for t in v_transactions) - sum(t.debit for t in v_transactions)
+    # 1.5 Total Payables
+    v_debit, v_credit = party_totals.get("VENDOR", (0.0, 0.0))
+    total_payables = v_credit - v_debit
 
     return {
         "total_receivables": total_receivables,
@@ -370,11 +363,12 @@ def delete_expense(
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
-    # Delete Linked Transactions First
-    db.query(AccountingTransaction).filter(
+    # Delete Linked Transactions First (per row, so closed ledger periods are invalidated)
+    for txn in db.query(AccountingTransaction).filter(
         AccountingTransaction.voucher_type == "EXPENSE",
         AccountingTransaction.voucher_id == expense_id
-    ).delete()
+    ).all():
+        db.delete(txn)
 
     # Delete Expense
     db.delete(expense)
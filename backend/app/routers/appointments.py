@@ -59,7 +59,7 @@ class AppointmentResponse(BaseModel):
 # --- Endpoints ---
 
 @router.get("/departments", response_model=List[DepartmentResponse])
-async def get_departments(
+def get_departments(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -71,7 +71,7 @@ async def get_departments(
     return departments
 
 @router.get("/doctors", response_model=List[DoctorResponse])
-async def get_doctors(
+def get_doctors(
     department_id: Optional[int] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -96,7 +96,7 @@ async def get_doctors(
     return doctors
 
 @router.post("/", response_model=AppointmentResponse)
-async def create_appointment(
+def create_appointment(
     payload: AppointmentCreate,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -132,7 +132,7 @@ async def create_appointment(
     return new_appointment
 
 @router.get("/", response_model=List[AppointmentResponse])
-async def get_appointments(
+def get_appointments(
     date: Optional[str] = None, # YYYY-MM-DD
     doctor_id: Optional[int] = None,
     department_id: Optional[int] = None,
@@ -159,7 +159,7 @@ async def get_appointments(
     return query.order_by(Appointment.start_time).all()
 
 @router.put("/{appointment_id}/status")
-async def update_appointment_status(
+def update_appointment_status(
     appointment_id: int,
     status: str,
     current_user: User = Depends(get_current_user),
@@ -10,12 +10,14 @@ otp_request_tracker = defaultdict(list)
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import func
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from ..core.config import settings
-from ..database import get_db
-from ..models import SystemSetting, User, UserRole, PasswordResetOTP, Permission, ROLE_PERMISSIONS, UserTrustedDevice
+from ..database import get_async_db, get_db
+from ..models import User, UserRole, PasswordResetOTP, Permission, ROLE_PERMISSIONS, UserTrustedDevice
+from ..services.principal_cache import LastActiveWriter, MaintenanceFlag, PrincipalCache
 from ..utils import create_access_token, verify_password, get_password_hash
 from ..audit import log_audit
 from ..services.email_service import EmailService
@@ -52,7 +54,7 @@ async def get_csrf_token(csrf_protect: CsrfProtect = Depends()):
 
 
 @router.post("/token", response_model=Token)
-async def login_for_access_token(
+def login_for_access_token(
     request: Request,
     background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(), 
@@ -309,7 +311,7 @@ class VerifyDeviceRequest(BaseModel):
     device_id: str
 
 @router.post("/mfa/verify-device", response_model=Token)
-async def verify_device_otp(req: VerifyDeviceRequest, db: Session = Depends(get_db)):
+def verify_device_otp(req: VerifyDeviceRequest, db: Session = Depends(get_db)):
     """
     Verifies the email OTP for a new device and, if successful, registers the device
     and issues the final access token.
@@ -434,7 +436,7 @@ async def verify_device_otp(req: VerifyDeviceRequest, db: Session = Depends(get_
     return response
 
 @router.post("/request-password-reset")
-async def request_password_reset(request: PasswordResetRequest, db: Session = Depends(get_db)):
+def request_password_reset(request: PasswordResetRequest, db: Session = Depends(get_db)):
     email = request.email.lower()
     
     # Rate limiting: 3 requests per hour
@@ -478,7 +480,7 @@ async def request_password_reset(request: PasswordResetRequest, db: Session = De
 
 
 @router.post("/reset-password")
-async def reset_password(data: PasswordResetConfirm, db: Session = Depends(get_db)):
+def reset_password(data: PasswordResetConfirm, db: Session = Depends(get_db)):
     from ..models import PasswordResetOTP
     from ..utils import get_password_hash
     
@@ -525,7 +527,16 @@ async def reset_password(data: PasswordResetConfirm, db: Session = Depends(get_d
     return {"message": "Password updated successfully"}
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+async def get_current_user(
+    request: Request,
+    db: Session = Depends(get_db),
+    async_db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Resolves the principal without touching the sync pool: cache hits cost no query and
+    misses go through the async engine. The user returned is attached to `db`
+    (merge, load=False) so sync endpoints can still modify it or lazy-load relationships.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -560,11 +571,16 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
         raise credentials_exception
     
     
-    from sqlalchemy import func
-    user = db.query(User).filter(func.lower(User.email) == func.lower(email)).first()
+    # Cache hit: no query (see services/principal_cache.py)
+    user = PrincipalCache.get(db, email, session_id)
     if user is None:
-        print(f"[AUTH_DEBUG] User with email {email} not found in database.")
-        raise credentials_exception
+        result = await async_db.execute(select(User).where(func.lower(User.email) == func.lower(email)))
+        loaded = result.scalars().first()
+        if loaded is None:
+            print(f"[AUTH_DEBUG] User with email {email} not found in database.")
+            raise credentials_exception
+        PrincipalCache.put(email, session_id, loaded)
+        user = db.merge(PrincipalCache.snapshot(loaded), load=False)
     
     # Single Session Verification
     if user.role != UserRole.SUPER_ADMIN:
@@ -576,15 +592,14 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
                 headers={"WWW-Authenticate": "Bearer"},
             )
     
-    # Global Maintenance Mode Check
-    maintenance = db.query(SystemSetting).filter(SystemSetting.key == "maintenance_mode").first()
-    if maintenance and maintenance.value == "true" and user.role != UserRole.SUPER_ADMIN:
+    # Global Maintenance Mode Check (process-wide cached flag)
+    if user.role != UserRole.SUPER_ADMIN and await MaintenanceFlag.is_enabled_async(async_db):
          raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="System is currently under maintenance. Please try again later.",
         )
     
-    # Update Last Active Timestamp (IST)
+    # Update Last Active Timestamp (IST), written behind in batches
     now = datetime.now(IST)
     
     # Needs checking if last_active_at is naive
@@ -592,15 +607,13 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     if last_active and last_active.tzinfo is None:
         last_active = last_active.replace(tzinfo=IST)
         
-    if not last_active or (now - last_active).total_seconds() > 300:
-        user.last_active_at = now
-        db.commit()
+    LastActiveWriter.touch(user.user_id, last_active, now)
     
     return user
 
 
 @router.get("/session-token")
-async def get_session_token(current_user: User = Depends(get_current_user)):
+def get_session_token(current_user: User = Depends(get_current_user)):
     """Returns the JWT for the currently active session. Useful for desktop app handoff."""
     token_data = {
         "sub": current_user.email, 
@@ -643,7 +656,7 @@ def require_permission(required_permission: Permission):
 
 
 @router.post("/logout")
-async def logout(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def logout(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Logs the user out by clearing the HttpOnly cookie and session ID."""
     import uuid
     
@@ -665,7 +678,7 @@ async def logout(current_user: User = Depends(get_current_user), db: Session = D
     return response
 
 @router.post("/register-demo")
-async def register_demo(data: dict, db: Session = Depends(get_db)):
+def register_demo(data: dict, db: Session = Depends(get_db)):
     from ..services.demo_service import register_demo_account, DemoRegistrationRequest
     return register_demo_account(DemoRegistrationRequest(**data), db)
 
@@ -683,7 +696,7 @@ class HospitalRegistrationRequest(BaseModel):
     password: str
 
 @router.post("/register")
-async def register_hospital(data: HospitalRegistrationRequest, db: Session = Depends(get_db)):
+def register_hospital(data: HospitalRegistrationRequest, db: Session = Depends(get_db)):
     from ..models import Hospital, User, UserRole
     from ..utils import get_password_hash
     from ..audit import log_audit
@@ -10,7 +10,7 @@ class ContactForm(BaseModel):
     message: str
 
 @router.post("")
-async def submit_contact_form(form: ContactForm):
+def submit_contact_form(form: ContactForm):
     success = EmailService.send_contact_form(form.name, form.email, form.message)
     if not success:
         raise HTTPException(status_code=500, detail="Failed to send message. Please try again later.")
@@ -17,6 +17,7 @@ from ..models import (
 )
 from .auth import get_current_user
 from ..services.s3_handler import S3Manager
+from ..services.sequence_service import SequenceService
 from ..models import Hospital
 
 router = APIRouter(
@@ -408,6 +409,14 @@ def get_dental_stats(
         "pending_plans": pending_plans
     }
 
+def _format_uhid(number: int) -> str:
+    return f"UHID-{number}"
+
+
+def _format_opd(year: int, number: int) -> str:
+    return f"OPD-{year}-{str(number).zfill(3)}"
+
+
 @router.get("/next-ids")
 def get_next_dental_ids(
     db: Session = Depends(get_db),
@@ -417,31 +426,15 @@ def get_next_dental_ids(
     if not hospital_id:
         raise HTTPException(status_code=400, detail="Hospital context required")
 
-    # Fetch latest patient for this hospital
-    latest_patient = db.query(DentalPatient).filter(
-        DentalPatient.hospital_id == hospital_id
-    ).order_by(DentalPatient.patient_id.desc()).first()
-
     current_year = datetime.now().year
-    
-    next_uhid_num = 10001
-    next_opd_num = 1
-
-    if latest_patient:
-        # Extract UHID number
-        if latest_patient.uhid:
-            uhid_match = re.search(r'(\d+)$', latest_patient.uhid)
-            if uhid_match:
-                next_uhid_num = int(uhid_match.group(1)) + 1
-        
-        # Extract OPD number
-        if latest_patient.opd_number:
-            opd_match = re.search(r'(\d+)$', latest_patient.opd_number)
-            if opd_match:
-                next_opd_num = int(opd_match.group(1)) + 1
 
-    next_uhid = f"UHID-{next_uhid_num}"
-    next_opd = f"OPD-{current_year}-{str(next_opd_num).zfill(3)}"
+    # Preview only (not reserved): a create with a blank UHID / OPD number allocates it.
+    # Counter rows per hospital (OPD numbers restart every year)
+    last_uhid, _ = SequenceService.peek(db, "dental_uhid", hospital_id)
+    last_opd, _ = SequenceService.peek(db, "dental_opd", hospital_id, str(current_year))
+
+    next_uhid = _format_uhid(last_uhid + 1)
+    next_opd = _format_opd(current_year, last_opd + 1)
 
     return {
         "next_uhid": next_uhid,
@@ -535,6 +528,12 @@ def create_patient(
             raise HTTPException(status_code=400, detail=f"Patient with OPD number {patient.opd_number} already exists.")
         
     db_patient = DentalPatient(**patient.dict(), hospital_id=hospital_id)
+    # Blank identifiers are allocated here, so two staff creating at once never share one
+    if not db_patient.uhid:
+        db_patient.uhid = _format_uhid(SequenceService.allocate_next(db, "dental_uhid", hospital_id))
+    if not db_patient.opd_number:
+        year = datetime.now().year
+        db_patient.opd_number = _format_opd(year, SequenceService.allocate_next(db, "dental_opd", hospital_id, str(year)))
     db.add(db_patient)
     db.commit()
     db.refresh(db_patient)
@@ -883,7 +882,7 @@ def get_periodontal_exam(
 
 # 3D Scans
 @router.post("/scans/{patient_id}", response_model=ScanResponse)
-async def upload_scan(
+def upload_scan(
     patient_id: int, 
     file: UploadFile = File(...), 
     scan_type: str = "Intraoral",
@@ -915,7 +914,7 @@ async def upload_scan(
     
     # Read file content
     from ..utils import validate_magic_bytes
-    contents = await file.read()
+    contents = file.file.read()
     
     if not validate_magic_bytes(contents[:100], ext):
         raise HTTPException(status_code=400, detail=f"File content does not match extension '{ext}' (Spoofing detected)")
@@ -1188,7 +1187,7 @@ def create_dental_inventory_item(item: DentalInventoryItemCreate, db: Session =
 s3 = S3Manager()
 
 @router.post("/scans/{patient_id}", response_model=ScanResponse)
-async def upload_dental_scan(
+def upload_dental_scan(
     patient_id: int,
     file: UploadFile = File(...),
     scan_type: str = "Intraoral",
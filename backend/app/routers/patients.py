@@ -1,21 +1,28 @@
 import datetime
 import os
+import re
 import uuid
 from typing import List, Optional, Union
 
 from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, UploadFile, Response, Request
 from pydantic import BaseModel
-from sqlalchemy import or_
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
+from starlette.concurrency import run_in_threadpool
 
-from ..database import SessionLocal, get_db
+from ..database import SessionLocal, get_async_db, get_db
 from ..models import BandwidthUsage, Patient, PDFFile, User, UserRole
 from ..routers.auth import get_current_user
 from ..services.compression import compress_pdf, compress_video_to_mp4
 from ..services.ocr import extract_text_from_pdf, classify_document, extract_text_from_image
 from ..services.s3_handler import S3Manager
 from ..audit import log_audit
+from ..services.sequence_service import SequenceService, mrd_prefix
 from ..services.storage_service import StorageService
+from ..services.restore_tracker import RestoreTracker
+from ..services.storage_tiering import StorageTiering
 from ..services.email_service import EmailService
 
 router = APIRouter(tags=["patients"])
@@ -194,7 +201,6 @@ def process_upload_task(file_id: int, temp_path: str, original_filename: str, us
         try:
             from ..audit import log_audit
             log_audit(db, user_id, "FILE_UPLOADED", f"Uploaded: {original_filename}", hospital_id=hospital_id)
-            db.commit() 
         except Exception as e:
             print(f"Background Audit Error: {e}")
         
@@ -254,6 +260,7 @@ def run_manual_ocr_task(file_id: int):
                 db_file.processing_progress = 0
                 db.commit()
                 return
+            StorageTiering.record_access(db_file.file_id, db_file.hospital_id, "ocr")
                 
             db_file.processing_progress = 30
             db.commit()
@@ -485,7 +492,7 @@ class PatientResponse(PatientMedicalBase):
         from_attributes = True
 
 class PatientCreate(PatientMedicalBase):
-    patient_u_id: str
+    patient_u_id: Optional[str] = None # Blank: the next MRD number is allocated on create
     uhid: Optional[str] = None
     full_name: str
     age: Optional[str] = None
@@ -578,13 +585,15 @@ def create_patient(patient: PatientCreate, db: Session = Depends(get_db), curren
              raise HTTPException(status_code=400, detail="User context missing hospital ID")
 
     # 1. Check for Duplicate MRD (Explicit Check for better error)
-    existing_mrd = db.query(Patient).filter(
-        Patient.hospital_id == hospital_id,
-        Patient.patient_u_id == patient.patient_u_id
-    ).first()
-    
-    if existing_mrd:
-        raise HTTPException(status_code=400, detail=f"MRD Number '{patient.patient_u_id}' already exists.")
+    auto_mrd = not (patient.patient_u_id or "").strip()
+    if not auto_mrd:
+        existing_mrd = db.query(Patient).filter(
+            Patient.hospital_id == hospital_id,
+            Patient.patient_u_id == patient.patient_u_id
+        ).first()
+
+        if existing_mrd:
+            raise HTTPException(status_code=400, detail=f"MRD Number '{patient.patient_u_id}' already exists.")
 
     # 2. Date Validation (Phase 2 Requirement)
     if patient.admission_date and patient.discharge_date:
@@ -616,19 +625,25 @@ def create_patient(patient: PatientCreate, db: Session = Depends(get_db), curren
         medical_summary=patient.medical_summary,
         remarks=patient.remarks
     )
-    
-    try:
-        from ..audit import log_audit
-        log_audit(db, current_user.user_id, "PATIENT_CREATED", f"Created patient: {db_patient.full_name} ({db_patient.patient_u_id})", hospital_id=hospital_id)
-    except Exception as e:
-        print(f"Audit Log Error: {e}") 
-    
-    try:
-        db.add(db_patient)
-        db.commit()
-        db.refresh(db_patient)
-    except Exception as e:
-        print(f"Audit Log Error: {e}") 
+
+    # uq_hospital_patient_mrd is the final guard: a typed-in MRD that was taken meanwhile
+    # is rejected, an allocated one (only a concurrent typed-in number can hold it) is retried
+    for attempt in range(3):
+        if auto_mrd:
+            db_patient.patient_u_id = SequenceService.allocate_mrd(db, hospital_id)
+        try:
+            log_audit(db, current_user.user_id, "PATIENT_CREATED", f"Created patient: {db_patient.full_name} ({db_patient.patient_u_id})", hospital_id=hospital_id)
+        except Exception as e:
+            print(f"Audit Log Error: {e}")
+        try:
+            db.add(db_patient)
+            db.commit()
+            db.refresh(db_patient)
+            break
+        except IntegrityError:
+            db.rollback()
+            if not auto_mrd or attempt == 2:
+                raise HTTPException(status_code=400, detail=f"MRD Number '{db_patient.patient_u_id}' already exists.")
 
     # --- Auto-Assign Storage ---
     # Disabled by user request (Manual Assignment Mode)
@@ -641,7 +656,7 @@ def create_patient(patient: PatientCreate, db: Session = Depends(get_db), curren
     return db_patient
 
 @router.post("/{patient_id}/upload")
-async def upload_patient_file(
+def upload_patient_file(
     patient_id: int, 
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
@@ -674,7 +689,7 @@ async def upload_patient_file(
                 tmp_path = temp_file.name
                 
                 # Check Magic Bytes to prevent spoofing
-                first_chunk = await file.read(1024 * 1024)
+                first_chunk = file.file.read(1024 * 1024)
                 if not first_chunk:
                     raise HTTPException(status_code=400, detail="Empty file upload")
                     
@@ -683,29 +698,10 @@ async def upload_patient_file(
                     
                 # Continue writing file
                 temp_file.write(first_chunk)
-                while content := await file.read(1024 * 1024): # 1MB chunks
+                while content := file.file.read(1024 * 1024): # 1MB chunks
                     temp_file.write(content)
 
-            # --- COMPRESSION STEP ---
-            file_size = os.path.getsize(tmp_path)
-            if ext == '.pdf' and file_size > 5 * 1024 * 1024: # > 5MB
-                try:
-                    from ..services.compression import compress_pdf
-                    print(f"📉 Compress candidate: {file.filename} ({file_size/1024/1024:.2f} MB)")
-                    
-                    with open(tmp_path, "rb") as f:
-                        original_bytes = f.read()
-                        
-                    compressed_bytes = compress_pdf(original_bytes)
-                    
-                    if len(compressed_bytes) < file_size:
-                        with open(tmp_path, "wb") as f:
-                            f.write(compressed_bytes)
-                        print(f"✅ Replaced with compressed version: {len(compressed_bytes)/1024/1024:.2f} MB")
-                except Exception as comp_e:
-                    print(f"⚠️ Compression skipped due to error: {comp_e}")
-            # ------------------------
-                    
+            # Compression runs in process_upload_task, not on the request
         except Exception as e:
             print(f"Disk Write Error: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to save upload to server temp: {str(e)}")
@@ -713,6 +709,7 @@ async def upload_patient_file(
         # 2. Create Initial DB Record
         new_file = PDFFile(
             record_id=patient_id,
+            hospital_id=patient.hospital_id,
             filename=file.filename,
             file_path=tmp_path, # FIX: Populate file_path
             s3_key="pending", 
@@ -888,33 +885,16 @@ def get_next_mrd_id(hospital_id: Optional[int] = None, db: Session = Depends(get
     if not target_hospital_id:
         raise HTTPException(status_code=400, detail="Hospital Context Required")
 
-    # Fetch all UIDs for this hospital to find max
-    # Note: This is a simple approach. For high scale, use a sequence or dedicated counter table.
-    patients = db.query(Patient.patient_u_id).filter(Patient.hospital_id == target_hospital_id).all()
-    
-    max_val = 0
-    prefix = "" 
-    
-    import re # Ensure imported
-    
-    # Simple heuristic: Look for pattern Prefix+Number or just Number
-    for p in patients:
-        uid = p.patient_u_id
-        # Extract number from end
-        match = re.search(r'(\d+)$', uid)
-        if match:
-            num_part = int(match.group(1))
-            if num_part > max_val:
-                max_val = num_part
-                # Update prefix if this is the max (best guess at current series)
-                prefix = uid[:match.start()]
+    # Preview only (not reserved): a create with a blank MRD allocates the number.
+    # Counter row per hospital (seeded from the existing UIDs on first use)
+    max_val, last_uid = SequenceService.peek(db, "mrd", target_hospital_id)
+
+    # Keep the prefix of the current series (e.g. "MRD-" from "MRD-1042")
+    prefix = mrd_prefix(last_uid)
 
     # If no patients, start at 1
     next_val = max_val + 1
     
-    # Simple zero-padding logic: if max_val likely came from a padded string (impossible to know for sure without original str)
-    # But usually 5 or 6 digits is standard. Let's return raw next string for now based on prefix.
-    
     last_id = f"{prefix}{max_val}" if max_val > 0 else "None"
     next_id = f"{prefix}{next_val}"
     
@@ -954,40 +934,41 @@ def get_unique_doctors(
     return sorted(list(doctors))
 
 @router.get("/", response_model=List[PatientResponse])
-def get_patients(
+async def get_patients(
     q: Optional[str] = None, 
     unassigned_only: bool = False,
     hospital_id: Optional[int] = None, # New: Allow filtering by specific hospital
     start_date: Optional[datetime.datetime] = None,
     end_date: Optional[datetime.datetime] = None,
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_async_db), 
     current_user: User = Depends(get_current_user)
 ):
     is_platform = current_user.role in ["superadmin", "superadmin_staff"]
     
-    query = db.query(Patient).options(joinedload(Patient.files), joinedload(Patient.box))
+    # Everything the response reads is loaded up front (no lazy loads on an async session)
+    query = select(Patient).options(selectinload(Patient.files), joinedload(Patient.box), joinedload(Patient.hospital))
     
     if unassigned_only:
-        query = query.filter(Patient.physical_box_id == None)
+        query = query.where(Patient.physical_box_id == None)
 
     if not is_platform:
         # Standard Staff: RESTRICT to their own hospital
-        query = query.filter(Patient.hospital_id == current_user.hospital_id)
+        query = query.where(Patient.hospital_id == current_user.hospital_id)
     else:
         # Platform Staff:
         # If hospital_id is provided, filter by it.
         # If NOT provided, return ALL (or maybe we should force selection for performance? logic below allows all)
         if hospital_id:
-            query = query.filter(Patient.hospital_id == hospital_id)
+            query = query.where(Patient.hospital_id == hospital_id)
     
     # Apply Date Filtering
     if start_date:
-        query = query.filter(or_(Patient.discharge_date >= start_date, Patient.admission_date >= start_date))
+        query = query.where(or_(Patient.discharge_date >= start_date, Patient.admission_date >= start_date))
     if end_date:
-        query = query.filter(or_(Patient.discharge_date <= end_date, Patient.admission_date <= end_date))
+        query = query.where(or_(Patient.discharge_date <= end_date, Patient.admission_date <= end_date))
 
     if q:
-        query = query.filter(
+        query = query.where(
             or_(
                 Patient.full_name.ilike(f"%{q}%"),
                 Patient.patient_u_id.ilike(f"%{q}%"),
@@ -996,32 +977,16 @@ def get_patients(
             )
         )
     
-    patients = query.all()
+    patients = (await db.execute(query)).scalars().all()
     for p in patients:
         p.hospital_name = p.hospital.legal_name if p.hospital else "Unknown"
-        # Accessing properties to ensures they are populated for Pydantic if needed
-        # (Though Pydantic's from_attributes handles it)
-        _ = p.box_label
-        _ = p.box_location_code
         
     return patients
 
-@router.get("/{patient_id}", response_model=PatientDetailResponse)
-def get_patient(patient_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    is_platform = current_user.role in ["superadmin", "superadmin_staff"]
-    
-    query = db.query(Patient).options(joinedload(Patient.files), joinedload(Patient.box)).filter(Patient.record_id == patient_id)
-    if not is_platform:
-        query = query.filter(Patient.hospital_id == current_user.hospital_id)
-    
-    patient = query.first()
-    
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-        
-    # Populate S3 Glacier Status
+def populate_storage_class(files):
+    """Blocking S3 HEAD per confirmed file: Glacier / restore status for the detail view."""
     s3_manager = S3Manager()
-    for f in (patient.files or []):
+    for f in files:
         if f.upload_status == 'confirmed' and f.s3_key:
             info = s3_manager.get_object_info(f.s3_key)
             if info:
@@ -1035,6 +1000,24 @@ def get_patient(patient_id: int, db: Session = Depends(get_db), current_user: Us
                 else:
                     f.restore_status = None
 
+@router.get("/{patient_id}", response_model=PatientDetailResponse)
+async def get_patient(patient_id: int, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    is_platform = current_user.role in ["superadmin", "superadmin_staff"]
+    
+    query = select(Patient).options(
+        selectinload(Patient.files), joinedload(Patient.box), joinedload(Patient.hospital)
+    ).where(Patient.record_id == patient_id)
+    if not is_platform:
+        query = query.where(Patient.hospital_id == current_user.hospital_id)
+    
+    patient = (await db.execute(query)).scalars().first()
+    
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+        
+    # Populate S3 Glacier Status
+    await run_in_threadpool(populate_storage_class, patient.files or [])
+
     patient.hospital_name = patient.hospital.legal_name if patient.hospital else "Unknown"
     return patient
 
@@ -1138,7 +1121,7 @@ def update_ocr_text(file_id: int, body: OCRUpdateRequest, db: Session = Depends(
     return {"status": "success", "message": "OCR Text updated successfully"}
 
 @router.post("/extract-details")
-async def extract_patient_details_from_file(
+def extract_patient_details_from_file(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -1179,7 +1162,7 @@ async def extract_patient_details_from_file(
         from ..services.ai_service import AIService
         ai_service = AIService(api_key=api_key)
 
-        content = await file.read()
+        content = file.file.read()
         filename = file.filename.lower()
         extracted_text = ""
         extracted_json = None
@@ -1404,6 +1387,7 @@ def serve_file(
         success = s3_manager.download_to_temp_cache(pdf_file.s3_key, encrypted_temp_path)
         if not success:
             raise HTTPException(status_code=404, detail="Physical file not found in storage")
+        StorageTiering.record_access(pdf_file.file_id, pdf_file.hospital_id, "serve")
 
         # 2. Decrypt from disk to disk
         print(f"🔓 Decrypting {pdf_file.filename} (Disk-to-Disk)...")
@@ -1442,8 +1426,8 @@ def serve_file(
         raise HTTPException(status_code=500, detail=f"Failed to serve file: {str(e)}")
 
 @router.get("/files/{file_id}/status")
-def get_file_status(file_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    file = db.query(PDFFile).filter(PDFFile.file_id == file_id).first()
+async def get_file_status(file_id: int, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    file = await db.get(PDFFile, file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
         
@@ -1457,7 +1441,6 @@ def get_file_status(file_id: int, db: Session = Depends(get_db), current_user: U
 @router.post("/files/{file_id}/restore")
 def request_restore_from_glacier(
     file_id: int, 
-    background_tasks: BackgroundTasks,
     tier: str = 'Standard', # Standard, Expedited, Bulk
     db: Session = Depends(get_db), 
     current_user: User = Depends(get_current_user)
@@ -1493,56 +1476,15 @@ def request_restore_from_glacier(
         hospital_name=pdf_file.patient.hospital.legal_name
     )
 
-    # Trigger monitoring task (Passing requester's email for final delivery)
-    background_tasks.add_task(monitor_restoration_and_email, file_id, current_user.email)
+    # Tracked by the restore_tracker job, which emails the file to the requester once ready
+    restore = RestoreTracker.track(db, pdf_file, current_user.email, tier=tier, user_id=current_user.user_id)
     
     return {
         "status": "success", 
+        "restore_id": restore.restore_id,
         "message": f"Restoration ({tier}) initiated. Once complete, the file will be sent to {current_user.email}."
     }
 
-def monitor_restoration_and_email(file_id: int, hospital_email: str):
-    """
-    Background worker to poll S3 and email file when ready.
-    Designed for 'Expedited' tier mostly (polls for 10 mins).
-    """
-    import time
-    from ..services.email_service import EmailService
-    
-    # We use a fresh session for background task
-    db = SessionLocal()
-    s3_manager = S3Manager()
-    try:
-        # Check every 60s for 6 hours (Standard retrieval limit). 
-        for _ in range(360): 
-            f = db.query(PDFFile).filter(PDFFile.file_id == file_id).first()
-            if not f: break
-            
-            info = s3_manager.get_object_info(f.s3_key)
-            if not info: break
-            
-            restore_str = info.get('Restore', '')
-            if restore_str and 'ongoing-request="false"' in restore_str:
-                # READY!
-                content = s3_manager.get_file_bytes(f.s3_key)
-                if content:
-                    decrypted = decrypt_data(content)
-                    EmailService.send_file_retrieval_success_email(
-                        recipient_email=hospital_email,
-                        hospital_name=f.patient.hospital.legal_name,
-                        patient_name=f.patient.full_name,
-                        mrd_number=f.patient.patient_u_id,
-                        filename=f.filename,
-                        file_content=decrypted
-                    )
-                break
-            time.sleep(60)
-    except Exception as e:
-        db.rollback()
-        print(f"❌ monitor_restoration error: {e}")
-    finally:
-        db.close()
-
 @router.post("/files/{file_id}/cancel")
 def cancel_upload(file_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     file = db.query(PDFFile).filter(PDFFile.file_id == file_id).first()
@@ -1687,7 +1629,7 @@ def list_pending_deletions(db: Session = Depends(get_db), current_user: User = D
     ]
 
 @router.delete("/files/{file_id}")
-async def delete_file(
+def delete_file(
     file_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -1873,7 +1815,6 @@ def request_file_download(
         try:
             from ..audit import log_audit
             log_audit(db, current_user.user_id, "FILE_LINK_GENERATED", f"Generated direct link for {pdf_file.filename}", hospital_id=pdf_file.patient.hospital_id)
-            db.commit()
         except: pass
 
         return {
@@ -1903,6 +1844,7 @@ def request_file_download(
     encrypted_bytes = s3_manager.get_file_bytes(pdf_file.s3_key)
     if not encrypted_bytes:
         raise HTTPException(status_code=404, detail="Physical file not found in storage")
+    StorageTiering.record_access(pdf_file.file_id, hospital.hospital_id, "download")
         
     try:
         decrypted_bytes = decrypt_data(encrypted_bytes)
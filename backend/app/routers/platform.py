@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 import os
 
 from ..database import get_db
-from ..models import SystemSetting, User, UserRole, Permission
+from ..models import PendingRestore, RetentionRun, ScheduledJob, SystemSetting, User, UserRole, Permission
 from ..routers.auth import get_current_user, require_permission
 from ..audit import log_audit
 
@@ -24,7 +25,7 @@ async def health_check():
     }
 
 @router.get("/settings")
-async def get_settings(db: Session = Depends(get_db)):
+def get_settings(db: Session = Depends(get_db)):
     # All users can arguably see settings (like announcement), but only admin can edit.
     try:
         settings = db.query(SystemSetting).all()
@@ -38,7 +39,7 @@ async def get_settings(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Database error while fetching settings: {str(e)}")
 
 @router.post("/settings/{key}")
-async def update_setting(key: str, update: SettingUpdate, db: Session = Depends(get_db), current_user: User = Depends(require_permission(Permission.MANAGE_PLATFORM_SETTINGS))):
+def update_setting(key: str, update: SettingUpdate, db: Session = Depends(get_db), current_user: User = Depends(require_permission(Permission.MANAGE_PLATFORM_SETTINGS))):
     # RBAC handles authorization instead of hardcoded SUPER_ADMIN check
     
     setting = db.query(SystemSetting).filter(SystemSetting.key == key).first()
@@ -58,7 +59,7 @@ async def update_setting(key: str, update: SettingUpdate, db: Session = Depends(
     return {"status": "success", "key": key, "value": update.value}
 
 @router.post("/clear-cache")
-async def clear_system_cache(
+def clear_system_cache(
     request: Request,
     db: Session = Depends(get_db), 
     current_user: User = Depends(require_permission(Permission.MANAGE_PLATFORM_SETTINGS))
@@ -88,7 +89,7 @@ from fastapi import BackgroundTasks
 from ..models import PDFFile
 
 @router.post("/bulk-ocr")
-async def run_bulk_ocr(
+def run_bulk_ocr(
     background_tasks: BackgroundTasks,
     limit: int = 50,
     db: Session = Depends(get_db), 
@@ -132,7 +133,7 @@ async def run_bulk_ocr(
     }
 
 @router.get("/system-error-logs")
-async def get_system_error_logs(
+def get_system_error_logs(
     db: Session = Depends(get_db), 
     current_user: User = Depends(require_permission(Permission.VIEW_ALL_AUDITS)),
     limit: int = 50
@@ -151,7 +152,7 @@ async def get_system_error_logs(
         raise HTTPException(status_code=500, detail="Could not fetch system error logs")
 
 @router.get("/ocr-status")
-async def get_ocr_status(
+def get_ocr_status(
     db: Session = Depends(get_db), 
     current_user: User = Depends(get_current_user)
 ):
@@ -185,8 +186,113 @@ async def get_ocr_status(
         print(f"OCR Status Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/loop-blocks")
+def get_loop_blocks(
+    request: Request,
+    current_user: User = Depends(require_permission(Permission.VIEW_ALL_AUDITS))
+):
+    """
+    Event-loop stalls seen by this worker, grouped by endpoint (see core/loop_monitor.py).
+    """
+    monitor = getattr(request.app.state, "loop_monitor", None)
+    if not monitor:
+        return {"enabled": False}
+    return {"enabled": True, **monitor.stats()}
+
+@router.get("/perf")
+def get_perf_summary(
+    top: int = 20,
+    current_user: User = Depends(require_permission(Permission.VIEW_ALL_AUDITS))
+):
+    """
+    Routes of this worker ranked by DB time, and routes with suspected N+1 query patterns
+    (see core/sql_instrumentation.py).
+    """
+    from ..core.config import settings
+    from ..core.sql_instrumentation import QueryStats
+    return {"enabled": settings.SQL_INSTRUMENTATION, **QueryStats.summary(top)}
+
+@router.get("/scheduler")
+def get_scheduled_jobs(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_permission(Permission.VIEW_ALL_AUDITS))
+):
+    """
+    Periodic jobs with their lease holder and last run (see services/scheduler.py).
+    """
+    jobs = db.query(ScheduledJob).order_by(ScheduledJob.name).all()
+    return [
+        {column.name: getattr(job, column.name) for column in ScheduledJob.__table__.columns}
+        for job in jobs
+    ]
+
+@router.get("/retention")
+def get_retention_status(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_permission(Permission.VIEW_ALL_AUDITS))
+):
+    """
+    What the next retention cleanup would remove (dry run) and the latest runs with
+    their checkpoints (see services/cleanup_service.py).
+    """
+    from ..services.cleanup_service import CleanupService
+    runs = db.query(RetentionRun).order_by(RetentionRun.run_id.desc()).limit(10).all()
+    return {
+        "pending": CleanupService.run_retention_policy(db, dry_run=True),
+        "runs": [
+            {column.name: getattr(run, column.name) for column in RetentionRun.__table__.columns}
+            for run in runs
+        ]
+    }
+
+@router.get("/storage-tiering")
+def get_storage_tiering_plan(
+    hospital_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_permission(Permission.VIEW_ALL_AUDITS))
+):
+    """
+    Dry run of the storage tiering job: per hospital / category access statistics, the
+    transitions it would make and their projected cost and retrieval latency
+    (see services/storage_tiering.py).
+    """
+    from ..services.storage_tiering import StorageTiering
+    return StorageTiering.plan(db, hospital_id)
+
+@router.post("/storage-tiering/run")
+def run_storage_tiering(
+    hospital_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_permission(Permission.MANAGE_PLATFORM_SETTINGS))
+):
+    """Execute the planned transitions now instead of waiting for the daily job."""
+    from ..services.storage_tiering import StorageTiering
+    result = StorageTiering.run(db, hospital_id, limit)
+    log_audit(db, current_user.user_id, "STORAGE_TIERING_RUN", f"Storage tiering run: {result}")
+    db.commit()
+    return result
+
+@router.get("/restores")
+def get_restores(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_permission(Permission.VIEW_ALL_AUDITS))
+):
+    """
+    Archive restores by status and the latest ones (see services/restore_tracker.py).
+    """
+    from ..services.restore_tracker import RestoreTracker
+    latest = db.query(PendingRestore).order_by(PendingRestore.restore_id.desc()).limit(50).all()
+    return {
+        **RestoreTracker.summary(db),
+        "latest": [
+            {column.name: getattr(r, column.name) for column in PendingRestore.__table__.columns}
+            for r in latest
+        ]
+    }
+
 @router.get("/ocr-logs")
-async def get_ocr_logs(current_user: User = Depends(get_current_user)):
+def get_ocr_logs(current_user: User = Depends(get_current_user)):
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.HOSPITAL_ADMIN, UserRole.PLATFORM_STAFF]:
         raise HTTPException(status_code=403, detail="Not authorized")
         
@@ -222,7 +328,7 @@ from fastapi.responses import FileResponse
 import os
 
 @router.get("/scanner-download")
-async def download_scanner_app():
+def download_scanner_app():
     """
     Downloads the current scanner app.
     """
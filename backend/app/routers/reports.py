@@ -1,10 +1,12 @@
+import csv
+import io
 from datetime import datetime, timedelta, date
 from typing import List, Optional
 from pydantic import BaseModel
 
 from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.responses import StreamingResponse
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session, joinedload, subqueryload
 
 from ..database import get_db
@@ -13,11 +15,12 @@ from ..models import (
     Hospital,
     Patient,
     PDFFile,
-    PhysicalBox,
     User,
     UserRole,
 )
 from ..routers.auth import get_current_user
+from ..services.billing_service import BillingService
+from ..services.occupancy import WarehouseOccupancy
 
 router = APIRouter()
 
@@ -60,6 +63,14 @@ def apply_date_filter(query, date_column, start_date: Optional[date], end_date:
         query = query.filter(date_column < (end_date + timedelta(days=1)))
     return query
 
+def resolve_hospital_scope(user: User, target_hospital_id: Optional[int]) -> Optional[int]:
+    """Same rules as apply_hospital_filter, returned as an id for service-layer queries."""
+    if user.role == UserRole.SUPER_ADMIN:
+        return target_hospital_id
+    if not user.hospital_id:
+        raise HTTPException(status_code=403, detail="User has no hospital context")
+    return user.hospital_id
+
 # --- Endpoints ---
 
 @router.get("/billing")
@@ -71,41 +82,30 @@ def get_billing_report(
     db: Session = Depends(get_db), 
     current_user: User = Depends(get_current_user)
 ):
-    query = db.query(PDFFile).join(Patient).options(joinedload(PDFFile.patient))
-    query = apply_hospital_filter(query, Patient, current_user, hospital_id)
-    query = apply_date_filter(query, PDFFile.upload_date, start_date, end_date)
-    
-    files = query.all()
+    filters = {
+        "hospital_id": resolve_hospital_scope(current_user, hospital_id),
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+    # Cost Logic (Base Price + Extra Pages * Price Per Page) is evaluated in SQL by BillingService
+    rows = BillingService.file_rows(db, **filters).all()
     
     data = []
-    total_cost = 0.0
-    
-    for f in files:
-        # Cost Logic: Base Price + (Extra Pages * Price Per Page)
-        # Using historical captured price if available, else current patient/hospital price
-        base_price = f.price_per_file or 100.0
-        included = f.included_pages or 20
-        extra_rate = f.price_per_extra_page or 1.0
-        
-        page_count = f.page_count or 0
-        extra_pages = max(0, page_count - included)
-        cost = base_price + (extra_pages * extra_rate)
-        total_cost += cost
-        
+    for f in rows:
         row = {
             "file_id": f.file_id,
             "record_id": f.record_id,
             "upload_date": f.upload_date.strftime("%d/%m/%Y %H:%M") if f.upload_date else "N/A",
-            "patient_name": f.patient.full_name,
-            "mrd": f.patient.patient_u_id,
-            "uhid": f.patient.uhid, # Added Field
-            "age": f.patient.age,   # Added Field
-            "admission_date": f.patient.admission_date.strftime("%d/%m/%Y") if f.patient.admission_date else None, # Added Field
-            "discharge_date": f.patient.discharge_date.strftime("%d/%m/%Y") if f.patient.discharge_date else None, # Added Field
+            "patient_name": f.patient_name,
+            "mrd": f.patient_u_id,
+            "uhid": f.uhid, # Added Field
+            "age": f.age,   # Added Field
+            "admission_date": f.admission_date.strftime("%d/%m/%Y") if f.admission_date else None, # Added Field
+            "discharge_date": f.discharge_date.strftime("%d/%m/%Y") if f.discharge_date else None, # Added Field
             "filename": f.filename,
-            "page_count": page_count,
-            "file_size_mb": round(f.file_size_mb, 2),
-            "cost": round(cost, 2),
+            "page_count": f.page_count or 0,
+            "file_size_mb": round(f.file_size_mb or 0.0, 2),
+            "cost": round(f.cost, 2),
             "status": f.upload_status,
             "is_paid": f.is_paid or False,
             "payment_date": f.payment_date.strftime("%d/%m/%Y") if f.payment_date else None
@@ -127,15 +127,41 @@ def get_billing_report(
             headers={"Content-Disposition": f"attachment; filename=billing_report_{datetime.now().strftime('%Y%m%d')}.csv"}
         )
 
+    summary = BillingService.summary(db, **filters)
     return {
         "summary": {
-            "total_files": len(files),
-            "total_cost": round(total_cost, 2),
+            "total_files": summary["total_files"],
+            "total_cost": summary["total_cost"],
             "currency": "INR"
         },
         "data": data
     }
 
+@router.get("/billing/summary")
+def get_billing_summary(
+    hospital_id: Optional[int] = None, 
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(get_db), 
+    current_user: User = Depends(get_current_user)
+):
+    """Billing preview: totals plus per hospital / per month aggregates, without per-file rows."""
+    filters = {
+        "hospital_id": resolve_hospital_scope(current_user, hospital_id),
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+    summary = BillingService.summary(db, **filters)
+    return {
+        "summary": {
+            "total_files": summary["total_files"],
+            "total_pages": summary["total_pages"],
+            "total_cost": summary["total_cost"],
+            "currency": "INR"
+        },
+        "periods": BillingService.period_aggregates(db, **filters)
+    }
+
 @router.get("/inventory")
 def get_inventory_report(
     hospital_id: Optional[int] = None, 
@@ -144,46 +170,9 @@ def get_inventory_report(
     db: Session = Depends(get_db), 
     current_user: User = Depends(get_current_user)
 ):
-    query = db.query(PhysicalBox).options(joinedload(PhysicalBox.rack))
-    query = apply_hospital_filter(query, PhysicalBox, current_user, hospital_id)
-    
-    if search:
-        search_term = f"%{search}%"
-        # Need to join rack if searching rack label, but let's stick to box fields for simplicity or simple join
-        # PhysicalBox has relationship `rack`
-        query = query.outerjoin(PhysicalBox.rack).filter(
-            or_(
-                PhysicalBox.label.ilike(search_term),
-                PhysicalBox.location_code.ilike(search_term),
-                # PhysicalBox.rack.has(Rack.label.ilike(search_term)) # If using has
-                # Since we joined, we can filter on Rack model if imported. 
-                # Let's simplify and search local fields first. 
-                # To search rack label, we need Rack model or aliases. 
-                # Let's stick to Box Label and Location for now to avoid complexity without Rack model import.
-                # Actually, Rack model is likely available via relationships.
-                PhysicalBox.description.ilike(search_term)
-            )
-        )
-    
-    boxes = query.all()
-    data = []
-    
-    for b in boxes:
-        # Patient Count
-        p_count = db.query(Patient).filter(Patient.physical_box_id == b.box_id).count()
-        utilization = round((p_count / (b.capacity or 50)) * 100, 1) if b.capacity else 0
-        
-        row = {
-            "box_label": b.label,
-            "location": b.location_code,
-            "rack": b.rack.label if b.rack else "Unassigned",
-            "status": b.status,
-            "files_stored": p_count,
-            "capacity": b.capacity,
-            "utilization_pct": utilization,
-            "created_at": b.created_at.strftime("%d/%m/%Y") if b.created_at else "N/A"
-        }
-        data.append(row)
+    # Rows come from the in-memory occupancy model
+    scope = resolve_hospital_scope(current_user, hospital_id)
+    data = WarehouseOccupancy.inventory(db, hospital_id=scope, search=search)
         
     if export_csv:
         output = io.StringIO()
@@ -262,6 +251,10 @@ def mark_files_as_paid(
     for f in files:
         f.is_paid = payload.is_paid
         f.payment_date = datetime.utcnow() if payload.is_paid else None
+        if payload.is_paid:
+            f.billing_status = "PAID"
+        else:
+            f.billing_status = "INVOICED" if f.invoice_id else "UNBILLED"
         count += 1
         
     db.commit()
@@ -1,14 +1,16 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from fastapi.responses import Response
-from ..services.scanner.doc_scanner import process_document
 import io
 
 router = APIRouter(prefix="/scanner", tags=["scanner"])
 
 @router.post("/process")
-async def scan_document(file: UploadFile = File(...)):
+def scan_document(file: UploadFile = File(...)):
     try:
-        contents = await file.read()
+        # OpenCV / scipy are only loaded by workers that actually scan
+        from ..services.scanner.doc_scanner import process_document
+
+        contents = file.file.read()
         # process_document returns jpeg bytes
         processed_data = process_document(contents)
         return Response(content=processed_data, media_type="image/jpeg")
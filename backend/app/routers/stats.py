@@ -3,10 +3,10 @@ from datetime import date, datetime, timedelta
 from typing import Dict, Optional
 
 from fastapi import APIRouter, Depends, Request
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy import distinct, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database import get_db
+from ..database import get_async_db
 from ..models import (
     AuditLog,
     FileRequest,
@@ -23,11 +23,19 @@ router = APIRouter(
     tags=["stats"]
 )
 
+def percent_trend(new: int, old: int) -> str:
+    if old > 0:
+        diff = ((new - old) / old) * 100
+        return f"{'+' if diff >= 0 else ''}{int(diff)}%"
+    if new > 0:
+        return f"+{new}"
+    return "+0%"
+
 @router.get("/dashboard")
-def get_dashboard_stats(
+async def get_dashboard_stats(
     request: Request, 
     hospital_id: Optional[int] = None,
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_async_db), 
     current_user: User = Depends(get_current_user)
 ) -> Dict:
     
@@ -43,34 +51,29 @@ def get_dashboard_stats(
         target_hospital_id = current_user.hospital_id
         is_drilled_down = False
 
-    # 1. User Stats & Trend
+    now = datetime.utcnow()
+    last_24h = now - timedelta(hours=24)
+    prev_24h = now - timedelta(hours=48)
+    today_start = datetime.combine(date.today(), datetime.min.time())
+    patient_scope = [Patient.hospital_id == target_hospital_id] if target_hospital_id else []
+
+    # 1. User Stats & Trend (one pass with conditional counts)
     try:
-        q_users = db.query(User)
+        # Active Users (last 15 mins); trend: users joined in last 24h vs previous 24h
+        fifteen_mins_ago = now - timedelta(minutes=15)
+        q_users = select(
+            func.count(),
+            func.count().filter(User.last_active_at >= fifteen_mins_ago),
+            func.count().filter(User.created_at >= last_24h),
+            func.count().filter(User.created_at >= prev_24h, User.created_at < last_24h)
+        ).select_from(User)
         if target_hospital_id: 
-            q_users = q_users.filter(User.hospital_id == target_hospital_id)
-        
-        user_count = q_users.count()
-        
-        # Active Users (last 15 mins)
-        fifteen_mins_ago = datetime.utcnow() - timedelta(minutes=15)
-        active_users = q_users.filter(User.last_active_at >= fifteen_mins_ago).count()
-    
-        # Trend: Users joined in last 24h vs previous 24h
-        now = datetime.utcnow()
-        last_24h = now - timedelta(hours=24)
-        prev_24h = now - timedelta(hours=48)
-        
-        new_users_24h = q_users.filter(User.created_at >= last_24h).count()
-        old_users_24h = q_users.filter(User.created_at >= prev_24h, User.created_at < last_24h).count()
+            q_users = q_users.where(User.hospital_id == target_hospital_id)
         
-        user_trend = "+0%"
-        if old_users_24h > 0:
-            diff = ((new_users_24h - old_users_24h) / old_users_24h) * 100
-            user_trend = f"{'+' if diff >= 0 else ''}{int(diff)}%"
-        elif new_users_24h > 0:
-            user_trend = f"+{new_users_24h}"
+        user_count, active_users, new_users_24h, old_users_24h = (await db.execute(q_users)).one()
+        user_trend = percent_trend(new_users_24h, old_users_24h)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (Users): {e}")
         user_count = 0
         active_users = 0
@@ -78,23 +81,16 @@ def get_dashboard_stats(
 
     # 2. Patient Data & Trend
     try:
-        q_patients = db.query(Patient)
-        if target_hospital_id: 
-            q_patients = q_patients.filter(Patient.hospital_id == target_hospital_id)
-        
-        patient_count = q_patients.count()
+        q_patients = select(
+            func.count(),
+            func.count().filter(Patient.created_at >= last_24h),
+            func.count().filter(Patient.created_at >= prev_24h, Patient.created_at < last_24h)
+        ).select_from(Patient).where(*patient_scope)
         
-        new_patients_24h = q_patients.filter(Patient.created_at >= last_24h).count()
-        old_patients_24h = q_patients.filter(Patient.created_at >= prev_24h, Patient.created_at < last_24h).count()
-        
-        patient_trend = "+0%"
-        if old_patients_24h > 0:
-            diff = ((new_patients_24h - old_patients_24h) / old_patients_24h) * 100
-            patient_trend = f"{'+' if diff >= 0 else ''}{int(diff)}%"
-        elif new_patients_24h > 0:
-            patient_trend = f"+{new_patients_24h}"
+        patient_count, new_patients_24h, old_patients_24h = (await db.execute(q_patients)).one()
+        patient_trend = percent_trend(new_patients_24h, old_patients_24h)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (Patients): {e}")
         patient_count = 0
         patient_trend = "Error"
@@ -102,65 +98,64 @@ def get_dashboard_stats(
     # 3. Warehouse Data
     try:
         if is_super and not is_drilled_down:
-            box_count = db.query(PhysicalBox).count()
+            box_count = await db.scalar(select(func.count()).select_from(PhysicalBox))
             warehouse_capacity_pct = round((box_count / 5000) * 100, 1) if box_count > 0 else 0
         else:
             # For individual hospital, show their specific box count if assigned
-            box_count = db.query(PhysicalBox).join(Patient).filter(Patient.hospital_id == target_hospital_id).distinct().count()
+            box_count = await db.scalar(
+                select(func.count(distinct(Patient.physical_box_id))).where(Patient.hospital_id == target_hospital_id)
+            )
             warehouse_capacity_pct = 0
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (Warehouse): {e}")
         box_count = 0
         warehouse_capacity_pct = 0
-    
-    # 4. Requests (Pending) & Today's Scans
-    try:
-        q_reqs = db.query(FileRequest).filter(FileRequest.status == "Pending")
-        if target_hospital_id:
-            q_reqs = q_reqs.filter(FileRequest.hospital_id == target_hospital_id)
-        pending_requests = q_reqs.count()
 
-        # Calculate Today's Scans
-        today_start = datetime.combine(date.today(), datetime.min.time())
-        q_todays_scans = db.query(PDFFile).filter(PDFFile.upload_date >= today_start)
+    # File aggregates for today's scans, storage, billing and the 7-day activity trend
+    # (sections 4, 7, 8 and 12) in a single scan
+    day_starts = [datetime.combine(date.today() - timedelta(days=i), datetime.min.time()) for i in range(6, -1, -1)]
+    confirmed = PDFFile.upload_status == 'confirmed'
+    file_stats = None
+    try:
+        q_files = select(
+            func.count().filter(PDFFile.upload_date >= today_start),
+            func.sum(PDFFile.file_size).filter(confirmed),
+            func.sum(PDFFile.file_size).filter(confirmed, PDFFile.upload_date >= last_24h),
+            func.count().filter(confirmed),
+            *[
+                func.count().filter(PDFFile.upload_date >= day_start, PDFFile.upload_date < day_start + timedelta(days=1))
+                for day_start in day_starts
+            ]
+        ).select_from(PDFFile)
         if target_hospital_id:
-             q_todays_scans = q_todays_scans.join(Patient).filter(Patient.hospital_id == target_hospital_id)
-        todays_scans_count = q_todays_scans.count()
+            q_files = q_files.join(Patient).where(Patient.hospital_id == target_hospital_id)
+        file_stats = (await db.execute(q_files)).one()
     except Exception as e:
-        db.rollback()
-        print(f"Stats Error (Requests): {e}")
-        pending_requests = 0
-        todays_scans_count = 0
+        await db.rollback()
+        print(f"Stats Error (Files): {e}")
     
-    # 5. Recent Activity (Filtered to File Movements for Dashboard)
-    audit_data = []
+    # 4. Requests (Pending) & Today's Scans
     try:
-        q_audit = db.query(AuditLog).filter(AuditLog.action.like("FILE_%"))
-        
+        q_reqs = select(func.count()).select_from(FileRequest).where(FileRequest.status == "Pending")
         if target_hospital_id:
-            q_audit = q_audit.filter(AuditLog.hospital_id == target_hospital_id)
-            
-        recent_audits = q_audit.order_by(AuditLog.timestamp.desc()).limit(8).all()
-        audit_data = [{
-            "id": log.log_id,
-            "action": log.action.replace("FILE_", ""), # Remove prefix for cleaner UI
-            "details": log.details,
-            "time": log.timestamp.strftime("%H:%M") if log.timestamp else "N/A"
-        } for log in recent_audits]
+            q_reqs = q_reqs.where(FileRequest.hospital_id == target_hospital_id)
+        pending_requests = await db.scalar(q_reqs)
     except Exception as e:
-        db.rollback()
-        print(f"Stats Error (Audit): {e}")
+        await db.rollback()
+        print(f"Stats Error (Requests): {e}")
+        pending_requests = 0
+    todays_scans_count = file_stats[0] if file_stats else 0
 
     # 6. QA Issues (Real Data Only)
     qa_data = []
     try:
         from ..models import QAIssue
-        q_qa = db.query(QAIssue).filter(QAIssue.status == "open")
+        q_qa = select(QAIssue).where(QAIssue.status == "open")
         if target_hospital_id:
-            q_qa = q_qa.filter(QAIssue.hospital_id == target_hospital_id)
+            q_qa = q_qa.where(QAIssue.hospital_id == target_hospital_id)
         
-        qa_issues = q_qa.all()
+        qa_issues = (await db.execute(q_qa)).scalars().all()
         qa_data = [{
             "id": i.issue_id,
             "file": i.filename,
@@ -170,7 +165,7 @@ def get_dashboard_stats(
             "timestamp": i.created_at.strftime("%Y-%m-%d") if i.created_at else "N/A"
         } for i in qa_issues]
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (QA): {e}")
 
     # 7. Storage & Trends
@@ -178,12 +173,8 @@ def get_dashboard_stats(
     usage_str = "0 B"
     storage_trend = "+0%"
     storage_capacity_pct = 0
-    try:
-        storage_query = db.query(func.sum(PDFFile.file_size)).filter(PDFFile.upload_status == 'confirmed')
-        if target_hospital_id:
-            storage_query = storage_query.join(Patient).filter(Patient.hospital_id == target_hospital_id)
-        
-        total_bytes = storage_query.scalar() or 0
+    if file_stats:
+        total_bytes = file_stats[1] or 0
         
         # Human Readable Storage (Improved for multi-unit)
         def format_size(size_bytes):
@@ -198,16 +189,13 @@ def get_dashboard_stats(
         usage_str = format_size(total_bytes)
         
         # Storage Trend: New uploads in last 24h
-        new_bytes_24h = storage_query.filter(PDFFile.upload_date >= last_24h).scalar() or 0
+        new_bytes_24h = file_stats[2] or 0
         storage_trend = f"+{format_size(new_bytes_24h)}" if float(new_bytes_24h) > 0 else "+0%"
         
         # 15. Storage Capacity Percentage
         # Assuming max storage per hospital is configurable, defaulting to 1TB
         max_storage_bytes = 1024 * 1024 * 1024 * 1024  # 1TB
         storage_capacity_pct = min(round((total_bytes / max_storage_bytes) * 100, 1), 100)
-    except Exception as e:
-        db.rollback()
-        print(f"Stats Error (Storage): {e}")
 
     # 8. Billing & Revenue (For Detailed Hospital View)
     billing_data = None
@@ -215,13 +203,12 @@ def get_dashboard_stats(
     
     try:
         if target_hospital_id:
-            hospital = db.query(Hospital).filter(Hospital.hospital_id == target_hospital_id).first()
+            hospital = await db.get(Hospital, target_hospital_id)
             if hospital:
                 hospital_name = hospital.legal_name
                 # Simplified Revenue Calculation for Demo: price_per_file * total_files
                 # In a real system, this would consider page counts
-                q_total_files = q_patients.join(PDFFile).filter(PDFFile.upload_status == 'confirmed')
-                total_files = q_total_files.count()
+                total_files = file_stats[3] if file_stats else 0
                 estimated_revenue = total_files * hospital.price_per_file
                 billing_data = {
                     "subscription_tier": hospital.subscription_tier,
@@ -231,18 +218,18 @@ def get_dashboard_stats(
                     "files_count": total_files
                 }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (Billing): {e}")
 
     # 9. Open Boxes Count
     open_boxes_count = 0
     try:
-        q_open_boxes = db.query(PhysicalBox).filter(PhysicalBox.is_open == True)
+        q_open_boxes = select(func.count()).select_from(PhysicalBox).where(PhysicalBox.is_open == True)
         if target_hospital_id:
-            q_open_boxes = q_open_boxes.filter(PhysicalBox.hospital_id == target_hospital_id)
-        open_boxes_count = q_open_boxes.count()
+            q_open_boxes = q_open_boxes.where(PhysicalBox.hospital_id == target_hospital_id)
+        open_boxes_count = await db.scalar(q_open_boxes)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (Boxes): {e}")
     
     # 10. Files Pending QA
@@ -251,49 +238,38 @@ def get_dashboard_stats(
     # 11. Category Breakdown (for pie chart)
     category_breakdown = []
     try:
+        q_categories = select(Patient.patient_category, func.count()).where(*patient_scope).group_by(Patient.patient_category)
+        counts = dict((await db.execute(q_categories)).all())
         for category in ['STANDARD', 'MLC', 'BIRTH', 'DEATH']:
-            q_cat = q_patients.filter(Patient.patient_category == category)
-            count = q_cat.count()
+            count = counts.get(category, 0)
             if count > 0:
                 category_breakdown.append({"name": category, "value": count})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (Categories): {e}")
     
     # 12. Activity Trend (last 7 days for line chart)
     activity_trend = []
-    try:
-        for i in range(6, -1, -1):  # Last 7 days
-            day_start = datetime.combine(date.today() - timedelta(days=i), datetime.min.time())
-            day_end = day_start + timedelta(days=1)
-            
-            q_day_files = db.query(PDFFile).filter(
-                PDFFile.upload_date >= day_start,
-                PDFFile.upload_date < day_end
-            )
-            if target_hospital_id:
-                q_day_files = q_day_files.join(Patient).filter(Patient.hospital_id == target_hospital_id)
-            
-            day_count = q_day_files.count()
+    if file_stats:
+        for day_start, day_count in zip(day_starts, file_stats[4:]):
             activity_trend.append({
                 "day": day_start.strftime("%a"),  # Mon, Tue, etc.
                 "count": day_count
             })
-    except Exception as e:
-        db.rollback()
-        print(f"Stats Error (Activity): {e}")
     
     # 13. Enhanced Recent Activity with Patient Names
     audit_data_enhanced = []
     try:
-        q_audit_enhanced = db.query(AuditLog).filter(AuditLog.action.like("FILE_%"))
+        q_audit_enhanced = select(AuditLog, User.email).outerjoin(User, AuditLog.user_id == User.user_id).where(
+            AuditLog.action.like("FILE_%")
+        )
         
         if target_hospital_id:
-            q_audit_enhanced = q_audit_enhanced.filter(AuditLog.hospital_id == target_hospital_id)
+            q_audit_enhanced = q_audit_enhanced.where(AuditLog.hospital_id == target_hospital_id)
             
-        recent_audits_enhanced = q_audit_enhanced.order_by(AuditLog.timestamp.desc()).limit(10).all()
+        recent_audits_enhanced = (await db.execute(q_audit_enhanced.order_by(AuditLog.timestamp.desc()).limit(10))).all()
         
-        for log in recent_audits_enhanced:
+        for log, user_email in recent_audits_enhanced:
             # Try to extract patient info from details
             patient_name = "Unknown"
             action_type = log.action.replace("FILE_", "")
@@ -309,10 +285,10 @@ def get_dashboard_stats(
                 "patient": patient_name,
                 "details": log.details,
                 "time": log.timestamp.strftime("%H:%M") if log.timestamp else "N/A",
-                "user": log.user.email if log.user else "System"
+                "user": user_email or "System"
             })
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Stats Error (Recent Audits): {e}")
 
     # 14. Recent Uploads (last 24 hours)
@@ -334,7 +310,7 @@ def get_dashboard_stats(
     
     connected_db_str = "Error"
     try:
-       connected_db_str = str(getattr(db.get_bind(), 'url', 'Unknown')).split('@')[-1] if 'sqlite' not in str(getattr(db.get_bind(), 'url', '')) else 'SQLite (Local)'
+       connected_db_str = str(getattr(db.bind, 'url', 'Unknown')).split('@')[-1] if 'sqlite' not in str(getattr(db.bind, 'url', '')) else 'SQLite (Local)'
     except:
        pass
 
@@ -1,12 +1,17 @@
+import hashlib
+import json
+import uuid
 from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 
-from ..database import get_db
+from ..core.config import settings
+from ..database import SessionLocal, get_db
 from ..models import (
     FileRequest,
     Hospital,
@@ -19,6 +24,12 @@ from ..models import (
     UserRole,
 )
 from ..routers.auth import get_current_user
+from ..services.bulk_assign import BulkAssignService
+from ..services.occupancy import WarehouseOccupancy
+from ..services.pick_list import PickListService
+from ..services.rack_slots import RackSlotIndex
+from ..services.scan_ingest import ScanIngestService
+from ..services.sequence_service import SequenceService
 from ..services.storage_service import StorageService
 from ..services.email_service import EmailService
 
@@ -126,6 +137,18 @@ class MovementLogCreate(BaseModel):
     name: str # Patient Name
     dest: str # Destination
 
+class ScanEvent(BaseModel):
+    code: str # Box label or patient MRD / UHID
+    action: str = "AUDIT" # AUDIT, MOVE, CHECK-IN, CHECK-OUT
+    location: Optional[str] = None # RACK-R2-C3 / rack label for boxes, box label for files
+    scanned_at: Optional[datetime] = None
+    device_id: Optional[str] = None
+
+class ScanBatch(BaseModel):
+    batch_id: Optional[str] = None # Groups an audit for /scans/reconciliation
+    device_id: Optional[str] = None
+    events: List[ScanEvent]
+
 class MovementLogResponse(BaseModel):
     id: int
     type: str
@@ -275,48 +298,43 @@ def get_warehouse_layout(db: Session = Depends(get_db), current_user: User = Dep
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER, UserRole.PLATFORM_STAFF, UserRole.HOSPITAL_ADMIN]:
         return []
 
-    # Fetch all racks (Racks are now shared warehouse resources)
-    db_racks = db.query(PhysicalRack).all()
-    
-    if not db_racks:
-        return []
-
-    # Optimize: Single Aggregation Query for Rack Occupancy
-    # SELECT rack_id, COUNT(*) FROM physical_box WHERE rack_id IN (...) GROUP BY rack_id
-    rack_ids = [r.rack_id for r in db_racks]
-    occupancy_data = db.query(
-        PhysicalBox.rack_id, 
-        func.count(PhysicalBox.box_id)
-    ).filter(
-        PhysicalBox.rack_id.in_(rack_ids)
-    ).group_by(PhysicalBox.rack_id).all()
-    
-    # Map occupancy to rack_id
-    occupancy_map = {r_id: count for r_id, count in occupancy_data}
-
-    layout_map = {}
-    for rack in db_racks:
-        if rack.aisle not in layout_map:
-            layout_map[rack.aisle] = []
-        
-        # O(1) Lookup
-        occupied = occupancy_map.get(rack.rack_id, 0)
-        
-        layout_map[rack.aisle].append({
-            "id": str(rack.rack_id),
-            "name": rack.label,
-            "capacity": rack.capacity,
-            "occupied": occupied
-        })
+    # Racks are shared warehouse resources; served from the per-worker occupancy model
+    return WarehouseOccupancy.layout(db)
 
-    result = []
-    for aisle_num in sorted(layout_map.keys()):
-        result.append({
-            "aisle": aisle_num,
-            "racks": layout_map[aisle_num]
-        })
-        
-    return result
+def _layout_label_scope(current_user: User) -> Optional[int]:
+    """Hospital whose box labels the user may see in slot views (None = all)."""
+    if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER, UserRole.PLATFORM_STAFF, UserRole.HOSPITAL_ADMIN]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if current_user.role in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
+        return None
+    if not current_user.hospital_id:
+        raise HTTPException(status_code=403, detail="User has no hospital context")
+    return current_user.hospital_id
+
+@router.get("/layout/heatmap")
+def get_layout_heatmap(
+    aisle: Optional[int] = None,
+    rack_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Per-slot fill % grid of each rack (optionally one aisle or rack)."""
+    return WarehouseOccupancy.heatmap(db, aisle=aisle, rack_id=rack_id, hospital_id=_layout_label_scope(current_user))
+
+@router.get("/layout/export")
+def export_layout(request: Request, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    The whole occupancy model as column-ordered arrays. Sends an ETag, so polling
+    clients get 304 Not Modified until something changes.
+    """
+    hospital_id = _layout_label_scope(current_user)
+    model = WarehouseOccupancy.export(db, hospital_id=hospital_id)
+    body = json.dumps(model, separators=(",", ":"), default=str).encode()
+    # Content hash: the same for every worker holding the same data, and across restarts
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 # --- New Models ---
 class BoxStatusUpdate(BaseModel):
@@ -370,111 +388,21 @@ def bulk_assign_files(req: BulkAssignRequest, db: Session = Depends(get_db), cur
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER, UserRole.HOSPITAL_ADMIN, UserRole.PLATFORM_STAFF]:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    print(f"[DEBUG] Bulk Assign: box_id={req.box_id}, identifiers={req.identifiers}, user={current_user.email}")
-    
-    box = db.query(PhysicalBox).filter(PhysicalBox.box_id == req.box_id).first()
+    box = db.query(PhysicalBox).filter(PhysicalBox.box_id == req.box_id).with_for_update().first()
     if not box:
-        print(f"[DEBUG] Bulk Assign: Box {req.box_id} NOT FOUND")
         raise HTTPException(status_code=404, detail="Box not found")
         
-    print(f"[DEBUG] Bulk Assign: Box {box.box_id} found. is_open={box.is_open}, capacity={box.capacity}")
     if not box.is_open:
         raise HTTPException(status_code=400, detail="This box is CLOSED. Please open it first.")
 
-    # Check current capacity
-    current_count = db.query(Patient).filter(Patient.physical_box_id == box.box_id).count()
-    
-    # Valid scope: Patients must belong to the same hospital as the box
-    target_hospital_id = box.hospital_id
-    
-    success_count = 0
-    errors = []
-    
-    for ident in req.identifiers:
-        # Check if box is full before each assignment
-        if current_count >= box.capacity:
-            # AUTO-EXPAND POLICY:
-            # If current user is Admin/Warehouse/Platform, we increase capacity automatically up to 1000
-            # This prevents "199/200" blockers during bulk operations.
-            if current_user.role in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER, UserRole.PLATFORM_STAFF, UserRole.HOSPITAL_ADMIN] and box.capacity < 1000:
-                 box.capacity = max(box.capacity + 100, current_count + 50) # Give extra breathing room
-                 if box.capacity > 1000: box.capacity = 1000
-                 db.commit() # Save capacity increase immediately
-            
-            # Re-check
-            if current_count >= box.capacity:
-                errors.append(f"{ident}: Box is FULL (capacity: {box.capacity})")
-                continue
-            
-        p = db.query(Patient).filter(
-            Patient.hospital_id == target_hospital_id,
-            (Patient.patient_u_id == ident) | (Patient.uhid == ident)
-        ).first()
-
-        if not p:
-            # Try parsing as int for record_id (Frontend sends record_id)
-            try:
-                rid = int(ident)
-                p = db.query(Patient).filter(
-                    Patient.hospital_id == target_hospital_id, 
-                    Patient.record_id == rid
-                ).first()
-            except:
-                pass
-        
-        if not p:
-            errors.append(f"{ident}: Not Found")
-            continue
-
-        # --- NEW: MUST HAVE PDF TO ASSIGN ---
-        # The user requested: "only i can add file to box it contain pdf of patient"
-        # This translates to: Patient record MUST have at least one file entry in PDFFile table.
-        if not p.files or len(p.files) == 0:
-            errors.append(f"{ident}: No digital files found. Please upload PDFs first.")
-            continue
-            
-        if p.physical_box_id == box.box_id:
-            errors.append(f"{ident}: Already in this box")
-            continue
-
-        # Strict Category Check
-        # Normalize Legacy Categories
-        normalize_map = {
-            "STANDARD": "IPD",
-            "GENERAL": "IPD",
-            "MLC": "MCL",
-            "BIRTH": "BRT",
-            "DEATH": "DHT"
-        }
-        
-        p_raw = (p.patient_category or "IPD").upper()
-        p_cat = normalize_map.get(p_raw, p_raw) # Default to self if not in map (e.g., already IPD, OPD)
-        
-        b_raw = (box.category or "IPD").upper()
-        b_cat = normalize_map.get(b_raw, b_raw)
-        
-        if p_cat != b_cat:
-            errors.append(f"{ident}: Mismatch - File is {p_cat}, Box is {b_cat}")
-            continue
-            
-        p.physical_box_id = box.box_id
-        success_count += 1
-        current_count += 1
-        
-    db.commit()
-    
-    # Auto-close box if it reached capacity
-    if current_count >= box.capacity and box.is_open:
-        box.is_open = False
-        box.status = "CLOSED"
-        db.commit()
+    # Patients must belong to the same hospital as the box (resolved inside the service)
+    can_expand = current_user.role in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER, UserRole.PLATFORM_STAFF, UserRole.HOSPITAL_ADMIN]
+    result = BulkAssignService.assign(db, box, req.identifiers, current_user.user_id, can_expand=can_expand)
         
     return {
         "status": "success",
-        "assigned": success_count,
-        "errors": errors,
-        "message": f"Successfully assigned {success_count} files." + (" Box is now FULL and auto-closed." if current_count >= box.capacity else ""),
-        "box_full": current_count >= box.capacity
+        **result,
+        "message": f"Successfully assigned {result['assigned']} files." + (" Box is now FULL and auto-closed." if result["box_full"] else "")
     }
 
 @router.post("/files/bulk-unassign")
@@ -484,44 +412,13 @@ def bulk_unassign_files(req: BulkUnassignRequest, db: Session = Depends(get_db),
     if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER, UserRole.HOSPITAL_ADMIN, UserRole.PLATFORM_STAFF]:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    hospital_id = current_user.hospital_id
-    success_count = 0
-    errors = []
-
-    for ident in req.identifiers:
-        # Build base query
-        query = db.query(Patient)
-        if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
-             query = query.filter(Patient.hospital_id == hospital_id)
-        
-        # Find by ID or UHID
-        p = query.filter((Patient.patient_u_id == ident) | (Patient.uhid == ident)).first()
-
-        if not p:
-            # Try parsing as int for record_id
-            try:
-                rid = int(ident)
-                query_rid = db.query(Patient)
-                if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]:
-                    query_rid = query_rid.filter(Patient.hospital_id == hospital_id)
-                p = query_rid.filter(Patient.record_id == rid).first()
-            except:
-                pass
-
-        if not p:
-            errors.append(f"{ident}: Not Found")
-            continue
-
-        p.physical_box_id = None
-        success_count += 1
-
-    db.commit()
+    hospital_id = None if current_user.role in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF] else current_user.hospital_id
+    result = BulkAssignService.unassign(db, req.identifiers, current_user.user_id, hospital_id=hospital_id)
 
     return {
         "status": "success", 
-        "unassigned": success_count,
-        "errors": errors,
-        "message": f"Successfully unassigned {success_count} files."
+        **result,
+        "message": f"Successfully unassigned {result['unassigned']} files."
     }
 
 
@@ -560,6 +457,104 @@ def record_movement(move: MovementLogCreate, db: Session = Depends(get_db), curr
     return {"status": "success", "log_id": new_log.log_id}
 
 
+def _scan_scope(current_user: User) -> Optional[int]:
+    if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER]:
+        raise HTTPException(status_code=403, detail="Not authorized to move files")
+    if current_user.role == UserRole.WAREHOUSE_MANAGER:
+        return current_user.hospital_id
+    return None
+
+def _scan_summary(batch_id: str, results: list) -> dict:
+    errors = sum(1 for r in results if r["status"] == "error")
+    return {
+        "batch_id": batch_id,
+        "received": len(results),
+        "ok": len(results) - errors,
+        "errors": errors,
+        "mismatches": sum(1 for r in results if r["outcome"] in ("mismatch", "unknown_location")),
+        "results": results
+    }
+
+@router.post("/scans")
+def ingest_scans(batch: ScanBatch, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Batch of handheld scans, applied in transactions of SCAN_CHUNK_SIZE events."""
+    hospital_id = _scan_scope(current_user)
+    batch_id = batch.batch_id or uuid.uuid4().hex
+    results = []
+    for start in range(0, len(batch.events), settings.SCAN_CHUNK_SIZE):
+        chunk = batch.events[start:start + settings.SCAN_CHUNK_SIZE]
+        for result in ScanIngestService.ingest(
+            db, chunk, current_user.user_id, hospital_id=hospital_id, batch_id=batch_id, device_id=batch.device_id
+        ):
+            result["index"] += start
+            results.append(result)
+    return _scan_summary(batch_id, results)
+
+def _ingest_scan_chunk(events: list, user_id: int, **kwargs) -> list:
+    # Runs in the threadpool with its own session: the async stream handler holds none
+    db = SessionLocal()
+    try:
+        return ScanIngestService.ingest(db, events, user_id, **kwargs)
+    finally:
+        db.close()
+
+@router.post("/scans/stream")
+async def ingest_scan_stream(
+    request: Request,
+    batch_id: Optional[str] = None,
+    device_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Newline-delimited JSON scan events (one ScanEvent per line), applied chunk by chunk
+    while the body is still arriving.
+    """
+    hospital_id = _scan_scope(current_user)
+    batch_id = batch_id or uuid.uuid4().hex
+    results, chunk, pending = [], [], b""
+    index = 0
+
+    async def flush():
+        applied = await run_in_threadpool(
+            _ingest_scan_chunk, [e for _, e in chunk], current_user.user_id,
+            hospital_id=hospital_id, batch_id=batch_id, device_id=device_id
+        )
+        for (position, _), result in zip(chunk, applied):
+            result["index"] = position
+            results.append(result)
+        chunk.clear()
+
+    async def parse(line: bytes):
+        nonlocal index
+        if not line.strip():
+            return
+        try:
+            chunk.append((index, ScanEvent(**json.loads(line))))
+        except (ValueError, TypeError, ValidationError) as e:
+            results.append({"index": index, "code": None, "kind": None, "outcome": "error",
+                            "status": "error", "detail": f"Invalid event: {e}"[:200]})
+        index += 1
+        if len(chunk) >= settings.SCAN_CHUNK_SIZE:
+            await flush()
+
+    async for data in request.stream():
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            await parse(line)
+    await parse(pending)
+    if chunk:
+        await flush()
+
+    results.sort(key=lambda r: r["index"])
+    return _scan_summary(batch_id, results)
+
+@router.get("/scans/reconciliation")
+def get_scan_reconciliation(batch_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Audited locations of a scan batch compared with the recorded ones."""
+    hospital_id = _scan_scope(current_user)
+    return ScanIngestService.reconcile(db, batch_id, hospital_id=hospital_id)
+
 # --- Original Endpoints (Kept for compatibility) ---
 
 @router.get("/boxes", response_model=List[BoxResponse])
@@ -572,7 +567,7 @@ def get_boxes(db: Session = Depends(get_db), current_user: User = Depends(get_cu
     results = []
     
     for b in boxes:
-        count = db.query(Patient).filter(Patient.physical_box_id == b.box_id).count()
+        count = b.current_count
         hospital_name = b.hospital.legal_name if b.hospital else "Unknown"
         show_location = current_user.role in [UserRole.SUPER_ADMIN, UserRole.PLATFORM_STAFF]
         
@@ -615,7 +610,8 @@ def create_box(box: BoxCreate, db: Session = Depends(get_db), current_user: User
     
     rack = None
     if box.rack_id:
-         rack = db.query(PhysicalRack).filter(PhysicalRack.rack_id == box.rack_id).first()
+         # Locked until commit so a concurrent create can't take the same slot
+         rack = db.query(PhysicalRack).filter(PhysicalRack.rack_id == box.rack_id).with_for_update().first()
     
     if not final_label or final_label.strip() == "":
         # Format: BOX-{YYYY}-{MM}-{SEQ}
@@ -626,16 +622,12 @@ def create_box(box: BoxCreate, db: Session = Depends(get_db), current_user: User
         # Let's use Rack Sequence if Rack exists, otherwise Global.
         # Decision: Global is safer for uniqueness.
         
-        count = db.query(PhysicalBox).filter(
-            PhysicalBox.hospital_id == target_hospital_id,
-            PhysicalBox.label.like(f"{prefix}%")
-        ).count()
-        
-        seq = count + 1
+        seq = SequenceService.allocate_next(db, "box_label", target_hospital_id, f"{prefix}-")
         final_label = f"{prefix}-{str(seq).zfill(3)}"
         
+        # Labels are unique across hospitals: skip numbers another hospital already used
         while db.query(PhysicalBox).filter(PhysicalBox.label == final_label).first():
-            seq += 1
+            seq = SequenceService.allocate_next(db, "box_label", target_hospital_id, f"{prefix}-")
             final_label = f"{prefix}-{str(seq).zfill(3)}"
 
     # --- AUTO-SLOTTING ---
@@ -644,25 +636,10 @@ def create_box(box: BoxCreate, db: Session = Depends(get_db), current_user: User
     assigned_col = None
     
     if rack:
-        # Get all occupied slots
-        occupied_slots = db.query(PhysicalBox.rack_row, PhysicalBox.rack_column).filter(
-            PhysicalBox.rack_id == rack.rack_id
-        ).all()
-        occupied_set = set((r, c) for r, c in occupied_slots if r and c)
-        
-        # Grid Search
-        found = False
-        for r in range(1, rack.total_rows + 1):
-            if found: break
-            for c in range(1, rack.total_columns + 1):
-                if (r, c) not in occupied_set:
-                    assigned_row = r
-                    assigned_col = c
-                    found = True
-                    break
-                    
-        if not found:
+        slot = RackSlotIndex.free_run(db, rack)
+        if not slot:
             raise HTTPException(status_code=400, detail="Rack is physically full (no empty slots).")
+        assigned_row, assigned_col = slot
             
         # Update Location Code
         if not final_location:
@@ -736,7 +713,7 @@ def update_box(box_id: int, box_update: BoxUpdate, db: Session = Depends(get_db)
     db.commit()
     db.refresh(db_box)
     
-    count = db.query(Patient).filter(Patient.physical_box_id == db_box.box_id).count()
+    count = db_box.current_count
     return BoxResponse(
         box_id=db_box.box_id,
         hospital_name=db_box.hospital.legal_name if db_box.hospital else "Unknown",
@@ -834,29 +811,9 @@ def get_next_sequence(hospital_id: int, category: str = "GENERAL", db: Session =
     # Format: HOSP/TYPE/SEQ
     # Example: VA/GEN/0001
     prefix = f"{hospital_code}/{cat_code}/"
-    pattern = f"{prefix}%"
-    
-    boxes = db.query(PhysicalBox).filter(
-        PhysicalBox.hospital_id == hospital_id,
-        PhysicalBox.label.like(pattern)
-    ).all()
-    
-    max_seq = 0
-    for b in boxes:
-        try:
-            # Label: VA/GEN/0001
-            parts = b.label.split('/')
-            
-            # Expecting 3 parts
-            if len(parts) == 3:
-                seq_str = parts[-1]
-                seq_num = int(seq_str)
-                if seq_num > max_seq:
-                    max_seq = seq_num
-        except (ValueError, IndexError):
-            continue
-            
-    next_seq = str(max_seq + 1).zfill(4)
+    last_seq, _ = SequenceService.peek(db, "box_label", hospital_id, prefix)
+
+    next_seq = str(last_seq + 1).zfill(4)
     full_label = f"{prefix}{next_seq}"
     
     return {"next_sequence": next_seq, "full_label": full_label}
@@ -950,6 +907,42 @@ def get_requests(db: Session = Depends(get_db), current_user: User = Depends(get
         ))
     return results
 
+@router.get("/requests/pick-list")
+def get_pick_list(
+    hospital_id: Optional[int] = None,
+    request_ids: Optional[str] = None,
+    export_csv: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Walking route for the pending retrieval requests (or the given comma-separated
+    request ids): one stop per box, ordered to minimise walking, with time estimates.
+    """
+    if current_user.role not in [UserRole.SUPER_ADMIN, UserRole.WAREHOUSE_MANAGER, UserRole.PLATFORM_STAFF]:
+        raise HTTPException(status_code=403, detail="Not authorized to view box locations")
+
+    target_hospital_id = hospital_id
+    if current_user.role == UserRole.WAREHOUSE_MANAGER and current_user.hospital_id:
+        target_hospital_id = current_user.hospital_id
+
+    ids = None
+    if request_ids:
+        try:
+            ids = [int(i) for i in request_ids.split(",") if i.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="request_ids must be comma-separated integers")
+
+    plan = PickListService.build(db, hospital_id=target_hospital_id, request_ids=ids)
+
+    if export_csv:
+        return Response(
+            content=PickListService.to_csv(plan),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename=pick_list_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"}
+        )
+    return plan
+
 @router.post("/requests")
 def create_request(req: RequestCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     new_req = FileRequest(
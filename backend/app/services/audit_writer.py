@@ -0,0 +1,120 @@
+import atexit
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import insert
+
+from ..core.config import settings
+from ..models import AuditLog
+
+# Batches that failed this many times are dumped to the system log instead of retried
+MAX_ATTEMPTS = 5
+
+
+class AuditWriter:
+    """
+    Per-worker write-behind for non-critical audit rows (document views, uploads).
+
+    Requests put a plain dict on a bounded queue; a daemon thread drains up to
+    AUDIT_BATCH_SIZE rows at a time (or whatever arrived within AUDIT_FLUSH_SECONDS) and
+    writes them with one multi-row INSERT. When the queue is full `enqueue` inserts the row
+    synchronously instead (backpressure), so rows are never dropped under load.
+
+    Subclasses writing another table set `table` and their own queue / retry state.
+    """
+
+    table = AuditLog.__table__
+    thread_name = "audit-writer"
+    _queue: "queue.Queue[dict]" = queue.Queue(maxsize=settings.AUDIT_QUEUE_SIZE)
+    _lock = threading.Lock()  # serialises flushes (writer thread vs atexit)
+    _retry: List[dict] = []
+    _attempts = 0
+    _thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def enqueue(cls, row: dict):
+        try:
+            cls._queue.put_nowait(row)
+        except queue.Full:
+            cls._write([row])
+            return
+        if cls._thread is None:
+            with cls._lock:
+                if cls._thread is None:
+                    cls._thread = threading.Thread(target=cls._run, name=cls.thread_name, daemon=True)
+                    cls._thread.start()
+
+    @classmethod
+    def _drain(cls, block: bool) -> List[dict]:
+        rows = []
+        deadline = time.monotonic() + settings.AUDIT_FLUSH_SECONDS
+        while len(rows) < settings.AUDIT_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    rows.append(cls._queue.get(timeout=timeout))
+                else:
+                    rows.append(cls._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    @classmethod
+    def _run(cls):
+        while True:
+            if cls._retry:
+                # Back off, then retry the failed batch together with whatever queued up
+                time.sleep(settings.AUDIT_FLUSH_SECONDS)
+                rows = cls._drain(block=False)
+            else:
+                # Wait for the first row, then collect a batch for at most AUDIT_FLUSH_SECONDS
+                rows = [cls._queue.get()] + cls._drain(block=True)
+            cls._write(rows)
+
+    @classmethod
+    def flush(cls) -> int:
+        """Write everything queued so far (shutdown, tests)."""
+        written = 0
+        while True:
+            rows = cls._drain(block=False)
+            if not rows and not cls._retry:
+                return written
+            if not cls._write(rows):
+                return written
+            written += len(rows)
+
+    @classmethod
+    def _write(cls, rows: List[dict]) -> bool:
+        from ..database import SessionLocal
+
+        with cls._lock:
+            batch, cls._retry = cls._retry + rows, []
+            if not batch:
+                return True
+            db = SessionLocal()
+            try:
+                # executemany: rendered as multi-row INSERT ... VALUES batches by SQLAlchemy
+                db.execute(insert(cls.table), batch)
+                db.commit()
+                cls._attempts = 0
+                return True
+            except Exception as e:
+                db.rollback()
+                cls._attempts += 1
+                if cls._attempts >= MAX_ATTEMPTS:
+                    from ..audit import system_logger
+                    for row in batch:
+                        system_logger.error(f"AUDIT_WRITE_FAILED | {row}")
+                    print(f"❌ Audit writer dropped {len(batch)} rows to system.log after {cls._attempts} attempts: {e}")
+                    cls._attempts = 0
+                else:
+                    cls._retry = batch
+                    print(f"⚠️ Audit writer flush failed ({len(batch)} rows, attempt {cls._attempts}): {e}")
+                return False
+            finally:
+                db.close()
+
+
+atexit.register(AuditWriter.flush)
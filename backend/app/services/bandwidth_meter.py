@@ -0,0 +1,135 @@
+import atexit
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from ..core.config import settings
+from ..models import BandwidthUsage
+
+MB = 1024 * 1024
+DEFAULT_QUOTA_MB = 1000.0  # 1GB Hard Limit
+
+
+def current_month() -> str:
+    return datetime.now().strftime("%Y-%m")
+
+
+class BandwidthMeter:
+    """
+    Per-worker bandwidth accumulator.
+
+    Requests only add bytes to an in-memory counter; a daemon thread flushes the
+    aggregated deltas every BANDWIDTH_FLUSH_SECONDS as atomic `used_mb = used_mb + delta`
+    updates, so concurrent workers never overwrite each other. Quota checks read a cached
+    copy of the row (refreshed every BANDWIDTH_QUOTA_CACHE_SECONDS) plus the bytes this
+    worker has counted since, instead of querying per request.
+    """
+
+    _lock = threading.Lock()
+    _pending: Dict[Tuple[int, str], int] = {}  # (hospital_id, month) -> bytes not yet flushed
+    # (hospital_id, month) -> [used_mb at load, quota_mb, expires_at, bytes counted since load]
+    _usage: Dict[Tuple[int, str], list] = {}
+    _thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def record(cls, hospital_id: int, nbytes: int):
+        if nbytes <= 0:
+            return
+        key = (hospital_id, current_month())
+        with cls._lock:
+            cls._pending[key] = cls._pending.get(key, 0) + nbytes
+            cached = cls._usage.get(key)
+            if cached:
+                cached[3] += nbytes
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._run, name="bandwidth-meter", daemon=True)
+                cls._thread.start()
+
+    @classmethod
+    def cached_usage(cls, hospital_id: int) -> Optional[Tuple[float, float]]:
+        """(used_mb, quota_mb) from the cache, or None when it has to be (re)loaded."""
+        entry = cls._usage.get((hospital_id, current_month()))
+        if not entry or entry[2] < time.monotonic():
+            return None
+        return entry[0] + entry[3] / MB, entry[1]
+
+    @classmethod
+    def load_usage(cls, hospital_id: int) -> Tuple[float, float]:
+        """Blocking: read the month's row into the cache (run in a threadpool)."""
+        from ..database import SessionLocal
+
+        key = (hospital_id, current_month())
+        db = SessionLocal()
+        try:
+            row = db.query(BandwidthUsage.used_mb, BandwidthUsage.quota_limit_mb).filter(
+                BandwidthUsage.hospital_id == hospital_id,
+                BandwidthUsage.month_year == key[1]
+            ).first()
+        finally:
+            db.close()
+
+        used_mb = (row.used_mb or 0.0) if row else 0.0
+        quota_mb = (row.quota_limit_mb or DEFAULT_QUOTA_MB) if row else DEFAULT_QUOTA_MB
+        with cls._lock:
+            # Bytes not flushed yet are not in the row: keep counting them on top of it
+            unflushed = cls._pending.get(key, 0)
+            cls._usage[key] = [used_mb, quota_mb, time.monotonic() + settings.BANDWIDTH_QUOTA_CACHE_SECONDS, unflushed]
+        return used_mb + unflushed / MB, quota_mb
+
+    @classmethod
+    def _run(cls):
+        while True:
+            time.sleep(settings.BANDWIDTH_FLUSH_SECONDS)
+            cls.flush()
+
+    @classmethod
+    def flush(cls) -> int:
+        """Write pending deltas with atomic increments; creates the month's row when missing."""
+        with cls._lock:
+            pending, cls._pending = cls._pending, {}
+        if not pending:
+            return 0
+
+        from ..database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            for (hospital_id, month), nbytes in pending.items():
+                delta_mb = nbytes / MB
+                increment = update(BandwidthUsage).where(
+                    BandwidthUsage.hospital_id == hospital_id,
+                    BandwidthUsage.month_year == month
+                ).values(used_mb=BandwidthUsage.used_mb + delta_mb)
+
+                if db.execute(increment).rowcount:
+                    continue
+                try:
+                    with db.begin_nested():
+                        db.add(BandwidthUsage(
+                            hospital_id=hospital_id,
+                            month_year=month,
+                            used_mb=delta_mb,
+                            quota_limit_mb=DEFAULT_QUOTA_MB
+                        ))
+                except IntegrityError:
+                    # Another worker created the row first
+                    db.execute(increment)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # Keep the bytes for the next flush rather than losing them
+            with cls._lock:
+                for key, nbytes in pending.items():
+                    cls._pending[key] = cls._pending.get(key, 0) + nbytes
+            print(f"⚠️ Bandwidth flush failed ({len(pending)} hospitals): {e}")
+            return 0
+        finally:
+            db.close()
+        return len(pending)
+
+
+atexit.register(BandwidthMeter.flush)
@@ -0,0 +1,208 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import extract, func, update
+from sqlalchemy.orm import Session
+
+from ..models import Hospital, Patient, PDFFile
+
+# PDFFile.billing_status values
+UNBILLED = "UNBILLED"
+INVOICED = "INVOICED"
+PAID = "PAID"
+
+
+class BillingService:
+    """
+    Single entry point for per-file billing figures.
+
+    Cost is computed by the database through the `PDFFile.billing_cost` expression
+    (historical price snapshot on pdf_files), so previews and totals never load ORM
+    objects or lazy-load patients row by row.
+    """
+
+    @staticmethod
+    def _apply_filters(
+        query,
+        hospital_id: Optional[int] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        file_ids: Optional[List[int]] = None,
+        confirmed_only: bool = False,
+        unbilled_only: bool = False,
+        unpaid_only: bool = False,
+    ):
+        if hospital_id and unbilled_only:
+            # Denormalized column so the lookup is served by idx_pdf_files_unbilled
+            query = query.filter(PDFFile.hospital_id == hospital_id)
+        elif hospital_id:
+            query = query.filter(Patient.hospital_id == hospital_id)
+        if start_date:
+            query = query.filter(PDFFile.upload_date >= start_date)
+        if end_date:
+            # End of the day for end_date
+            query = query.filter(PDFFile.upload_date < (end_date + timedelta(days=1)))
+        if file_ids is not None:
+            query = query.filter(PDFFile.file_id.in_(file_ids))
+        if confirmed_only:
+            query = query.filter(PDFFile.upload_status == 'confirmed')
+        if unpaid_only:
+            query = query.filter(PDFFile.is_paid == False)
+        if unbilled_only:
+            query = query.filter(PDFFile.billing_status == UNBILLED)
+        return query
+
+    @staticmethod
+    def file_rows(db: Session, **filters):
+        """
+        Column-only query of billable files with patient fields and the computed cost.
+        Keyword filters are those of `_apply_filters` (shared by all methods here).
+        """
+        query = db.query(
+            PDFFile.file_id,
+            PDFFile.record_id,
+            PDFFile.filename,
+            PDFFile.page_count,
+            PDFFile.file_size_mb,
+            PDFFile.upload_date,
+            PDFFile.upload_status,
+            PDFFile.is_paid,
+            PDFFile.payment_date,
+            Patient.hospital_id,
+            Patient.full_name.label("patient_name"),
+            Patient.patient_u_id,
+            Patient.uhid,
+            Patient.age,
+            Patient.admission_date,
+            Patient.discharge_date,
+            PDFFile.billing_cost.label("cost"),
+        ).join(Patient, Patient.record_id == PDFFile.record_id)
+
+        return BillingService._apply_filters(query, **filters)
+
+    @staticmethod
+    def summary(db: Session, **filters) -> dict:
+        """Totals for a filtered set of files in a single aggregate query."""
+        query = db.query(
+            func.count(PDFFile.file_id),
+            func.coalesce(func.sum(PDFFile.page_count), 0),
+            func.coalesce(func.sum(PDFFile.billing_cost), 0.0),
+        ).join(Patient, Patient.record_id == PDFFile.record_id)
+        query = BillingService._apply_filters(query, **filters)
+
+        total_files, total_pages, total_cost = query.one()
+        return {
+            "total_files": total_files or 0,
+            "total_pages": int(total_pages or 0),
+            "total_cost": round(float(total_cost or 0.0), 2),
+        }
+
+    @staticmethod
+    def period_aggregates(db: Session, **filters) -> List[dict]:
+        """Per hospital, per calendar month totals (year, month, files, pages, cost)."""
+        year_col = extract('year', PDFFile.upload_date)
+        month_col = extract('month', PDFFile.upload_date)
+
+        query = db.query(
+            Patient.hospital_id,
+            year_col.label("year"),
+            month_col.label("month"),
+            func.count(PDFFile.file_id),
+            func.coalesce(func.sum(PDFFile.page_count), 0),
+            func.coalesce(func.sum(PDFFile.billing_cost), 0.0),
+        ).join(Patient, Patient.record_id == PDFFile.record_id)
+        query = BillingService._apply_filters(query, **filters)
+        query = query.group_by(Patient.hospital_id, year_col, month_col)\
+            .order_by(Patient.hospital_id, year_col, month_col)
+
+        return [
+            {
+                "hospital_id": hospital_id,
+                "period": f"{int(year):04d}-{int(month):02d}" if year is not None else None,
+                "total_files": files,
+                "total_pages": int(pages or 0),
+                "total_cost": round(float(cost or 0.0), 2),
+            }
+            for hospital_id, year, month, files, pages, cost in query.all()
+        ]
+
+    @staticmethod
+    def hospital_aggregates(db: Session, **filters) -> List[dict]:
+        """
+        Per active hospital totals in one grouped query (no patient join: grouped on the
+        denormalized pdf_files.hospital_id, served by idx_pdf_files_unbilled).
+        """
+        query = db.query(
+            PDFFile.hospital_id,
+            func.count(PDFFile.file_id),
+            func.coalesce(func.sum(PDFFile.page_count), 0),
+            func.coalesce(func.sum(PDFFile.billing_cost), 0.0),
+            func.min(PDFFile.upload_date),
+            func.max(PDFFile.upload_date),
+        ).join(Hospital, Hospital.hospital_id == PDFFile.hospital_id)\
+         .filter(Hospital.is_active == True)
+        query = BillingService._apply_filters(query, **filters)
+        query = query.group_by(PDFFile.hospital_id).order_by(PDFFile.hospital_id)
+
+        return [
+            {
+                "hospital_id": hospital_id,
+                "total_files": files,
+                "total_pages": int(pages or 0),
+                "total_cost": float(cost or 0.0),
+                "first_upload": first_upload,
+                "last_upload": last_upload,
+            }
+            for hospital_id, files, pages, cost, first_upload, last_upload in query.all()
+        ]
+
+
+    # --- Billing state transitions ---
+
+    @staticmethod
+    def mark_invoiced(db: Session, invoice_id: int, file_ids: List[int]):
+        """UNBILLED -> INVOICED for the files placed on a new invoice."""
+        if not file_ids:
+            return 0
+        return db.query(PDFFile).filter(PDFFile.file_id.in_(file_ids)).update({
+            "billing_status": INVOICED,
+            "invoice_id": invoice_id
+        }, synchronize_session=False)
+
+    @staticmethod
+    def mark_invoiced_many(db: Session, file_invoice_ids: Dict[int, int]):
+        """UNBILLED -> INVOICED across many invoices in one executemany UPDATE ({file_id: invoice_id})."""
+        if not file_invoice_ids:
+            return 0
+        db.execute(update(PDFFile), [
+            {"file_id": file_id, "billing_status": INVOICED, "invoice_id": invoice_id}
+            for file_id, invoice_id in file_invoice_ids.items()
+        ])
+        return len(file_invoice_ids)
+
+    @staticmethod
+    def mark_paid(db: Session, invoice_id: int, paid_at: Optional[datetime] = None):
+        """INVOICED -> PAID for every file on the invoice."""
+        return db.query(PDFFile).filter(PDFFile.invoice_id == invoice_id).update({
+            "billing_status": PAID,
+            "is_paid": True,
+            "payment_date": paid_at or datetime.now()
+        }, synchronize_session=False)
+
+    @staticmethod
+    def release_files(db: Session, invoice_id: int, file_ids: Optional[List[int]] = None):
+        """
+        Back to UNBILLED (invoice deleted, or items removed from it).
+        Without file_ids every file on the invoice is released.
+        """
+        query = db.query(PDFFile).filter(PDFFile.invoice_id == invoice_id)
+        if file_ids is not None:
+            if not file_ids:
+                return 0
+            query = query.filter(PDFFile.file_id.in_(file_ids))
+        return query.update({
+            "billing_status": UNBILLED,
+            "invoice_id": None,
+            "is_paid": False,
+            "payment_date": None
+        }, synchronize_session=False)
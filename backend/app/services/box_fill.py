@@ -0,0 +1,120 @@
+"""
+Box fill counters.
+
+`PhysicalBox.current_count` is the number of patients assigned to the box. A
+before_flush listener turns every change of `Patient.physical_box_id` (assign, move,
+unassign, delete) into an atomic `current_count = current_count + delta` UPDATE, so
+picking a box with space is one indexed query instead of a COUNT per box. Code that
+re-points patients with a bulk UPDATE must call `BoxFill.apply_deltas` itself; after
+manual SQL, `python -m app.services.box_fill` recounts every box.
+"""
+from collections import Counter
+from typing import Dict, Optional
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from ..models import Patient, PhysicalBox
+
+DEFAULT_CAPACITY = 50
+
+
+class BoxFill:
+    @staticmethod
+    def capacity():
+        """SQL expression for a box's capacity (unset / 0 means the default)."""
+        return func.coalesce(func.nullif(PhysicalBox.capacity, 0), DEFAULT_CAPACITY)
+
+    @staticmethod
+    def pick_box(db: Session, hospital_id: int, category: Optional[str] = None, status: str = "In Storage") -> Optional[PhysicalBox]:
+        """
+        Oldest box of the hospital with room left, locked until the caller commits.
+        Boxes already locked by another assigner are skipped rather than waited on.
+        """
+        query = db.query(PhysicalBox).filter(
+            PhysicalBox.hospital_id == hospital_id,
+            PhysicalBox.status == status,
+            PhysicalBox.current_count < BoxFill.capacity()
+        )
+        if category is not None:
+            query = query.filter(PhysicalBox.category == category)
+        return query.order_by(PhysicalBox.box_id).with_for_update(skip_locked=True).first()
+
+    @staticmethod
+    def apply_deltas(db: Session, deltas: Dict[int, int]):
+        """Atomically add `delta` to each box's count (box_id -> delta)."""
+        for box_id, delta in deltas.items():
+            if not box_id or not delta:
+                continue
+            db.execute(
+                update(PhysicalBox.__table__)
+                .where(PhysicalBox.__table__.c.box_id == box_id)
+                .values(current_count=PhysicalBox.__table__.c.current_count + delta)
+            )
+            box = db.identity_map.get(db.identity_key(PhysicalBox, box_id))
+            if box is not None:
+                db.expire(box, ["current_count"])
+        # Boxes whose fill changed in this transaction (see services/occupancy.py)
+        db.info.setdefault("changed_boxes", set()).update(b for b, d in deltas.items() if b and d)
+
+    @staticmethod
+    def rebuild(db: Session, hospital_id: Optional[int] = None) -> int:
+        """Recount every box from the patients table (one UPDATE)."""
+        boxes = PhysicalBox.__table__
+        counted = (
+            select(func.count(Patient.record_id))
+            .where(Patient.physical_box_id == boxes.c.box_id)
+            .scalar_subquery()
+        )
+        stmt = update(boxes).values(current_count=counted)
+        if hospital_id is not None:
+            stmt = stmt.where(boxes.c.hospital_id == hospital_id)
+        result = db.execute(stmt)
+        db.commit()
+        return result.rowcount
+
+
+def _committed_box(state) -> Optional[int]:
+    history = state.attrs.physical_box_id.history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+
+@event.listens_for(Patient.physical_box_id, "set", active_history=True)
+def _load_previous_box(target, value, oldvalue, initiator):
+    """Loads the old value of an expired attribute on set, so the flush knows which box lost a patient."""
+
+
+@event.listens_for(Session, "before_flush")
+def _count_box_assignments(session, flush_context, instances):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Patient) and obj.physical_box_id:
+            deltas[obj.physical_box_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Patient):
+            state = inspect(obj)
+            if "physical_box_id" in state.expired_attributes:
+                # Expired by an earlier commit: load the box, or history has nothing to decrement
+                with session.no_autoflush:
+                    session.refresh(obj, ["physical_box_id"])
+            deltas[_committed_box(state)] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Patient):
+            state = inspect(obj)
+            if state.attrs.physical_box_id.history.has_changes():
+                deltas[_committed_box(state)] -= 1
+                deltas[obj.physical_box_id] += 1
+    if deltas:
+        BoxFill.apply_deltas(session, dict(deltas))
+
+
+if __name__ == "__main__":
+    from ..database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(f"✅ Recounted {BoxFill.rebuild(db)} boxes.")
+    finally:
+        db.close()
@@ -0,0 +1,178 @@
+"""
+Set-based box assignment for barcode batches (/storage/files/bulk-assign, bulk-unassign).
+
+All identifiers are resolved in one query (MRD number, UHID or record id, with a
+has-files EXISTS flag), validated in memory, applied with one UPDATE and logged with
+one multi-row insert, instead of two or three round trips per identifier.
+"""
+from typing import Dict, List, Optional
+
+from sqlalchemy import exists, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from ..models import PDFFile, Patient, PhysicalBox, PhysicalMovementLog
+from .box_fill import DEFAULT_CAPACITY, BoxFill
+
+# Legacy category names -> current codes (boxes and patients are compared normalised)
+CATEGORY_ALIASES = {
+    "STANDARD": "IPD",
+    "GENERAL": "IPD",
+    "MLC": "MCL",
+    "BIRTH": "BRT",
+    "DEATH": "DHT"
+}
+
+MAX_AUTO_CAPACITY = 1000
+CHUNK_SIZE = 1000  # identifiers per IN list
+
+
+def normalize_category(category: Optional[str]) -> str:
+    raw = (category or "IPD").upper()
+    return CATEGORY_ALIASES.get(raw, raw)
+
+
+class BulkAssignService:
+    @staticmethod
+    def resolve(db: Session, identifiers: List[str], hospital_id: Optional[int] = None) -> Dict[str, dict]:
+        """identifier -> patient row (MRD number first, then UHID, then record id)."""
+        has_files = exists().where(PDFFile.record_id == Patient.record_id)
+        by_uid, by_uhid, by_record = {}, {}, {}
+        unique = list(dict.fromkeys(identifiers))
+        for start in range(0, len(unique), CHUNK_SIZE):
+            chunk = unique[start:start + CHUNK_SIZE]
+            record_ids = [int(i) for i in chunk if i.isdigit()]
+            query = select(
+                Patient.record_id, Patient.patient_u_id, Patient.uhid, Patient.full_name,
+                Patient.patient_category, Patient.physical_box_id, has_files.label("has_files")
+            ).where(or_(
+                Patient.patient_u_id.in_(chunk),
+                Patient.uhid.in_(chunk),
+                Patient.record_id.in_(record_ids)
+            ))
+            if hospital_id is not None:
+                query = query.where(Patient.hospital_id == hospital_id)
+            for row in db.execute(query).mappings():
+                row = dict(row)
+                by_uid.setdefault(row["patient_u_id"], row)
+                if row["uhid"]:
+                    by_uhid.setdefault(row["uhid"], row)
+                by_record[str(row["record_id"])] = row
+
+        return {
+            ident: by_uid.get(ident) or by_uhid.get(ident) or by_record.get(ident.strip())
+            for ident in unique
+        }
+
+    @staticmethod
+    def _log_movements(db: Session, rows: List[dict], action_type: str, destination: Optional[str], user_id: int):
+        if rows:
+            db.execute(insert(PhysicalMovementLog), [
+                {
+                    "action_type": action_type,
+                    "uhid": row["uhid"] or row["patient_u_id"],
+                    "patient_name": row["full_name"],
+                    "destination": destination,
+                    "performed_by_user_id": user_id,
+                    "status": "Success"
+                } for row in rows
+            ])
+
+    @staticmethod
+    def assign(db: Session, box: PhysicalBox, identifiers: List[str], user_id: int, can_expand: bool = False) -> dict:
+        """
+        Validates and assigns every identifier to `box` in one transaction. With
+        `can_expand`, a full box grows (by 100, up to 1000) instead of rejecting files.
+        """
+        patients = BulkAssignService.resolve(db, identifiers, hospital_id=box.hospital_id)
+        box_category = normalize_category(box.category)
+        current_count = box.current_count
+        capacity = box.capacity or DEFAULT_CAPACITY
+
+        results, accepted = [], {}
+        for ident in identifiers:
+            p = patients.get(ident)
+            error = None
+            if current_count >= capacity and can_expand and capacity < MAX_AUTO_CAPACITY:
+                # AUTO-EXPAND POLICY: prevents "199/200" blockers during bulk operations
+                capacity = min(max(capacity + 100, current_count + 50), MAX_AUTO_CAPACITY)
+
+            if current_count >= capacity:
+                error = f"Box is FULL (capacity: {capacity})"
+            elif not p:
+                error = "Not Found"
+            elif not p["has_files"]:
+                # Patient record MUST have at least one file entry in PDFFile table
+                error = "No digital files found. Please upload PDFs first."
+            elif p["physical_box_id"] == box.box_id or p["record_id"] in accepted:
+                error = "Already in this box"
+            elif normalize_category(p["patient_category"]) != box_category:
+                error = f"Mismatch - File is {normalize_category(p['patient_category'])}, Box is {box_category}"
+
+            if error:
+                results.append({"identifier": ident, "status": "error", "detail": error})
+                continue
+            accepted[p["record_id"]] = p
+            current_count += 1
+            results.append({"identifier": ident, "status": "assigned", "record_id": p["record_id"]})
+
+        if accepted:
+            db.execute(
+                update(Patient.__table__)
+                .where(Patient.__table__.c.record_id.in_(list(accepted)))
+                .values(physical_box_id=box.box_id)
+            )
+            deltas = {box.box_id: len(accepted)}
+            for p in accepted.values():
+                if p["physical_box_id"]:
+                    deltas[p["physical_box_id"]] = deltas.get(p["physical_box_id"], 0) - 1
+            BoxFill.apply_deltas(db, deltas)
+            BulkAssignService._log_movements(db, list(accepted.values()), "BOX-ASSIGN", box.label, user_id)
+
+        if capacity != box.capacity:
+            box.capacity = capacity
+        # Auto-close box if it reached capacity
+        box_full = current_count >= capacity
+        if box_full and box.is_open:
+            box.is_open = False
+            box.status = "CLOSED"
+        db.commit()
+
+        return {
+            "assigned": len(accepted),
+            "box_full": box_full,
+            "results": results,
+            "errors": [f"{r['identifier']}: {r['detail']}" for r in results if r["status"] == "error"]
+        }
+
+    @staticmethod
+    def unassign(db: Session, identifiers: List[str], user_id: int, hospital_id: Optional[int] = None) -> dict:
+        patients = BulkAssignService.resolve(db, identifiers, hospital_id=hospital_id)
+
+        results, accepted = [], {}
+        for ident in identifiers:
+            p = patients.get(ident)
+            if not p:
+                results.append({"identifier": ident, "status": "error", "detail": "Not Found"})
+                continue
+            accepted[p["record_id"]] = p
+            results.append({"identifier": ident, "status": "unassigned", "record_id": p["record_id"]})
+
+        boxed = [p for p in accepted.values() if p["physical_box_id"]]
+        if boxed:
+            db.execute(
+                update(Patient.__table__)
+                .where(Patient.__table__.c.record_id.in_([p["record_id"] for p in boxed]))
+                .values(physical_box_id=None)
+            )
+            deltas = {}
+            for p in boxed:
+                deltas[p["physical_box_id"]] = deltas.get(p["physical_box_id"], 0) - 1
+            BoxFill.apply_deltas(db, deltas)
+            BulkAssignService._log_movements(db, boxed, "BOX-UNASSIGN", None, user_id)
+        db.commit()
+
+        return {
+            "unassigned": len(results) - sum(1 for r in results if r["status"] == "error"),
+            "results": results,
+            "errors": [f"{r['identifier']}: {r['detail']}" for r in results if r["status"] == "error"]
+        }
@@ -1,68 +1,207 @@
 import datetime
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_
-from ..models import Hospital, Patient, PDFFile
-from .s3_handler import S3Manager
 import os
+import time
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, selectinload
+
+from ..core.config import settings
+from ..models import Hospital, Patient, PDFFile, RetentionRun
+from .s3_handler import S3Manager
+
+# Never removed by retention
+EXEMPT_CATEGORIES = ["MLC", "BIRTH", "DEATH"]
+
 
 class CleanupService:
+    """
+    Retention cleanup: hard-deletes patients (and their files) discharged longer ago than
+    their hospital's retention period. MLC, BIRTH and DEATH cases are EXEMPT.
+
+    Candidates are streamed per hospital in keyset batches (record_id order). Each batch
+    deletes its storage objects with batched S3 `delete_objects` calls, deletes the
+    patients and advances a `RetentionRun` checkpoint in one commit, so a crash loses at
+    most one batch and the next run resumes at the cursor. Patients whose objects could
+    not be deleted stay in place and are retried on the next pass. Runs stop (status
+    "paused") after RETENTION_MAX_PATIENTS_PER_RUN patients and can be throttled to
+    RETENTION_MAX_OBJECTS_PER_SECOND.
+    """
+
+    @staticmethod
+    def _cutoff(hospital: Hospital) -> datetime.datetime:
+        retention_years = getattr(hospital, 'retention_years', 5) # Default to 5 if not set
+        return datetime.datetime.now() - datetime.timedelta(days=retention_years * 365)
+
+    @staticmethod
+    def _candidates(hospital: Hospital):
+        # We use discharge_date as the clock-start for retention
+        return (
+            Patient.hospital_id == hospital.hospital_id,
+            Patient.discharge_date < CleanupService._cutoff(hospital),
+            Patient.patient_category.notin_(EXEMPT_CATEGORIES),
+            Patient.is_deleted == False # Only cleanup non-deleted (or we can cleanup all)
+        )
+
+    @staticmethod
+    def preview(db: Session) -> dict:
+        """Dry run: patients and files each active hospital would lose (counts only)."""
+        hospitals = db.query(Hospital).filter(Hospital.is_active == True).order_by(Hospital.hospital_id).all()
+        result = []
+        for hospital in hospitals:
+            conditions = CleanupService._candidates(hospital)
+            patients = db.execute(select(func.count(Patient.record_id)).where(*conditions)).scalar()
+            if not patients:
+                continue
+            files = db.execute(
+                select(func.count(PDFFile.file_id)).join(Patient, Patient.record_id == PDFFile.record_id).where(*conditions)
+            ).scalar()
+            result.append({
+                "hospital_id": hospital.hospital_id,
+                "hospital_name": hospital.legal_name,
+                "patients": patients,
+                "files": files
+            })
+        return {
+            "dry_run": True,
+            "patients": sum(h["patients"] for h in result),
+            "files": sum(h["files"] for h in result),
+            "hospitals": result
+        }
+
+    @staticmethod
+    def _start_run(db: Session) -> RetentionRun:
+        """Resume an unfinished run (crashed or paused at its limit) or start a new one."""
+        run = db.query(RetentionRun).filter(
+            RetentionRun.status.in_(["running", "paused"])
+        ).order_by(RetentionRun.run_id.desc()).first()
+        if run:
+            print(f"🧹 [Retention Cleanup] Resuming run {run.run_id} at hospital {run.cursor_hospital_id}, record {run.cursor_record_id}")
+            run.status = "running"
+        else:
+            run = RetentionRun(status="running", started_at=datetime.datetime.utcnow())
+            db.add(run)
+        db.commit()
+        return run
+
+    @staticmethod
+    def _storage_paths(f: PDFFile):
+        if f.s3_key:
+            yield f.s3_key
+        if f.storage_path and f.storage_path != f.s3_key and os.path.isabs(f.storage_path):
+            yield f.storage_path
+
     @staticmethod
-    def run_retention_policy(db: Session):
+    def _delete_batch(db: Session, s3_manager: S3Manager, patients, run: RetentionRun) -> int:
+        """Deletes one batch of patients and their files; returns the number of storage objects removed."""
+        keys = [key for p in patients for f in p.files for key in CleanupService._storage_paths(f) if not os.path.isabs(key)]
+        failed = s3_manager.delete_files(keys, max_workers=settings.RETENTION_DELETE_WORKERS) if keys else set()
+
+        objects = 0
+        for patient in patients:
+            patient_keys = [key for f in patient.files for key in CleanupService._storage_paths(f)]
+            if any(key in failed for key in patient_keys):
+                run.patients_skipped += 1
+                continue
+            # Absolute local paths (legacy uploads) are removed directly
+            for path in patient_keys:
+                if os.path.isabs(path) and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        print(f"⚠️ Failed to delete {path} during cleanup: {e}")
+            objects += len(patient_keys)
+            run.files_deleted += len(patient.files)
+            run.patients_deleted += 1
+            # Delete patient from DB (Cascade handles PDFFile rows)
+            db.delete(patient)
+
+        run.cursor_hospital_id = patients[-1].hospital_id
+        run.cursor_record_id = patients[-1].record_id
+        db.commit()
+        return objects
+
+    @staticmethod
+    def run_retention_policy(db: Session, dry_run: bool = False, max_patients: Optional[int] = None):
         """
-        Background task to clean up patient records that have exceeded 
+        Background task to clean up patient records that have exceeded
         their hospital's retention policy. MLC cases are EXEMPT.
         """
+        if dry_run:
+            return CleanupService.preview(db)
+
         print(f"🧹 [Retention Cleanup] Started at {datetime.datetime.now()}")
-        hospitals = db.query(Hospital).filter(Hospital.is_active == True).all()
-        
-        total_files_deleted = 0
-        total_patients_deleted = 0
-        
-        for hospital in hospitals:
-            retention_years = getattr(hospital, 'retention_years', 5) # Default to 5 if not set
-            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=retention_years * 365)
-            
-            # Find patients past retention date, excluding MLC, BIRTH, DEATH
-            # We use discharge_date as the clock-start for retention
-            patients_to_cleanup = db.query(Patient)\
-                .options(joinedload(Patient.files))\
-                .filter(
-                    Patient.hospital_id == hospital.hospital_id,
-                    Patient.discharge_date < cutoff_date,
-                    Patient.patient_category.notin_(["MLC", "BIRTH", "DEATH"]),
-                    Patient.is_deleted == False # Only cleanup non-deleted (or we can cleanup all)
-                ).all()
-                
-            if not patients_to_cleanup:
-                continue
-                
-            print(f"🏥 Hospital {hospital.legal_name}: Found {len(patients_to_cleanup)} patients past retention ({retention_years} yrs)")
-            
-            s3_manager = S3Manager()
-            for patient in patients_to_cleanup:
-                # 1. Delete associated files from S3/Local
-                for f in patient.files:
-                    try:
-                        if f.s3_key:
-                            s3_manager.delete_file(f.s3_key)
-                        if f.storage_path and f.storage_path != f.s3_key and os.path.isabs(f.storage_path):
-                            if os.path.exists(f.storage_path): os.remove(f.storage_path)
-                        total_files_deleted += 1
-                    except Exception as e:
-                        print(f"⚠️ Failed to delete file {f.file_id} during cleanup: {e}")
-                
-                # 2. Delete patient from DB (Cascade handles PDFFile rows)
-                # We could also do 'is_deleted = True' but for retention, we usually hard-delete
-                db.delete(patient)
-                total_patients_deleted += 1
-                
-        if total_patients_deleted > 0:
+        limit = settings.RETENTION_MAX_PATIENTS_PER_RUN if max_patients is None else max_patients
+        batch_size = max(1, settings.RETENTION_BATCH_SIZE)
+        run = CleanupService._start_run(db)
+        run_id = run.run_id
+        deleted_before = run.patients_deleted + run.patients_skipped
+        s3_manager = None
+        started = time.monotonic()
+        objects = 0
+
+        try:
+            hospitals = db.query(Hospital).filter(
+                Hospital.is_active == True,
+                Hospital.hospital_id >= (run.cursor_hospital_id or 0)
+            ).order_by(Hospital.hospital_id).all()
+
+            for hospital in hospitals:
+                conditions = CleanupService._candidates(hospital)
+                after = run.cursor_record_id if hospital.hospital_id == run.cursor_hospital_id else 0
+                while True:
+                    handled = run.patients_deleted + run.patients_skipped - deleted_before
+                    if limit and handled >= limit:
+                        run.status = "paused"
+                        db.commit()
+                        print(f"⏸️ [Retention Cleanup] Run limit of {limit} patients reached; resuming next run.")
+                        return CleanupService._summary(run)
+
+                    size = min(batch_size, limit - handled) if limit else batch_size
+                    patients = db.query(Patient).options(selectinload(Patient.files)).filter(
+                        *conditions, Patient.record_id > (after or 0)
+                    ).order_by(Patient.record_id).limit(size).all()
+                    if not patients:
+                        break
+
+                    s3_manager = s3_manager or S3Manager()
+                    after = patients[-1].record_id
+                    objects += CleanupService._delete_batch(db, s3_manager, patients, run)
+
+                    # Throttle: keep the storage delete rate under the configured ceiling
+                    if settings.RETENTION_MAX_OBJECTS_PER_SECOND > 0:
+                        ahead = objects / settings.RETENTION_MAX_OBJECTS_PER_SECOND - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+
+                run.cursor_hospital_id, run.cursor_record_id = hospital.hospital_id + 1, 0
+                db.commit()
+
+            run.status = "completed"
+            run.finished_at = datetime.datetime.utcnow()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            run = db.get(RetentionRun, run_id)
+            run.status = "failed"
+            run.last_error = str(e)[:2000]
+            run.finished_at = datetime.datetime.utcnow()
             db.commit()
-            print(f"✅ Cleanup Complete: Removed {total_patients_deleted} patients and {total_files_deleted} files.")
+            print(f"❌ [Retention Cleanup] Run {run_id} failed at hospital {run.cursor_hospital_id}, record {run.cursor_record_id}: {e}")
+            raise
+
+        if run.patients_deleted:
+            print(f"✅ Cleanup Complete: Removed {run.patients_deleted} patients and {run.files_deleted} files.")
         else:
             print("✨ Cleanup Finished: Nothing to remove.")
-            
+        return CleanupService._summary(run)
+
+    @staticmethod
+    def _summary(run: RetentionRun) -> dict:
         return {
-            "patients_deleted": total_patients_deleted,
-            "files_deleted": total_files_deleted
+            "run_id": run.run_id,
+            "status": run.status,
+            "patients_deleted": run.patients_deleted,
+            "files_deleted": run.files_deleted,
+            "patients_skipped": run.patients_skipped
         }
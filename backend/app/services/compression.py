@@ -12,7 +12,6 @@ except ImportError:
     HAS_IMG_TOOLS = False
     print("Warning: PDF Compression Tools missing (pdf2image/Pillow). Using lossless only.")
 
-from moviepy import VideoFileClip
 from pypdf import PdfReader, PdfWriter
 
 
@@ -98,6 +97,9 @@ def compress_video_to_mp4(file_path: str) -> str:
     Returns path to compressed file.
     """
     try:
+        # Imported here: moviepy (and the IPython stack it pulls in) adds ~0.5s to worker boot
+        from moviepy import VideoFileClip
+
         temp_dir = tempfile.gettempdir()
         filename = os.path.basename(file_path)
         name, _ = os.path.splitext(filename)
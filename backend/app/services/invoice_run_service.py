@@ -0,0 +1,239 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from ..models import AccountingTransaction, BillingRun, Hospital, Invoice, InvoiceItem, PDFFile
+from .billing_service import BillingService
+from .numbering_service import NumberingService, invoice_series
+
+DEFAULT_REGISTRATION_FEE = 1000.0
+
+
+def previous_month_end(today: Optional[date] = None) -> date:
+    """Last calendar day of the month before `today` (default billing period end)."""
+    today = today or date.today()
+    return today.replace(day=1) - timedelta(days=1)
+
+
+class InvoiceRunService:
+    """
+    Month-end batch billing across every active hospital.
+
+    Selection is one grouped query over the unbilled partial index, invoice numbers are
+    reserved as a single block through NumberingService, and invoices,
+    items, ledger entries and file state are written with bulk statements in one
+    transaction. Email delivery is left to the caller (after commit).
+    """
+
+    @staticmethod
+    def _candidate_filters(period_end: date) -> dict:
+        return {"end_date": period_end, "confirmed_only": True, "unbilled_only": True}
+
+    @staticmethod
+    def preview(
+        db: Session,
+        period_end: date,
+        is_gst_bill: bool = True,
+        include_registration_fee: bool = True,
+    ) -> dict:
+        """Dry run: what the run would bill, per hospital, without writing anything."""
+        aggregates = BillingService.hospital_aggregates(db, **InvoiceRunService._candidate_filters(period_end))
+        hospitals = {
+            h.hospital_id: h for h in db.query(
+                Hospital.hospital_id, Hospital.legal_name, Hospital.is_reg_fee_paid, Hospital.registration_fee
+            ).filter(Hospital.hospital_id.in_([a["hospital_id"] for a in aggregates]))
+        }
+        gst_rate = 18.0 if is_gst_bill else 0.0
+
+        rows = []
+        for agg in aggregates:
+            hospital = hospitals[agg["hospital_id"]]
+            registration_fee = 0.0
+            if include_registration_fee and not hospital.is_reg_fee_paid:
+                registration_fee = hospital.registration_fee or DEFAULT_REGISTRATION_FEE
+            subtotal = agg["total_cost"] + registration_fee
+            tax_amount = (subtotal * gst_rate) / 100
+            rows.append({
+                "hospital_id": agg["hospital_id"],
+                "hospital_name": hospital.legal_name,
+                "file_count": agg["total_files"],
+                "total_pages": agg["total_pages"],
+                "files_amount": round(agg["total_cost"], 2),
+                "registration_fee": registration_fee,
+                "tax_amount": round(tax_amount, 2),
+                "grand_total": round(subtotal + tax_amount),
+                "invoice_period": f"{agg['first_upload']:%d-%m-%Y} - {agg['last_upload']:%d-%m-%Y}"
+                if agg["first_upload"] else "N/A",
+            })
+
+        return {
+            "period_end": period_end,
+            "gst_rate": gst_rate,
+            "invoice_count": len(rows),
+            "total_amount": sum(r["grand_total"] for r in rows),
+            "hospitals": rows,
+        }
+
+    @staticmethod
+    def execute(
+        db: Session,
+        run: BillingRun,
+        include_registration_fee: bool = True,
+        bill_date: Optional[datetime] = None,
+        due_date: Optional[datetime] = None,
+    ) -> dict:
+        """
+        Bills every hospital with unbilled confirmed files uploaded up to the run's period.
+        Commits once at the end; returns the run summary (also stored on the BillingRun).
+        """
+        period_end = (run.period_end - timedelta(days=1)).date()
+        bill_date = bill_date or datetime.now()
+
+        # Lock the candidate files so a concurrent single-invoice generate cannot take them
+        files = BillingService.file_rows(db, **InvoiceRunService._candidate_filters(period_end))\
+            .join(Hospital, Hospital.hospital_id == PDFFile.hospital_id)\
+            .filter(Hospital.is_active == True)\
+            .order_by(PDFFile.hospital_id, PDFFile.upload_date, PDFFile.file_id)\
+            .with_for_update(of=PDFFile).all()
+
+        files_by_hospital = defaultdict(list)
+        for f in files:
+            files_by_hospital[f.hospital_id].append(f)
+
+        hospitals = db.query(Hospital).filter(Hospital.hospital_id.in_(list(files_by_hospital))).all()
+        hospitals = sorted(hospitals, key=lambda h: h.hospital_id)
+
+        series = invoice_series(run.is_gst_bill)
+        allocated, numbers = NumberingService.next_invoice_numbers(db, series, len(hospitals)) \
+            if hospitals else ([], [])
+        try:
+            return InvoiceRunService._write_run(
+                db, run, hospitals, files_by_hospital, numbers, include_registration_fee, bill_date, due_date
+            )
+        except Exception:
+            # Give the reserved block back so the series stays gapless
+            db.rollback()
+            NumberingService.release(db, series, allocated)
+            raise
+
+    @staticmethod
+    def _write_run(db, run, hospitals, files_by_hospital, numbers, include_registration_fee, bill_date, due_date):
+        gst_rate = 18.0 if run.is_gst_bill else 0.0
+
+        plans = []
+        for hospital, invoice_number in zip(hospitals, numbers):
+            items = []
+            if include_registration_fee and not hospital.is_reg_fee_paid:
+                items.append({
+                    "file_id": None,
+                    "amount": hospital.registration_fee or DEFAULT_REGISTRATION_FEE,
+                    "discount": 0.0,
+                    "description": "One-time Registration Fee",
+                    "hsn_code": "998311"
+                })
+            hospital_files = files_by_hospital[hospital.hospital_id]
+            for f in hospital_files:
+                items.append({
+                    "file_id": f.file_id,
+                    "amount": f.cost,
+                    "discount": 0.0,
+                    "description": f"Processing MRD: {f.patient_u_id} - {f.patient_name} ({f.filename})",
+                    "hsn_code": "998311"
+                })
+
+            subtotal = sum(i["amount"] for i in items)
+            tax_amount = (subtotal * gst_rate) / 100
+            plans.append({
+                "hospital": hospital,
+                "files": hospital_files,
+                "items": items,
+                "invoice": Invoice(
+                    hospital_id=hospital.hospital_id,
+                    invoice_number=invoice_number,
+                    total_amount=round(subtotal + tax_amount),
+                    tax_amount=tax_amount,
+                    gst_rate=gst_rate,
+                    bill_date=bill_date,
+                    due_date=due_date,
+                    status="PENDING"
+                ),
+            })
+
+        # Invoices are flushed together (batched INSERT ... RETURNING) to get their ids
+        db.add_all([p["invoice"] for p in plans])
+        db.flush()
+
+        item_rows = []
+        file_invoice_ids: Dict[int, int] = {}
+        ledger_entries = []
+        for plan in plans:
+            invoice = plan["invoice"]
+            for item in plan["items"]:
+                item_rows.append({"invoice_id": invoice.invoice_id, **item})
+            for f in plan["files"]:
+                file_invoice_ids[f.file_id] = invoice.invoice_id
+            ledger_entries.append(AccountingTransaction(
+                party_type="HOSPITAL",
+                party_id=invoice.hospital_id,
+                voucher_type="INVOICE",
+                voucher_id=invoice.invoice_id,
+                voucher_number=invoice.invoice_number,
+                debit=invoice.total_amount,
+                credit=0.0,
+                description=f"Sales Invoice for {len(plan['files'])} records and items",
+                date=bill_date
+            ))
+
+        if item_rows:
+            db.execute(insert(InvoiceItem), item_rows)
+        BillingService.mark_invoiced_many(db, file_invoice_ids)
+        db.add_all(ledger_entries)
+
+        reg_fee_hospitals = [
+            p["hospital"].hospital_id for p in plans
+            if any(i["description"] == "One-time Registration Fee" for i in p["items"])
+        ]
+        if reg_fee_hospitals:
+            db.execute(
+                update(Hospital).where(Hospital.hospital_id.in_(reg_fee_hospitals)).values(is_reg_fee_paid=True)
+            )
+
+        result = [
+            {
+                "hospital_id": p["hospital"].hospital_id,
+                "hospital_name": p["hospital"].legal_name,
+                "invoice_id": p["invoice"].invoice_id,
+                "invoice_number": p["invoice"].invoice_number,
+                "file_count": len(p["files"]),
+                "total_pages": sum(f.page_count or 0 for f in p["files"]),
+                "tax_amount": round(p["invoice"].tax_amount, 2),
+                "grand_total": p["invoice"].total_amount,
+            }
+            for p in plans
+        ]
+
+        run.status = "COMPLETED"
+        run.invoice_count = len(result)
+        run.total_amount = sum(r["grand_total"] for r in result)
+        run.result = result
+        run.completed_at = datetime.now()
+        db.commit()
+
+        print(f"🧾 [BILLING RUN] {run.idempotency_key}: {run.invoice_count} invoices, total {run.total_amount}")
+        return InvoiceRunService.summary(run)
+
+    @staticmethod
+    def summary(run: BillingRun) -> dict:
+        return {
+            "run_id": run.run_id,
+            "idempotency_key": run.idempotency_key,
+            "status": run.status,
+            "period_end": (run.period_end - timedelta(days=1)).date(),
+            "invoice_count": run.invoice_count or 0,
+            "total_amount": run.total_amount or 0.0,
+            "hospitals": run.result or [],
+            "error": run.error,
+        }
@@ -0,0 +1,232 @@
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import and_, delete, event, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from ..models import AccountingTransaction, LedgerBalanceSnapshot
+
+# Transactions without a party (INTERNAL expenses) are checkpointed under party_id 0
+PARTY_KEY = func.coalesce(AccountingTransaction.party_id, 0)
+
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def _naive(dt: Optional[datetime]) -> Optional[datetime]:
+    # Snapshots are stored on naive month boundaries
+    return dt.replace(tzinfo=None) if dt is not None and dt.tzinfo else dt
+
+
+class LedgerService:
+    """
+    Statement of account engine.
+
+    Balances are read from the latest monthly checkpoint (LedgerBalanceSnapshot) plus the
+    transactions dated after it, and statement rows carry a running balance computed with a
+    SQL window function, so neither statements nor dashboard totals scan the full history.
+    """
+
+    @staticmethod
+    def _party_filter(query, party_type: str, party_id: Optional[int]):
+        query = query.filter(AccountingTransaction.party_type == party_type)
+        if not party_id:
+            return query.filter(AccountingTransaction.party_id.is_(None))
+        return query.filter(AccountingTransaction.party_id == party_id)
+
+    @staticmethod
+    def balance_as_of(db: Session, party_type: str, party_id: Optional[int], as_of: Optional[datetime]) -> float:
+        """Debit - credit of every transaction for the party dated before `as_of` (None = all)."""
+        as_of = _naive(as_of)
+        snap_query = db.query(LedgerBalanceSnapshot).filter(
+            LedgerBalanceSnapshot.party_type == party_type,
+            LedgerBalanceSnapshot.party_id == (party_id or 0)
+        )
+        if as_of is not None:
+            snap_query = snap_query.filter(LedgerBalanceSnapshot.period_end <= as_of)
+        snapshot = snap_query.order_by(LedgerBalanceSnapshot.period_end.desc()).first()
+
+        delta_query = LedgerService._party_filter(
+            db.query(func.coalesce(func.sum(AccountingTransaction.debit - AccountingTransaction.credit), 0.0)),
+            party_type, party_id
+        )
+        if snapshot:
+            delta_query = delta_query.filter(AccountingTransaction.date >= snapshot.period_end)
+        if as_of is not None:
+            delta_query = delta_query.filter(AccountingTransaction.date < as_of)
+
+        opening = (snapshot.total_debit - snapshot.total_credit) if snapshot else 0.0
+        return float(opening + (delta_query.scalar() or 0.0))
+
+    @staticmethod
+    def statement(
+        db: Session,
+        party_type: str,
+        party_id: Optional[int],
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        skip: int = 0,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """
+        Opening balance at start_date, then the window's transactions with running balances.
+        Paging is applied after the window function so every row keeps its true balance.
+        """
+        opening_balance = LedgerService.balance_as_of(db, party_type, party_id, start_date) if start_date else 0.0
+
+        window = LedgerService._party_filter(db.query(AccountingTransaction), party_type, party_id)
+        if start_date:
+            window = window.filter(AccountingTransaction.date >= start_date)
+        if end_date:
+            window = window.filter(AccountingTransaction.date < end_date)
+
+        running = func.sum(AccountingTransaction.debit - AccountingTransaction.credit).over(
+            order_by=(AccountingTransaction.date, AccountingTransaction.transaction_id)
+        )
+        ordered = window.add_columns(running.label("running_total")).subquery()
+
+        totals = db.query(
+            func.count(ordered.c.transaction_id),
+            func.coalesce(func.sum(ordered.c.debit), 0.0),
+            func.coalesce(func.sum(ordered.c.credit), 0.0),
+        ).one()
+        total_count, window_debit, window_credit = totals
+
+        page = db.query(ordered).order_by(ordered.c.date, ordered.c.transaction_id).offset(skip)
+        if limit is not None:
+            page = page.limit(limit)
+
+        transactions = []
+        for row in page.all():
+            txn = dict(row._mapping)
+            txn["running_balance"] = opening_balance + float(txn.pop("running_total") or 0.0)
+            transactions.append(txn)
+
+        return {
+            "opening_balance": opening_balance,
+            "closing_balance": opening_balance + float(window_debit) - float(window_credit),
+            "total_debit": float(window_debit),
+            "total_credit": float(window_credit),
+            "total_count": total_count,
+            "transactions": transactions,
+        }
+
+    @staticmethod
+    def balances_by_party(db: Session, as_of: Optional[datetime] = None) -> Dict[Tuple[str, int], Tuple[float, float]]:
+        """
+        Cumulative (debit, credit) per (party_type, party_id) before `as_of`, in two queries:
+        each party's latest checkpoint, then the transactions dated after it.
+        """
+        as_of = _naive(as_of)
+        latest_query = select(
+            LedgerBalanceSnapshot.party_type,
+            LedgerBalanceSnapshot.party_id,
+            func.max(LedgerBalanceSnapshot.period_end).label("period_end"),
+        ).group_by(LedgerBalanceSnapshot.party_type, LedgerBalanceSnapshot.party_id)
+        if as_of is not None:
+            latest_query = latest_query.where(LedgerBalanceSnapshot.period_end <= as_of)
+        latest = latest_query.subquery()
+
+        balances = {}
+        snapshots = db.query(
+            LedgerBalanceSnapshot.party_type, LedgerBalanceSnapshot.party_id,
+            LedgerBalanceSnapshot.total_debit, LedgerBalanceSnapshot.total_credit
+        ).join(latest, and_(
+            LedgerBalanceSnapshot.party_type == latest.c.party_type,
+            LedgerBalanceSnapshot.party_id == latest.c.party_id,
+            LedgerBalanceSnapshot.period_end == latest.c.period_end
+        ))
+        for party_type, party_id, debit, credit in snapshots:
+            balances[(party_type, party_id)] = (debit or 0.0, credit or 0.0)
+
+        deltas = db.query(
+            AccountingTransaction.party_type, PARTY_KEY,
+            func.coalesce(func.sum(AccountingTransaction.debit), 0.0),
+            func.coalesce(func.sum(AccountingTransaction.credit), 0.0),
+        ).outerjoin(latest, and_(
+            AccountingTransaction.party_type == latest.c.party_type,
+            PARTY_KEY == latest.c.party_id
+        )).filter(
+            or_(latest.c.period_end.is_(None), AccountingTransaction.date >= latest.c.period_end)
+        )
+        if as_of is not None:
+            deltas = deltas.filter(AccountingTransaction.date < as_of)
+        deltas = deltas.group_by(AccountingTransaction.party_type, PARTY_KEY)
+
+        for party_type, party_id, debit, credit in deltas:
+            prev_debit, prev_credit = balances.get((party_type, party_id), (0.0, 0.0))
+            balances[(party_type, party_id)] = (prev_debit + float(debit), prev_credit + float(credit))
+
+        return balances
+
+    @staticmethod
+    def totals_by_party_type(db: Session) -> Dict[str, Tuple[float, float]]:
+        """Current (debit, credit) per party type, e.g. for receivables/payables."""
+        totals = {}
+        for (party_type, _), (debit, credit) in LedgerService.balances_by_party(db).items():
+            prev_debit, prev_credit = totals.get(party_type, (0.0, 0.0))
+            totals[party_type] = (prev_debit + debit, prev_credit + credit)
+        return totals
+
+    @staticmethod
+    def close_period(db: Session, period_end: Optional[datetime] = None) -> int:
+        """
+        Writes checkpoints for every party as of `period_end` (defaults to the start of the
+        current month, i.e. closes last month). Idempotent: existing checkpoints are replaced.
+        """
+        period_end = month_start(_naive(period_end) or datetime.now())
+        balances = LedgerService.balances_by_party(db, period_end)
+
+        db.execute(delete(LedgerBalanceSnapshot).where(LedgerBalanceSnapshot.period_end == period_end))
+        db.bulk_insert_mappings(LedgerBalanceSnapshot, [
+            {
+                "party_type": party_type,
+                "party_id": party_id,
+                "period_end": period_end,
+                "total_debit": debit,
+                "total_credit": credit,
+            }
+            for (party_type, party_id), (debit, credit) in balances.items()
+        ])
+        db.commit()
+        print(f"📒 [LEDGER] Closed period ending {period_end:%Y-%m-%d} for {len(balances)} parties")
+        return len(balances)
+
+
+@event.listens_for(Session, "before_flush")
+def _invalidate_stale_snapshots(session, flush_context, instances):
+    """
+    A voucher created, edited or deleted on or before a closed period makes that party's
+    later checkpoints stale; drop them so balances fall back to the previous checkpoint.
+    """
+    affected = {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, AccountingTransaction):
+            continue
+        state = inspect(obj)
+        dates = [obj.date] + list(state.attrs.date.history.deleted)
+        dates = [_naive(d) for d in dates if d is not None]
+        # Unflushed server_default dates are "now": only later checkpoints could be affected
+        since = min(dates) if dates else datetime.now()
+
+        # Moving a voucher between parties makes both ledgers stale
+        party_types = {obj.party_type, *state.attrs.party_type.history.deleted}
+        party_ids = {obj.party_id or 0, *((p or 0) for p in state.attrs.party_id.history.deleted)}
+        parties = {(t, p) for t in party_types for p in party_ids}
+
+        for party in parties:
+            if party not in affected or since < affected[party]:
+                affected[party] = since
+
+    if not affected:
+        return
+
+    snapshots = LedgerBalanceSnapshot.__table__
+    connection = session.connection()
+    for (party_type, party_id), since in affected.items():
+        connection.execute(delete(snapshots).where(
+            snapshots.c.party_type == party_type,
+            snapshots.c.party_id == party_id,
+            snapshots.c.period_end > since
+        ))
@@ -0,0 +1,174 @@
+from typing import List, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models import AccountingConfig, AvailableInvoiceNumber, Invoice
+
+# Voucher series -> (AccountingConfig counter column, prefix column, default prefix).
+# The series name doubles as AvailableInvoiceNumber.invoice_type for the gap pool,
+# so the pool is namespaced per (series, financial year).
+SERIES = {
+    "gst": ("next_invoice_number", "invoice_prefix", "INV"),
+    "nongst": ("next_invoice_number_nongst", "invoice_prefix_nongst", "BOS"),
+    "receipt": ("next_receipt_number", "receipt_prefix", "RCPT"),
+    "expense": ("next_expense_number", "expense_prefix", "EXP"),
+}
+
+
+def invoice_series(is_gst_bill: bool) -> str:
+    return "gst" if is_gst_bill else "nongst"
+
+
+class NumberingService:
+    """
+    Invoice / voucher number allocator.
+
+    Numbers are reserved in their own short transaction on the caller's engine, so the
+    billing transaction never holds the counter row lock:
+      1. gaps left by deleted vouchers are claimed with SELECT ... FOR UPDATE SKIP LOCKED,
+         so concurrent allocators take different gaps instead of queueing;
+      2. the rest comes from one atomic UPDATE ... RETURNING on the config counter,
+         which reserves a whole block for batch runs.
+    If the caller's transaction fails, `release` returns the numbers to the gap pool,
+    keeping the statutory series gapless without retries.
+
+    Single-voucher callers (receipts, expenses) pass `same_transaction=True` instead: the
+    number is reserved in the caller's session, so it commits or rolls back with the insert.
+    """
+
+    @staticmethod
+    def _config_id(session: Session) -> int:
+        config_id = session.execute(
+            select(AccountingConfig.config_id).order_by(AccountingConfig.config_id).limit(1)
+        ).scalar()
+        if config_id is None:
+            config = AccountingConfig()
+            session.add(config)
+            session.flush()
+            config_id = config.config_id
+        return config_id
+
+    @staticmethod
+    def _reserve(session: Session, series: str, count: int) -> List[int]:
+        counter_col = getattr(AccountingConfig, SERIES[series][0])
+        config_id = NumberingService._config_id(session)
+        fy = session.execute(
+            select(AccountingConfig.current_fy).where(AccountingConfig.config_id == config_id)
+        ).scalar()
+
+        gaps = session.execute(
+            select(AvailableInvoiceNumber.id, AvailableInvoiceNumber.number).where(
+                AvailableInvoiceNumber.invoice_type == series,
+                AvailableInvoiceNumber.financial_year == fy
+            ).order_by(AvailableInvoiceNumber.number).limit(count).with_for_update(skip_locked=True)
+        ).all()
+        numbers = [g.number for g in gaps]
+        if gaps:
+            session.execute(delete(AvailableInvoiceNumber).where(
+                AvailableInvoiceNumber.id.in_([g.id for g in gaps])
+            ))
+
+        remaining = count - len(numbers)
+        if remaining:
+            next_number = session.execute(
+                update(AccountingConfig)
+                .where(AccountingConfig.config_id == config_id)
+                .values({counter_col: func.coalesce(counter_col, 1) + remaining})
+                .returning(counter_col)
+            ).scalar()
+            numbers.extend(range(next_number - remaining, next_number))
+        return sorted(numbers)
+
+    @staticmethod
+    def allocate(db: Session, series: str, count: int = 1, same_transaction: bool = False) -> List[int]:
+        """
+        Reserve `count` numbers of a series for the current financial year. Committed
+        immediately, or with the caller's transaction when `same_transaction` is set.
+        """
+        if count <= 0:
+            return []
+        if same_transaction:
+            return NumberingService._reserve(db, series, count)
+
+        with Session(bind=db.get_bind()) as alloc:
+            numbers = NumberingService._reserve(alloc, series, count)
+            alloc.commit()
+        return numbers
+
+    @staticmethod
+    def format(db: Session, series: str, numbers: List[int], financial_year: Optional[str] = None) -> List[str]:
+        """Render numbers with the configured prefix and number_format."""
+        config = db.query(AccountingConfig).order_by(AccountingConfig.config_id).first() or AccountingConfig()
+        _, prefix_col, default_prefix = SERIES[series]
+        prefix = getattr(config, prefix_col) or default_prefix
+        number_format = config.number_format or "{prefix}/{fy}/{number:04d}"
+        fy = financial_year or config.current_fy or "2025-26"
+        return [number_format.format(prefix=prefix, fy=fy, number=n) for n in numbers]
+
+    @staticmethod
+    def next_numbers(db: Session, series: str, count: int = 1, same_transaction: bool = False) -> List[str]:
+        """allocate + format."""
+        return NumberingService.format(db, series, NumberingService.allocate(db, series, count, same_transaction))
+
+    @staticmethod
+    def next_invoice_numbers(db: Session, series: str, count: int = 1):
+        """
+        (numbers, invoice_numbers) for `count` new invoices. Numbers already taken by
+        manually numbered invoices are skipped (they stay consumed), so inserts never
+        fail on the unique constraint.
+        """
+        numbers, rendered = [], []
+        for _ in range(5):
+            needed = count - len(numbers)
+            if not needed:
+                break
+            batch = NumberingService.allocate(db, series, needed)
+            formatted = NumberingService.format(db, series, batch)
+            taken = {n for (n,) in db.query(Invoice.invoice_number).filter(Invoice.invoice_number.in_(formatted))}
+            for number, invoice_number in zip(batch, formatted):
+                if invoice_number not in taken:
+                    numbers.append(number)
+                    rendered.append(invoice_number)
+
+        if len(numbers) < count:
+            NumberingService.release(db, series, numbers)
+            raise RuntimeError(f"Could not allocate {count} free '{series}' invoice numbers")
+        return numbers, rendered
+
+    @staticmethod
+    def release(db: Session, series: str, numbers: List[int], financial_year: Optional[str] = None):
+        """Return unused (or deleted vouchers') numbers to the gap pool. Already pooled numbers are skipped."""
+        if not numbers:
+            return
+        with Session(bind=db.get_bind()) as alloc:
+            if financial_year is None:
+                financial_year = alloc.execute(
+                    select(AccountingConfig.current_fy).order_by(AccountingConfig.config_id).limit(1)
+                ).scalar() or "2025-26"
+            for number in numbers:
+                try:
+                    with alloc.begin_nested():
+                        alloc.add(AvailableInvoiceNumber(
+                            number=number, invoice_type=series, financial_year=financial_year
+                        ))
+                except IntegrityError:
+                    pass
+            alloc.commit()
+
+    @staticmethod
+    def parse(db: Session, voucher_number: str):
+        """
+        (series, financial_year, number) for a voucher number in the default
+        PREFIX/FY/NUMBER format, or None if it cannot be attributed to a series.
+        """
+        parts = (voucher_number or "").split('/')
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+        config = db.query(AccountingConfig).order_by(AccountingConfig.config_id).first() or AccountingConfig()
+        for series, (_, prefix_col, default_prefix) in SERIES.items():
+            if parts[0] in (getattr(config, prefix_col), default_prefix):
+                return series, parts[1], int(parts[2])
+        return None
+
@@ -0,0 +1,245 @@
+"""
+Warehouse occupancy model (storage layout, slot heatmap, inventory utilization).
+
+Each worker keeps aisle -> rack -> slot -> box -> fill level in memory: all racks and
+boxes are loaded with two queries and fill levels come from `PhysicalBox.current_count`
+(see services/box_fill.py), so the layout endpoints and the inventory report never
+count patients. Commits that touch racks, boxes or box assignments reload just those
+rows; changes made by other workers (or bulk SQL) show up after
+OCCUPANCY_CACHE_SECONDS at most, when the model is rebuilt.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models import PhysicalBox, PhysicalRack
+
+_RACK_COLUMNS = (
+    PhysicalRack.rack_id, PhysicalRack.label, PhysicalRack.aisle, PhysicalRack.hospital_id,
+    PhysicalRack.warehouse_id, PhysicalRack.capacity, PhysicalRack.total_rows, PhysicalRack.total_columns
+)
+_BOX_COLUMNS = (
+    PhysicalBox.box_id, PhysicalBox.label, PhysicalBox.hospital_id, PhysicalBox.rack_id,
+    PhysicalBox.rack_row, PhysicalBox.rack_column, PhysicalBox.location_code, PhysicalBox.status,
+    PhysicalBox.category, PhysicalBox.capacity, PhysicalBox.current_count, PhysicalBox.created_at
+)
+
+
+def _rack_entry(row) -> dict:
+    return {
+        "rack_id": row.rack_id, "label": row.label, "aisle": row.aisle or 0,
+        "hospital_id": row.hospital_id, "warehouse_id": row.warehouse_id, "capacity": row.capacity,
+        "rows": row.total_rows or 5, "columns": row.total_columns or 10
+    }
+
+
+def _box_entry(row) -> dict:
+    return {
+        "box_id": row.box_id, "label": row.label, "hospital_id": row.hospital_id,
+        "rack_id": row.rack_id, "row": row.rack_row, "column": row.rack_column,
+        "location": row.location_code, "status": row.status, "category": row.category,
+        "capacity": row.capacity, "count": row.current_count or 0, "created_at": row.created_at
+    }
+
+
+def _fill_pct(box: dict) -> float:
+    return round((box["count"] / box["capacity"]) * 100, 1) if box["capacity"] else 0
+
+
+class WarehouseOccupancy:
+    _lock = threading.Lock()
+    _racks: Dict[int, dict] = {}
+    _boxes: Dict[int, dict] = {}
+    _loaded_at: Optional[float] = None
+
+    # --- model maintenance ---
+
+    @classmethod
+    def _ensure(cls, db: Session):
+        loaded_at = cls._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < settings.OCCUPANCY_CACHE_SECONDS:
+            return
+        racks = {row.rack_id: _rack_entry(row) for row in db.execute(select(*_RACK_COLUMNS))}
+        boxes = {row.box_id: _box_entry(row) for row in db.execute(select(*_BOX_COLUMNS))}
+        with cls._lock:
+            cls._racks, cls._boxes = racks, boxes
+            cls._loaded_at = time.monotonic()
+
+    @classmethod
+    def refresh(cls, db: Session, box_ids=(), rack_ids=()):
+        """Reload the given rows into a loaded model (deleted rows are dropped)."""
+        if cls._loaded_at is None:
+            return
+        box_ids, rack_ids = {i for i in box_ids if i}, {i for i in rack_ids if i}
+        racks = {row.rack_id: _rack_entry(row) for row in db.execute(
+            select(*_RACK_COLUMNS).where(PhysicalRack.rack_id.in_(rack_ids))
+        )} if rack_ids else {}
+        boxes = {row.box_id: _box_entry(row) for row in db.execute(
+            select(*_BOX_COLUMNS).where(PhysicalBox.box_id.in_(box_ids))
+        )} if box_ids else {}
+        with cls._lock:
+            for rack_id in rack_ids:
+                if rack_id in racks:
+                    cls._racks[rack_id] = racks[rack_id]
+                else:
+                    cls._racks.pop(rack_id, None)
+            for box_id in box_ids:
+                if box_id in boxes:
+                    cls._boxes[box_id] = boxes[box_id]
+                else:
+                    cls._boxes.pop(box_id, None)
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._loaded_at = None
+
+    @classmethod
+    def _snapshot(cls, db: Session):
+        cls._ensure(db)
+        with cls._lock:
+            return list(cls._racks.values()), list(cls._boxes.values())
+
+    # --- views ---
+
+    @classmethod
+    def layout(cls, db: Session) -> List[dict]:
+        """Aisles -> racks with box count (`occupied`), used slots and file fill."""
+        racks, boxes = cls._snapshot(db)
+        per_rack: Dict[int, List[dict]] = {}
+        for box in boxes:
+            if box["rack_id"]:
+                per_rack.setdefault(box["rack_id"], []).append(box)
+
+        aisles: Dict[int, list] = {}
+        for rack in sorted(racks, key=lambda r: (r["aisle"], r["label"], r["rack_id"])):
+            rack_boxes = per_rack.get(rack["rack_id"], [])
+            slots = rack["rows"] * rack["columns"]
+            used = len({(b["row"], b["column"]) for b in rack_boxes if b["row"] and b["column"]})
+            files = sum(b["count"] for b in rack_boxes)
+            file_capacity = sum(b["capacity"] or 0 for b in rack_boxes)
+            aisles.setdefault(rack["aisle"], []).append({
+                "id": str(rack["rack_id"]),
+                "name": rack["label"],
+                "capacity": rack["capacity"],
+                "occupied": len(rack_boxes),
+                "slots": slots,
+                "slots_used": used,
+                "files": files,
+                "file_capacity": file_capacity,
+                "fill_pct": round(files / file_capacity * 100, 1) if file_capacity else 0
+            })
+        return [{"aisle": aisle, "racks": aisles[aisle]} for aisle in sorted(aisles)]
+
+    @classmethod
+    def heatmap(
+        cls,
+        db: Session,
+        aisle: Optional[int] = None,
+        rack_id: Optional[int] = None,
+        hospital_id: Optional[int] = None
+    ) -> List[dict]:
+        """
+        Per-slot grid of each rack: `fill[row-1][column-1]` is the fill % of the box in
+        that slot (None = empty slot). Labels of other hospitals' boxes are hidden when
+        `hospital_id` is given.
+        """
+        racks, boxes = cls._snapshot(db)
+        by_slot = {(b["rack_id"], b["row"], b["column"]): b for b in boxes if b["rack_id"]}
+        result = []
+        for rack in sorted(racks, key=lambda r: (r["aisle"], r["label"], r["rack_id"])):
+            if (aisle is not None and rack["aisle"] != aisle) or (rack_id is not None and rack["rack_id"] != rack_id):
+                continue
+            fill, labels = [], []
+            for row in range(1, rack["rows"] + 1):
+                fill_row, label_row = [], []
+                for column in range(1, rack["columns"] + 1):
+                    box = by_slot.get((rack["rack_id"], row, column))
+                    fill_row.append(_fill_pct(box) if box else None)
+                    visible = box and (hospital_id is None or box["hospital_id"] == hospital_id)
+                    label_row.append(box["label"] if visible else None)
+                fill.append(fill_row)
+                labels.append(label_row)
+            result.append({
+                "rack_id": rack["rack_id"], "label": rack["label"], "aisle": rack["aisle"],
+                "rows": rack["rows"], "columns": rack["columns"], "fill": fill, "boxes": labels
+            })
+        return result
+
+    @classmethod
+    def inventory(cls, db: Session, hospital_id: Optional[int] = None, search: Optional[str] = None) -> List[dict]:
+        """Inventory report rows (per-box files stored and utilization)."""
+        racks, boxes = cls._snapshot(db)
+        rack_labels = {r["rack_id"]: r["label"] for r in racks}
+        term = (search or "").lower()
+        data = []
+        for box in sorted(boxes, key=lambda b: b["box_id"]):
+            if hospital_id is not None and box["hospital_id"] != hospital_id:
+                continue
+            rack = rack_labels.get(box["rack_id"], "Unassigned")
+            if term and not any(term in (v or "").lower() for v in (box["label"], box["location"], rack)):
+                continue
+            data.append({
+                "box_label": box["label"],
+                "location": box["location"],
+                "rack": rack,
+                "status": box["status"],
+                "files_stored": box["count"],
+                "capacity": box["capacity"],
+                "utilization_pct": _fill_pct(box),
+                "created_at": box["created_at"].strftime("%d/%m/%Y") if box["created_at"] else "N/A"
+            })
+        return data
+
+    @classmethod
+    def export(cls, db: Session, hospital_id: Optional[int] = None) -> dict:
+        """Whole model as column-ordered arrays (compact JSON for the frontend)."""
+        racks, boxes = cls._snapshot(db)
+        rack_fields = ["rack_id", "label", "aisle", "rows", "columns", "hospital_id", "warehouse_id"]
+        box_fields = ["box_id", "label", "rack_id", "row", "column", "count", "capacity", "status", "category", "hospital_id"]
+        if hospital_id is not None:
+            boxes = [b for b in boxes if b["hospital_id"] == hospital_id]
+        return {
+            "rack_fields": rack_fields,
+            "racks": [[r[f] for f in rack_fields] for r in sorted(racks, key=lambda r: r["rack_id"])],
+            "box_fields": box_fields,
+            "boxes": [[b[f] for f in box_fields] for b in sorted(boxes, key=lambda b: b["box_id"])],
+        }
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    """
+    Remember the racks / boxes this transaction touched (ids exist after the flush).
+    Fill count changes arrive through BoxFill.apply_deltas, which records its boxes too.
+    """
+    boxes = {obj.box_id for obj in list(session.new) + list(session.dirty) + list(session.deleted) if isinstance(obj, PhysicalBox)}
+    racks = {obj.rack_id for obj in list(session.new) + list(session.dirty) + list(session.deleted) if isinstance(obj, PhysicalRack)}
+    if boxes:
+        session.info.setdefault("changed_boxes", set()).update(boxes)
+    if racks:
+        session.info.setdefault("changed_racks", set()).update(racks)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changes(session, previous_transaction):
+    session.info.pop("changed_boxes", None)
+    session.info.pop("changed_racks", None)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    boxes = session.info.pop("changed_boxes", None)
+    racks = session.info.pop("changed_racks", None)
+    if not (boxes or racks) or WarehouseOccupancy._loaded_at is None:
+        return
+    try:
+        with Session(bind=session.get_bind()) as reader:
+            WarehouseOccupancy.refresh(reader, boxes or (), racks or ())
+    except Exception as e:
+        print(f"⚠️ Occupancy refresh failed, rebuilding on next read: {e}")
+        WarehouseOccupancy.invalidate()
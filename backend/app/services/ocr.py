@@ -4,11 +4,32 @@ import sys
 import os
 import shutil
 
-# Try imports for OCR
-try:
-    import pytesseract
-    from pdf2image import convert_from_bytes
-    from PIL import Image
+# OCR tools (pytesseract, pdf2image, Pillow) are imported and configured on first use,
+# so importing this module (every worker boot) costs nothing
+HAS_OCR = None
+POPPLER_PATH = None
+pytesseract = None
+convert_from_bytes = None
+
+
+def ensure_ocr() -> bool:
+    """Imports and auto-configures the OCR tools once; returns whether OCR is available."""
+    global HAS_OCR, POPPLER_PATH, pytesseract, convert_from_bytes
+    if HAS_OCR is not None:
+        return HAS_OCR
+
+    # Try imports for OCR
+    try:
+        import pytesseract as _pytesseract
+        from pdf2image import convert_from_bytes as _convert_from_bytes
+        from PIL import Image
+    except ImportError:
+        HAS_OCR = False
+        print("Warning: OCR Dependencies missing. Falling back to text-only mode.")
+        return HAS_OCR
+
+    pytesseract = _pytesseract
+    convert_from_bytes = _convert_from_bytes
     HAS_OCR = True
     
     # --- AUTO-CONFIGURE EXTERNAL TOOLS ---
@@ -38,7 +59,6 @@ try:
     project_root = os.getcwd()
     local_poppler_bin = os.path.join(project_root, "poppler-25.12.0", "Library", "bin")
     
-    POPPLER_PATH = None
     if os.path.exists(local_poppler_bin):
         POPPLER_PATH = local_poppler_bin
         # Add to PATH temporarily for this process to ensure other tools prefer it
@@ -49,9 +69,7 @@ try:
         if not shutil.which("pdftoppm"):
              print("[WARN] OCR Config: Poppler not found locally or in PATH. PDF processing may fail.")
 
-except ImportError:
-    HAS_OCR = False
-    print("Warning: OCR Dependencies missing. Falling back to text-only mode.")
+    return HAS_OCR
 
 from pypdf import PdfReader
 
@@ -75,7 +93,7 @@ def extract_text_from_pdf(file_bytes: bytes) -> str:
         text = digital_text.strip()
         
         # 2. OCR Fallback (if text is too short, likely a scan)
-        if len(text) < 50 and HAS_OCR:
+        if len(text) < 50 and ensure_ocr():
             print("[INFO] Low text density detected. Attempting OCR...")
             try:
                 # Get page count first
@@ -173,7 +191,7 @@ def extract_text_from_image(file_bytes: bytes) -> str:
     """
     Extracts text from an image file (bytes) using Tesseract.
     """
-    if not HAS_OCR:
+    if not ensure_ocr():
         print("[WARN] OCR disabled. Cannot extract text from image.")
         return ""
         
@@ -0,0 +1,232 @@
+"""
+Pick lists for file retrieval requests (/storage/requests/pick-list).
+
+Pending requests are resolved to their boxes in one query and grouped so that each box
+is one stop. Stops are placed on a simple warehouse model:
+
+- aisles are parallel, `PICK_AISLE_SPACING_M` apart, joined by a cross aisle at the
+  front (x = 0) and at the back (the end of the longest aisle);
+- racks stand side by side along their aisle in label order, `PICK_RACK_WIDTH_M` wide,
+  and a box sits at its column's position in the rack (the row is only the shelf height).
+
+The walk starts and ends at the dock (front of aisle 0). The route is built nearest
+neighbour first and then improved with 2-opt, separately per warehouse. Boxes without
+a rack are listed as unlocated.
+"""
+import csv
+import io
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models import FileRequest, PhysicalBox, PhysicalRack
+
+PICKABLE_STATUSES = ("Pending", "Approved")
+MAX_TWO_OPT_STOPS = 400  # above this the nearest-neighbour route is used as is
+MAX_TWO_OPT_PASSES = 20
+
+
+class _Layout:
+    """Aisle / along-aisle coordinates of racks (one query per pick list)."""
+
+    def __init__(self, racks: Sequence):
+        self.position: Dict[int, int] = {}  # rack_id -> index along its aisle
+        per_aisle: Dict[tuple, int] = {}
+        for rack in sorted(racks, key=lambda r: (r.warehouse_id or 0, r.aisle or 0, r.label, r.rack_id)):
+            key = (rack.warehouse_id or 0, rack.aisle or 0)
+            self.position[rack.rack_id] = per_aisle.get(key, 0)
+            per_aisle[key] = self.position[rack.rack_id] + 1
+        self.depth = max(per_aisle.values(), default=1) * settings.PICK_RACK_WIDTH_M
+
+    def point(self, box) -> tuple:
+        columns = box.total_columns or 10
+        column = min(max(box.rack_column or 1, 1), columns)
+        x = (self.position[box.rack_id] + (column - 0.5) / columns) * settings.PICK_RACK_WIDTH_M
+        return (box.aisle or 0, x, box.rack_row or 0)
+
+    def distance(self, a: tuple, b: tuple) -> float:
+        if a[0] == b[0]:
+            return abs(a[1] - b[1])
+        across = abs(a[0] - b[0]) * settings.PICK_AISLE_SPACING_M
+        via_front = a[1] + b[1]
+        via_back = (self.depth - a[1]) + (self.depth - b[1])
+        return across + min(via_front, via_back)
+
+
+def _route_length(order: List[int], dist) -> float:
+    return sum(dist[a][b] for a, b in zip(order, order[1:]))
+
+
+def _nearest_neighbour(dist) -> List[int]:
+    """Closed tour over nodes 0..n-1 starting at 0 (the dock)."""
+    unvisited = set(range(1, len(dist)))
+    order = [0]
+    while unvisited:
+        here = dist[order[-1]]
+        nearest = min(unvisited, key=lambda n: (here[n], n))
+        unvisited.remove(nearest)
+        order.append(nearest)
+    order.append(0)
+    return order
+
+
+def _two_opt(order: List[int], dist) -> List[int]:
+    """Reverse route segments while that shortens the tour (dock stays at both ends)."""
+    for _ in range(MAX_TWO_OPT_PASSES):
+        improved = False
+        for i in range(1, len(order) - 2):
+            for j in range(i + 1, len(order) - 1):
+                a, b, c, d = order[i - 1], order[i], order[j], order[j + 1]
+                if dist[a][c] + dist[b][d] < dist[a][b] + dist[c][d] - 1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+        if not improved:
+            break
+    return order
+
+
+def _estimate(distance_m: float, stops: int, files: int) -> dict:
+    walk_seconds = distance_m / settings.PICK_WALK_SPEED_M_S
+    handling_seconds = stops * settings.PICK_SECONDS_PER_STOP + files * settings.PICK_SECONDS_PER_FILE
+    return {
+        "distance_m": round(distance_m, 1),
+        "walk_minutes": round(walk_seconds / 60, 1),
+        "estimated_minutes": round((walk_seconds + handling_seconds) / 60, 1),
+    }
+
+
+class PickListService:
+    @staticmethod
+    def pending_stops(
+        db: Session,
+        hospital_id: Optional[int] = None,
+        request_ids: Optional[List[int]] = None,
+        statuses: Sequence[str] = PICKABLE_STATUSES
+    ) -> List[dict]:
+        """One entry per box holding requested files, with its location (one query)."""
+        query = (
+            select(
+                FileRequest.request_id, FileRequest.requester_name, FileRequest.request_date,
+                PhysicalBox.box_id, PhysicalBox.label, PhysicalBox.location_code,
+                PhysicalBox.rack_id, PhysicalBox.rack_row, PhysicalBox.rack_column,
+                PhysicalRack.label.label("rack_label"), PhysicalRack.aisle,
+                PhysicalRack.warehouse_id, PhysicalRack.total_columns
+            )
+            .join(PhysicalBox, PhysicalBox.box_id == FileRequest.box_id)
+            .outerjoin(PhysicalRack, PhysicalRack.rack_id == PhysicalBox.rack_id)
+            .where(FileRequest.status.in_(statuses))
+            .order_by(FileRequest.request_id)
+        )
+        if hospital_id is not None:
+            query = query.where(FileRequest.hospital_id == hospital_id)
+        if request_ids:
+            query = query.where(FileRequest.request_id.in_(request_ids))
+
+        stops: Dict[int, dict] = {}
+        for row in db.execute(query):
+            stop = stops.get(row.box_id)
+            if stop is None:
+                stop = stops[row.box_id] = {"row": row, "request_ids": [], "requesters": []}
+            stop["request_ids"].append(row.request_id)
+            if row.requester_name not in stop["requesters"]:
+                stop["requesters"].append(row.requester_name)
+        return list(stops.values())  # in order of each box's first request
+
+    @staticmethod
+    def build(
+        db: Session,
+        hospital_id: Optional[int] = None,
+        request_ids: Optional[List[int]] = None,
+        statuses: Sequence[str] = PICKABLE_STATUSES
+    ) -> dict:
+        stops = PickListService.pending_stops(db, hospital_id, request_ids, statuses)
+        located = [s for s in stops if s["row"].rack_id is not None]
+        # Every rack standing in the visited aisles, so positions along an aisle are real
+        aisles = {s["row"].aisle or 0 for s in located}
+        layout = _Layout(db.execute(
+            select(PhysicalRack.rack_id, PhysicalRack.warehouse_id, PhysicalRack.aisle, PhysicalRack.label)
+            .where(PhysicalRack.aisle.in_(aisles))
+        ).all() if located else [])
+
+        by_warehouse: Dict[Optional[int], List[dict]] = {}
+        for stop in located:
+            by_warehouse.setdefault(stop["row"].warehouse_id, []).append(stop)
+
+        routes = []
+        for warehouse_id, group in sorted(by_warehouse.items(), key=lambda i: i[0] or 0):
+            points = [(0, 0.0, 0)] + [layout.point(s["row"]) for s in group]
+            dist = [[layout.distance(a, b) for b in points] for a in points]
+            order = _nearest_neighbour(dist)
+            if len(group) <= MAX_TWO_OPT_STOPS:
+                order = _two_opt(order, dist)
+            distance = _route_length(order, dist)
+            # Walking the boxes in request order, for comparison
+            naive = _route_length([0] + list(range(1, len(points))) + [0], dist)
+
+            route_stops = []
+            for seq, (prev, node) in enumerate(zip(order, order[1:-1]), start=1):
+                stop = group[node - 1]
+                row = stop["row"]
+                route_stops.append({
+                    "sequence": seq,
+                    "box_id": row.box_id,
+                    "box_label": row.label,
+                    "rack_label": row.rack_label,
+                    "aisle": row.aisle,
+                    "row": row.rack_row,
+                    "column": row.rack_column,
+                    "location_code": row.location_code,
+                    "request_ids": stop["request_ids"],
+                    "requesters": stop["requesters"],
+                    "walk_m": round(dist[prev][node], 1),
+                })
+            files = sum(len(s["request_ids"]) for s in group)
+            routes.append({
+                "warehouse_id": warehouse_id,
+                "stops": route_stops,
+                "requests": files,
+                **_estimate(distance, len(group), files),
+                "unoptimized_distance_m": round(naive, 1),
+            })
+
+        unlocated = [{
+            "box_id": s["row"].box_id,
+            "box_label": s["row"].label,
+            "location_code": s["row"].location_code,
+            "request_ids": s["request_ids"],
+        } for s in stops if s["row"].rack_id is None]
+
+        total_distance = sum(r["distance_m"] for r in routes)
+        total_requests = sum(len(s["request_ids"]) for s in stops)
+        return {
+            "routes": routes,
+            "unlocated": unlocated,
+            "total_stops": len(stops),
+            "total_requests": total_requests,
+            **_estimate(total_distance, len(located), sum(r["requests"] for r in routes)),
+        }
+
+    @staticmethod
+    def to_csv(plan: dict) -> str:
+        """Printable walk sheet: one line per stop in route order, unlocated boxes last."""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["Stop", "Warehouse", "Aisle", "Rack", "Row", "Column", "Box", "Location", "Request IDs", "Requested By", "Walk (m)"])
+        for route in plan["routes"]:
+            for stop in route["stops"]:
+                writer.writerow([
+                    stop["sequence"], route["warehouse_id"] or "", stop["aisle"], stop["rack_label"],
+                    stop["row"], stop["column"], stop["box_label"], stop["location_code"] or "",
+                    " ".join(map(str, stop["request_ids"])), ", ".join(stop["requesters"]), stop["walk_m"]
+                ])
+        for box in plan["unlocated"]:
+            writer.writerow([
+                "-", "", "", "", "", "", box["box_label"], box["location_code"] or "UNASSIGNED",
+                " ".join(map(str, box["request_ids"])), "", ""
+            ])
+        writer.writerow([])
+        writer.writerow(["Total distance (m)", plan["distance_m"]])
+        writer.writerow(["Estimated time (min)", plan["estimated_minutes"]])
+        return output.getvalue()
@@ -0,0 +1,263 @@
+import atexit
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import bindparam, event, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from ..core.config import settings
+from ..models import SystemSetting, User
+
+# User columns whose change must not evict the cached principal
+_VOLATILE_USER_FIELDS = {"last_active_at", "updated_at"}
+
+
+class PrincipalCache:
+    """
+    Per-worker cache of authenticated users for get_current_user.
+
+    Entries are detached column snapshots keyed by (email, session_id) with a short TTL;
+    a hit is re-attached to the request session with merge(load=False), so it costs no
+    query and endpoints can still modify the user or lazy-load relationships.
+    Any flushed change to a user (logout, role, password, session) evicts it, and the
+    TTL bounds staleness for changes made by other workers.
+    """
+
+    _lock = threading.Lock()
+    _entries: Dict[Tuple[str, str], Tuple[float, User]] = {}
+    _keys_by_user: Dict[int, set] = {}
+
+    @classmethod
+    def get(cls, db: Session, email: str, session_id: Optional[str]) -> Optional[User]:
+        key = (email.lower(), session_id or "")
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if not entry:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                cls._drop(key, snapshot.user_id)
+                return None
+        return db.merge(snapshot, load=False)
+
+    @staticmethod
+    def snapshot(user: User) -> User:
+        """Detached column copy of `user`, safe to merge(load=False) into any session."""
+        snapshot = User(**{
+            attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs
+        })
+        make_transient_to_detached(snapshot)
+        return snapshot
+
+    @classmethod
+    def put(cls, email: str, session_id: Optional[str], user: User):
+        if settings.PRINCIPAL_CACHE_TTL_SECONDS <= 0:
+            return
+        snapshot = cls.snapshot(user)
+        key = (email.lower(), session_id or "")
+        with cls._lock:
+            cls._entries[key] = (time.monotonic() + settings.PRINCIPAL_CACHE_TTL_SECONDS, snapshot)
+            cls._keys_by_user.setdefault(user.user_id, set()).add(key)
+
+    @classmethod
+    def invalidate_user(cls, user_id: int):
+        with cls._lock:
+            for key in cls._keys_by_user.pop(user_id, set()):
+                cls._entries.pop(key, None)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+            cls._keys_by_user.clear()
+
+    @classmethod
+    def _drop(cls, key, user_id):
+        cls._entries.pop(key, None)
+        keys = cls._keys_by_user.get(user_id)
+        if keys:
+            keys.discard(key)
+
+
+class MaintenanceFlag:
+    """
+    Process-wide cached `maintenance_mode` setting. The value is reloaded when the local
+    version changes or after the TTL. Saving a SystemSetting bumps the version in this
+    worker and, after commit, publishes the bump on a Redis channel that every worker
+    listens to. Without Redis, other workers see the change within the TTL.
+    """
+
+    CHANNEL = "maintenance_flag"
+
+    _lock = threading.Lock()
+    _version = 0
+    _cached: Optional[Tuple[int, float, bool]] = None  # (version, expires_at, enabled)
+    _listener: Optional[threading.Thread] = None
+
+    _query = select(SystemSetting.value).where(SystemSetting.key == "maintenance_mode")
+
+    @classmethod
+    def _fresh(cls) -> Optional[bool]:
+        cached = cls._cached
+        if cached and cached[0] == cls._version and cached[1] > time.monotonic():
+            return cached[2]
+        return None
+
+    @classmethod
+    def _store(cls, version: int, value: Optional[str]) -> bool:
+        enabled = value == "true"
+        with cls._lock:
+            cls._cached = (version, time.monotonic() + settings.MAINTENANCE_FLAG_TTL_SECONDS, enabled)
+        return enabled
+
+    @classmethod
+    def is_enabled(cls, db: Session) -> bool:
+        cls._listen()
+        enabled = cls._fresh()
+        if enabled is None:
+            version = cls._version
+            enabled = cls._store(version, db.execute(cls._query).scalar())
+        return enabled
+
+    @classmethod
+    async def is_enabled_async(cls, db: AsyncSession) -> bool:
+        cls._listen()
+        enabled = cls._fresh()
+        if enabled is None:
+            version = cls._version
+            enabled = cls._store(version, (await db.execute(cls._query)).scalar())
+        return enabled
+
+    @classmethod
+    def bump(cls):
+        with cls._lock:
+            cls._version += 1
+
+    @classmethod
+    def publish(cls) -> bool:
+        """Bump the flag in every worker; False if Redis is unavailable (other workers wait for the TTL)."""
+        try:
+            import redis
+
+            redis.Redis.from_url(settings.REDIS_URL, socket_timeout=0.25, socket_connect_timeout=0.25).publish(cls.CHANNEL, "bump")
+            return True
+        except Exception as e:
+            print(f"⚠️ Maintenance flag: Redis unavailable ({e}), other workers reload within {settings.MAINTENANCE_FLAG_TTL_SECONDS}s")
+            return False
+
+    @classmethod
+    def _listen(cls):
+        if cls._listener is not None:
+            return
+        with cls._lock:
+            if cls._listener is None:
+                cls._listener = threading.Thread(target=cls._run_listener, name="maintenance-flag-listener", daemon=True)
+                cls._listener.start()
+
+    @classmethod
+    def _run_listener(cls):
+        try:
+            import redis
+        except ImportError:
+            return
+        while True:
+            try:
+                pubsub = redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(cls.CHANNEL)
+                cls.bump()  # bumps published while disconnected were missed
+                for _ in pubsub.listen():
+                    cls.bump()
+            except Exception:
+                time.sleep(30)  # no Redis: the TTL bounds staleness
+
+
+class LastActiveWriter:
+    """
+    Write-behind for users.last_active_at: requests only record a timestamp in memory,
+    a daemon thread writes all pending timestamps in one executemany UPDATE per interval.
+    """
+
+    _lock = threading.Lock()
+    _pending: Dict[int, datetime] = {}
+    _last_seen: Dict[int, datetime] = {}
+    _thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def touch(cls, user_id: int, stored: Optional[datetime], now: datetime, min_interval: int = 300) -> bool:
+        """Queue `now` unless the user was marked active less than min_interval seconds ago."""
+        last = max(filter(None, (stored, cls._last_seen.get(user_id))), default=None)
+        if last and (now - last).total_seconds() <= min_interval:
+            return False
+        with cls._lock:
+            cls._last_seen[user_id] = now
+            cls._pending[user_id] = now
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._run, name="last-active-writer", daemon=True)
+                cls._thread.start()
+        return True
+
+    @classmethod
+    def _run(cls):
+        while True:
+            time.sleep(settings.LAST_ACTIVE_FLUSH_SECONDS)
+            cls.flush()
+
+    @classmethod
+    def flush(cls) -> int:
+        with cls._lock:
+            pending, cls._pending = cls._pending, {}
+        if not pending:
+            return 0
+
+        from ..database import SessionLocal
+
+        users = User.__table__
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(users).where(users.c.user_id == bindparam("uid")).values(last_active_at=bindparam("ts")),
+                [{"uid": user_id, "ts": ts} for user_id, ts in pending.items()]
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ last_active_at flush failed ({len(pending)} users): {e}")
+        finally:
+            db.close()
+        return len(pending)
+
+
+atexit.register(LastActiveWriter.flush)
+
+
+@event.listens_for(Session, "before_flush")
+def _track_principal_changes(session, flush_context, instances):
+    user_ids = session.info.setdefault("principal_cache_evict", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            state = inspect(obj)
+            changed = {
+                attr.key for attr in state.attrs
+                if attr.key not in _VOLATILE_USER_FIELDS and attr.history.has_changes()
+            }
+            if changed or obj in session.deleted:
+                user_ids.add(obj.user_id)
+                PrincipalCache.invalidate_user(obj.user_id)
+    if any(isinstance(obj, SystemSetting) for obj in list(session.new) + list(session.dirty)):
+        MaintenanceFlag.bump()
+        session.info["system_settings_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _evict_committed_principals(session):
+    # Evict again after commit: a concurrent request may have cached the pre-commit row
+    for user_id in session.info.pop("principal_cache_evict", set()):
+        PrincipalCache.invalidate_user(user_id)
+    # Bump again once committed (a read before the commit may have cached the old value),
+    # then tell the other workers
+    if session.info.pop("system_settings_changed", False):
+        MaintenanceFlag.bump()
+        MaintenanceFlag.publish()
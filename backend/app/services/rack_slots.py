@@ -0,0 +1,216 @@
+"""
+Rack slot occupancy index.
+
+Each rack stores a bitmap of its occupied (row, column) slots (`slot_bitmap`, bit
+(row-1)*columns + (column-1)) plus a `free_slots` count, so finding space is one
+query for the candidate racks and a few integer operations per rack instead of one
+query per rack and a Python scan of the grid. The bitmap is kept in sync with box
+inserts, moves and deletes by a before_flush listener; a rack without a bitmap (new
+column, resized rack) rebuilds it on first use. Bulk UPDATEs bypass the listener:
+run `python -m app.services.rack_slots` to rebuild every rack after one.
+"""
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from sqlalchemy import event, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from ..models import PhysicalBox, PhysicalRack
+
+
+@lru_cache(maxsize=256)
+def _run_starts(rows: int, columns: int, length: int) -> int:
+    """Bits where a run of `length` slots fits without wrapping into the next row."""
+    if length > columns:
+        return 0
+    row_mask = (1 << (columns - length + 1)) - 1
+    return sum(row_mask << (r * columns) for r in range(rows))
+
+
+def _lowest_bit(bits: int) -> int:
+    return (bits & -bits).bit_length() - 1
+
+
+class RackSlotIndex:
+    @staticmethod
+    def dimensions(rack: PhysicalRack) -> Tuple[int, int]:
+        return rack.total_rows or 5, rack.total_columns or 10
+
+    @staticmethod
+    def slot_bit(rack: PhysicalRack, row: Optional[int], column: Optional[int]) -> Optional[int]:
+        rows, columns = RackSlotIndex.dimensions(rack)
+        if not row or not column or not (1 <= row <= rows and 1 <= column <= columns):
+            return None
+        return (row - 1) * columns + (column - 1)
+
+    @staticmethod
+    def slot_at(rack: PhysicalRack, bit: int) -> Tuple[int, int]:
+        _, columns = RackSlotIndex.dimensions(rack)
+        return bit // columns + 1, bit % columns + 1
+
+    @staticmethod
+    def _store(rack: PhysicalRack, bits: int):
+        rows, columns = RackSlotIndex.dimensions(rack)
+        size = rows * columns
+        rack.slot_bitmap = bits.to_bytes((size + 7) // 8, "little")
+        rack.free_slots = size - bin(bits).count("1")
+
+    @staticmethod
+    def rebuild(db: Session, rack: PhysicalRack) -> int:
+        bits = 0
+        used = db.query(PhysicalBox.rack_row, PhysicalBox.rack_column).filter(
+            PhysicalBox.rack_id == rack.rack_id
+        ).all()
+        for row, column in used:
+            bit = RackSlotIndex.slot_bit(rack, row, column)
+            if bit is not None:
+                bits |= 1 << bit
+        RackSlotIndex._store(rack, bits)
+        return bits
+
+    @staticmethod
+    def occupied(db: Session, rack: PhysicalRack) -> int:
+        if rack.slot_bitmap is None:
+            return RackSlotIndex.rebuild(db, rack)
+        return int.from_bytes(rack.slot_bitmap, "little")
+
+    @staticmethod
+    def free_run(db: Session, rack: PhysicalRack, length: int = 1) -> Optional[Tuple[int, int]]:
+        """First (row, column) starting `length` free slots side by side in one row."""
+        rows, columns = RackSlotIndex.dimensions(rack)
+        free = ((1 << rows * columns) - 1) & ~RackSlotIndex.occupied(db, rack)
+        starts = free
+        for shift in range(1, length):
+            starts &= free >> shift
+        starts &= _run_starts(rows, columns, length)
+        if not starts:
+            return None
+        return RackSlotIndex.slot_at(rack, _lowest_bit(starts))
+
+    @staticmethod
+    def find_slot(
+        db: Session,
+        hospital_id: int,
+        length: int = 1,
+        near_aisle: Optional[int] = None
+    ) -> Optional[Tuple[PhysicalRack, int, int]]:
+        """
+        (rack, row, column) of the first rack with `length` adjacent free slots, racks
+        closest to `near_aisle` first. The chosen rack row stays locked (FOR UPDATE) until
+        the caller commits, so concurrent allocators don't pick the same slot.
+        """
+        db.flush()  # boxes placed earlier in this transaction must already be in the bitmaps
+        query = db.query(PhysicalRack).filter(
+            PhysicalRack.hospital_id == hospital_id,
+            or_(PhysicalRack.free_slots.is_(None), PhysicalRack.free_slots >= length)
+        )
+        if near_aisle is not None:
+            query = query.order_by(func.abs(PhysicalRack.aisle - near_aisle))
+        racks = query.order_by(PhysicalRack.rack_id).all()
+
+        for rack in racks:
+            db.refresh(rack, with_for_update=True)
+            slot = RackSlotIndex.free_run(db, rack, length)
+            if slot:
+                return rack, slot[0], slot[1]
+        return None
+
+    @staticmethod
+    def rebuild_all(db: Session, hospital_id: Optional[int] = None) -> int:
+        query = db.query(PhysicalRack)
+        if hospital_id is not None:
+            query = query.filter(PhysicalRack.hospital_id == hospital_id)
+        racks = query.all()
+        for rack in racks:
+            RackSlotIndex.rebuild(db, rack)
+        db.commit()
+        return len(racks)
+
+
+_SLOT_ATTRS = ("rack_id", "rack_row", "rack_column")
+
+
+def _committed(state, key):
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+
+def _load_previous_slot(target, value, oldvalue, initiator):
+    """Loads the old value of an expired attribute on set, so the flush can free the old slot."""
+
+
+for _attribute in (PhysicalBox.rack_id, PhysicalBox.rack_row, PhysicalBox.rack_column):
+    event.listen(_attribute, "set", _load_previous_slot, active_history=True)
+
+
+@event.listens_for(Session, "before_flush")
+def _sync_rack_slots(session, flush_context, instances):
+    """Set / clear the slot bits of boxes being added, moved or deleted."""
+    changes = []  # (rack_id, row, column, occupied)
+    for obj in session.deleted:
+        if isinstance(obj, PhysicalBox):
+            state = inspect(obj)
+            if state.expired_attributes.intersection(_SLOT_ATTRS):
+                # Expired by an earlier commit: load the slot, or history has nothing to free
+                with session.no_autoflush:
+                    session.refresh(obj, _SLOT_ATTRS)
+            changes.append((_committed(state, "rack_id"), _committed(state, "rack_row"), _committed(state, "rack_column"), False))
+    for obj in session.new:
+        if isinstance(obj, PhysicalBox):
+            changes.append((obj.rack_id, obj.rack_row, obj.rack_column, True))
+    for obj in session.dirty:
+        if isinstance(obj, PhysicalRack):
+            state = inspect(obj)
+            if state.attrs.total_rows.history.has_changes() or state.attrs.total_columns.history.has_changes():
+                obj.slot_bitmap = None  # layout changed: rebuilt on next use
+                obj.free_slots = None
+        elif isinstance(obj, PhysicalBox):
+            state = inspect(obj)
+            if any(state.attrs[key].history.has_changes() for key in _SLOT_ATTRS):
+                changes.append((_committed(state, "rack_id"), _committed(state, "rack_row"), _committed(state, "rack_column"), False))
+                changes.append((obj.rack_id, obj.rack_row, obj.rack_column, True))
+
+    if not changes:
+        return
+    racks = {}
+    with session.no_autoflush:
+        for rack_id, row, column, occupied in changes:
+            if not rack_id:
+                continue
+            if rack_id not in racks:
+                racks[rack_id] = _lock_rack(session, rack_id)
+            rack = racks[rack_id]
+            if rack is None or rack.slot_bitmap is None:
+                continue
+            bit = RackSlotIndex.slot_bit(rack, row, column)
+            if bit is None:
+                continue
+            bits = int.from_bytes(rack.slot_bitmap, "little")
+            bits = bits | (1 << bit) if occupied else bits & ~(1 << bit)
+            RackSlotIndex._store(rack, bits)
+
+
+def _lock_rack(session, rack_id) -> Optional[PhysicalRack]:
+    """
+    The rack row locked (FOR UPDATE) until commit, with its current bitmap. Moves and
+    deletes don't go through find_slot, so without the lock a stale copy could write
+    back a bitmap missing a concurrent allocator's bit.
+    """
+    rack = session.identity_map.get(session.identity_key(PhysicalRack, rack_id))
+    if rack is not None and inspect(rack).modified:
+        # Bitmap already rebuilt / changed in this transaction: lock, keep the pending value
+        session.execute(select(PhysicalRack.rack_id).where(PhysicalRack.rack_id == rack_id).with_for_update())
+        return rack
+    return session.get(PhysicalRack, rack_id, with_for_update=True, populate_existing=True)
+
+
+if __name__ == "__main__":
+    from ..database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(f"✅ Rebuilt slot index for {RackSlotIndex.rebuild_all(db)} racks.")
+    finally:
+        db.close()
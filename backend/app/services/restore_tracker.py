@@ -0,0 +1,212 @@
+"""
+Archive restore tracking and delivery.
+
+`request_restore_from_glacier` starts the S3 restore and records a `PendingRestore` row
+per recipient. The "restore_tracker" scheduler job (every RESTORE_POLL_SECONDS, on one
+worker at a time) then:
+
+1. takes up to RESTORE_POLL_BATCH pending rows that are due and HEADs their objects on
+   RESTORE_POLL_WORKERS threads (one HEAD per object, however many people asked for it);
+2. marks finished restores "ready". Unfinished ones are checked again after an
+   exponential backoff (RESTORE_BACKOFF_MIN_SECONDS doubling up to
+   RESTORE_BACKOFF_MAX_SECONDS), the first check waiting until the tier can have
+   finished. A restore S3 no longer knows about (lost, or the restored copy expired
+   before delivery) is requested again; rows still pending after RESTORE_GIVE_UP_HOURS
+   expire;
+3. emails "ready" rows on RESTORE_DELIVERY_WORKERS threads (each file is fetched and
+   decrypted once), retrying failed sends on later ticks up to RESTORE_DELIVERY_ATTEMPTS.
+
+All state is in the table, so tracking survives restarts and no request thread waits on S3.
+"""
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models import Hospital, Patient, PDFFile, PendingRestore
+from .s3_handler import S3Manager
+
+# Earliest a restore of each tier can be done (S3 Glacier Flexible Retrieval)
+TIER_FIRST_CHECK_SECONDS = {"Expedited": 60, "Standard": 3 * 3600, "Bulk": 5 * 3600}
+ACTIVE_STATUSES = ("pending", "ready")
+
+
+def _backoff(check_count: int) -> datetime.timedelta:
+    seconds = settings.RESTORE_BACKOFF_MIN_SECONDS * 2 ** min(check_count, 16)
+    return datetime.timedelta(seconds=min(seconds, settings.RESTORE_BACKOFF_MAX_SECONDS))
+
+
+def _restored(info: Optional[dict]) -> bool:
+    """The object can be read: restore finished, or it is not archived (anymore)."""
+    if not info:
+        return False
+    return not info.get("IsGlacier") or 'ongoing-request="false"' in (info.get("Restore") or "")
+
+
+class RestoreTracker:
+    @staticmethod
+    def track(
+        db: Session,
+        pdf_file: PDFFile,
+        recipient_email: str,
+        tier: str = "Standard",
+        user_id: Optional[int] = None
+    ) -> PendingRestore:
+        """Record a started restore for delivery to `recipient_email` (the same active request is reused)."""
+        existing = db.query(PendingRestore).filter(
+            PendingRestore.file_id == pdf_file.file_id,
+            PendingRestore.recipient_email == recipient_email,
+            PendingRestore.status.in_(ACTIVE_STATUSES)
+        ).first()
+        if existing:
+            return existing
+        now = datetime.datetime.utcnow()
+        first_check = TIER_FIRST_CHECK_SECONDS.get(tier, TIER_FIRST_CHECK_SECONDS["Standard"])
+        restore = PendingRestore(
+            file_id=pdf_file.file_id, s3_key=pdf_file.s3_key, tier=tier,
+            recipient_email=recipient_email, requested_by=user_id, status="pending",
+            requested_at=now, next_check_at=now + datetime.timedelta(seconds=first_check)
+        )
+        db.add(restore)
+        db.commit()
+        return restore
+
+    @staticmethod
+    def poll(db: Session) -> dict:
+        """One scheduler tick: check due restores, then deliver the ready ones."""
+        now = datetime.datetime.utcnow()
+        result = {"checked": 0, "ready": 0, "expired": 0, "rerequested": 0}
+        due = db.query(PendingRestore).filter(
+            PendingRestore.status == "pending",
+            PendingRestore.next_check_at <= now
+        ).order_by(PendingRestore.next_check_at).limit(settings.RESTORE_POLL_BATCH).all()
+
+        s3_manager = None
+        if due:
+            s3_manager = S3Manager()
+            infos = s3_manager.get_objects_info([r.s3_key for r in due], settings.RESTORE_POLL_WORKERS)
+            give_up = now - datetime.timedelta(hours=settings.RESTORE_GIVE_UP_HOURS)
+            rerequest = {}
+            for restore in due:
+                info = infos.get(restore.s3_key)
+                restore.check_count += 1
+                if _restored(info):
+                    restore.status = "ready"
+                    restore.next_check_at = now
+                    result["ready"] += 1
+                elif restore.requested_at < give_up:
+                    restore.status = "expired"
+                    restore.completed_at = now
+                    restore.last_error = f"Not restored after {settings.RESTORE_GIVE_UP_HOURS}h"
+                    result["expired"] += 1
+                else:
+                    if info is None:
+                        restore.last_error = "Object status unavailable"
+                    elif not info.get("Restore"):
+                        rerequest[restore.s3_key] = restore.tier
+                    restore.next_check_at = now + _backoff(restore.check_count)
+            for key, tier in rerequest.items():
+                ok, msg = s3_manager.initiate_restoration(key, tier=tier)
+                result["rerequested"] += 1 if ok else 0
+                if not ok:
+                    print(f"⚠️ [Restore Tracker] Could not re-request restore of {key}: {msg}")
+            result["checked"] = len(due)
+            db.commit()
+
+        result.update(RestoreTracker._deliver(db, s3_manager))
+        return result
+
+    @staticmethod
+    def _deliver(db: Session, s3_manager: Optional[S3Manager] = None) -> dict:
+        ready = db.query(PendingRestore).filter(
+            PendingRestore.status == "ready"
+        ).order_by(PendingRestore.restore_id).limit(settings.RESTORE_POLL_BATCH).all()
+        if not ready:
+            return {"delivered": 0, "delivery_failed": 0}
+
+        files = {row.file_id: row for row in db.execute(
+            select(
+                PDFFile.file_id, PDFFile.filename, PDFFile.s3_key, PDFFile.hospital_id,
+                Patient.full_name, Patient.patient_u_id, Hospital.legal_name
+            )
+            .join(Patient, Patient.record_id == PDFFile.record_id)
+            .outerjoin(Hospital, Hospital.hospital_id == Patient.hospital_id)
+            .where(PDFFile.file_id.in_({r.file_id for r in ready}))
+        )}
+        # One fetch + decrypt per file, however many recipients
+        jobs: Dict[int, List[tuple]] = {}
+        errors: Dict[int, str] = {}
+        for restore in ready:
+            if restore.file_id in files:
+                jobs.setdefault(restore.file_id, []).append((restore.restore_id, restore.recipient_email))
+            else:
+                errors[restore.restore_id] = "File no longer exists"
+
+        s3_manager = s3_manager or S3Manager()
+
+        def deliver(item) -> List[tuple]:
+            from .email_service import EmailService
+            from .encryption import decrypt_data
+            file_id, recipients = item
+            f = files[file_id]
+            try:
+                content = s3_manager.get_file_bytes(f.s3_key)
+                if not content:
+                    return [(restore_id, "Restored object could not be read") for restore_id, _ in recipients]
+                decrypted = decrypt_data(content)
+            except Exception as e:
+                return [(restore_id, f"Could not prepare file: {e}") for restore_id, _ in recipients]
+            outcome = []
+            for restore_id, email in recipients:
+                sent = EmailService.send_file_retrieval_success_email(
+                    recipient_email=email,
+                    hospital_name=f.legal_name or "",
+                    patient_name=f.full_name,
+                    mrd_number=f.patient_u_id,
+                    filename=f.filename,
+                    file_content=decrypted
+                )
+                outcome.append((restore_id, None if sent else "Email delivery failed"))
+            return outcome
+
+        if jobs:
+            with ThreadPoolExecutor(max_workers=max(1, min(settings.RESTORE_DELIVERY_WORKERS, len(jobs)))) as pool:
+                for outcome in pool.map(deliver, jobs.items()):
+                    for restore_id, error in outcome:
+                        errors[restore_id] = error
+
+        from .storage_tiering import StorageTiering
+        now = datetime.datetime.utcnow()
+        delivered = failed = 0
+        for restore in ready:
+            error = errors.get(restore.restore_id)
+            if error is None:
+                restore.status = "delivered"
+                restore.completed_at = now
+                restore.last_error = None
+                StorageTiering.record_access(restore.file_id, files[restore.file_id].hospital_id, "restore")
+                delivered += 1
+                continue
+            restore.delivery_attempts += 1
+            restore.last_error = error
+            if restore.delivery_attempts >= settings.RESTORE_DELIVERY_ATTEMPTS or restore.file_id not in files:
+                restore.status = "failed"
+                restore.completed_at = now
+                print(f"❌ [Restore Tracker] Giving up delivery of restore {restore.restore_id}: {error}")
+            failed += 1
+        db.commit()
+        return {"delivered": delivered, "delivery_failed": failed}
+
+    @staticmethod
+    def summary(db: Session) -> dict:
+        """Restores by status, and the oldest one still pending."""
+        counts = dict(db.execute(
+            select(PendingRestore.status, func.count(PendingRestore.restore_id)).group_by(PendingRestore.status)
+        ).all())
+        oldest = db.execute(
+            select(func.min(PendingRestore.requested_at)).where(PendingRestore.status.in_(ACTIVE_STATUSES))
+        ).scalar()
+        return {"by_status": counts, "oldest_active_requested_at": oldest}
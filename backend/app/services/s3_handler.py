@@ -1,5 +1,6 @@
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from botocore.exceptions import ClientError
@@ -22,11 +23,12 @@ class S3Manager:
                     's3',
                     aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
                     aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                    region_name=settings.AWS_REGION
+                    region_name=settings.AWS_REGION,
+                    endpoint_url=settings.AWS_S3_ENDPOINT_URL
                 )
             else:
                 # Fallback to default session (e.g., ~/.aws/credentials)
-                self.s3_client = boto3.client('s3', region_name=settings.AWS_REGION)
+                self.s3_client = boto3.client('s3', region_name=settings.AWS_REGION, endpoint_url=settings.AWS_S3_ENDPOINT_URL)
                 self.s3_client.list_buckets()
             
             print(f"[INFO] S3 Manager initialized for bucket: {self.bucket_name} (Region: {settings.AWS_REGION})")
@@ -56,7 +58,7 @@ class S3Manager:
         
         try:
             extra_args = {
-                'StorageClass': 'INTELLIGENT_TIERING'
+                'StorageClass': settings.S3_UPLOAD_STORAGE_CLASS
             }
             if content_type:
                 extra_args['ContentType'] = content_type
@@ -199,6 +201,88 @@ class S3Manager:
         
         return success
 
+    def delete_files(self, object_names, max_workers: int = 4):
+        """
+        Deletes many files: S3 `delete_objects` calls of up to 1000 keys, run on a small
+        thread pool. Returns the object names that could not be deleted (missing objects
+        count as deleted).
+        """
+        keys = {}
+        for name in object_names:
+            key = self._clean_key(name)
+            if key:
+                keys.setdefault(key, []).append(name)
+        failed = set()
+
+        # Local copies (Legacy cleanup or Local mode)
+        for key, names in keys.items():
+            full_path = os.path.join(self.local_root, key)
+            try:
+                if os.path.exists(full_path):
+                    os.remove(full_path)
+            except Exception as e:
+                print(f"[WARN] Local Delete Warning: {e}")
+                if self.mode == "local":
+                    failed.update(names)
+
+        if self.mode != "s3" or not keys:
+            return failed
+
+        def delete_chunk(chunk):
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True}
+                )
+                return [error["Key"] for error in response.get("Errors", [])]
+            except ClientError as e:
+                print(f"[ERROR] S3 Batch Delete Error: {e}")
+                return chunk
+
+        all_keys = list(keys)
+        chunks = [all_keys[i:i + 1000] for i in range(0, len(all_keys), 1000)]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+            for errors in pool.map(delete_chunk, chunks):
+                for key in errors:
+                    failed.update(keys[key])
+        return failed
+
+    def change_storage_classes(self, moves: dict, max_workers: int = 4) -> dict:
+        """
+        Moves objects to another storage class with in-place copies (metadata kept), on a
+        small thread pool. `moves` maps object name -> StorageClass. Returns object name ->
+        S3 error code for the moves that failed (InvalidObjectState: archived, restore first).
+        """
+        if self.mode != "s3":
+            return {name: "LocalMode" for name in moves}
+
+        def change(item):
+            name, storage_class = item
+            key = self._clean_key(name)
+            try:
+                self.s3_client.copy_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    CopySource={"Bucket": self.bucket_name, "Key": key},
+                    StorageClass=storage_class,
+                    MetadataDirective="COPY"
+                )
+                return name, None
+            except ClientError as e:
+                return name, e.response.get("Error", {}).get("Code", "Unknown")
+            except Exception as e:
+                print(f"[ERROR] Storage Class Change Error: {e}")
+                return name, "Unknown"
+
+        failed = {}
+        if not moves:
+            return failed
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(moves)))) as pool:
+            for name, error in pool.map(change, moves.items()):
+                if error:
+                    failed[name] = error
+        return failed
+
     def get_object_info(self, object_name: str):
         """
         Returns StorageClass and Restore status for an object.
@@ -218,6 +302,14 @@ class S3Manager:
             print(f"[ERROR] Head Object Error: {e}")
             return None
 
+    def get_objects_info(self, object_names, max_workers: int = 8) -> dict:
+        """`get_object_info` for many objects on a small thread pool: object name -> info (None on error)."""
+        names = list(dict.fromkeys(object_names))
+        if not names:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(names)))) as pool:
+            return dict(zip(names, pool.map(self.get_object_info, names)))
+
     def initiate_restoration(self, object_name: str, days: int = 1, tier: str = 'Standard'):
         """
         Initiates restoration for a Glacier/Deep Archive object.
@@ -225,6 +317,7 @@ class S3Manager:
         if self.mode != "s3":
             return False, "Not in S3 mode"
             
+        object_name = self._clean_key(object_name)
         try:
             self.s3_client.restore_object(
                 Bucket=self.bucket_name,
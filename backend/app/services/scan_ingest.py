@@ -0,0 +1,471 @@
+"""
+Batch ingestion of handheld barcode / QR scans (/storage/scans).
+
+A scan names a box label or a patient (MRD number, UHID or record id), an action and
+optionally a location:
+
+- AUDIT      record where the item was seen; compared with the database, not applied
+- MOVE       box -> rack slot ("RACK-A1-R2-C3", or a rack label for its first free
+             slot); patient file -> box label
+- CHECK-IN / CHECK-OUT   movement log only
+
+A batch is resolved with a handful of IN queries (labels through a per-worker
+label -> id cache), validated in memory and written in one transaction: movement logs
+as one multi-row insert, moves as ORM updates so rack slot bitmaps and box fill counts
+stay in sync. Each event gets its own result. `reconcile` compares the audited
+locations of a batch with the database.
+"""
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, insert, select
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models import Patient, PhysicalBox, PhysicalMovementLog, PhysicalRack
+from .box_fill import DEFAULT_CAPACITY
+from .bulk_assign import CHUNK_SIZE, BulkAssignService
+from .rack_slots import RackSlotIndex, _lowest_bit
+
+ACTIONS = ("AUDIT", "MOVE", "CHECK-IN", "CHECK-OUT")
+_SLOT_LOCATION = re.compile(r"^(.+?)-R(\d+)-C(\d+)$", re.IGNORECASE)
+
+
+def parse_location(location: Optional[str]) -> Tuple[Optional[str], Optional[int], Optional[int]]:
+    """(rack or box label, row, column) of a scanned location; row/column only for rack slots."""
+    location = (location or "").strip()
+    if not location:
+        return None, None, None
+    match = _SLOT_LOCATION.match(location)
+    if match:
+        return match.group(1), int(match.group(2)), int(match.group(3))
+    return location, None, None
+
+
+def _chunks(values: List, size: int = CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class LabelCache:
+    """
+    Per-worker label -> id maps for boxes and racks (rack labels are only unique per
+    hospital, so racks are keyed by (hospital_id, label)). Entries expire after
+    SCAN_LABEL_CACHE_SECONDS; flushed relabels and deletes evict them, and ids that no
+    longer carry their label are re-resolved by the caller.
+    """
+
+    _lock = threading.Lock()
+    _boxes: Dict[str, Tuple[float, int]] = {}
+    _racks: Dict[Tuple[Optional[int], str], Tuple[float, int]] = {}
+
+    @classmethod
+    def _split(cls, entries: dict, keys: Iterable) -> Tuple[dict, list]:
+        hits, misses = {}, []
+        now = time.monotonic()
+        with cls._lock:
+            for key in keys:
+                entry = entries.get(key)
+                if entry and entry[0] > now:
+                    hits[key] = entry[1]
+                else:
+                    misses.append(key)
+        return hits, misses
+
+    @classmethod
+    def _store(cls, entries: dict, found: dict):
+        if settings.SCAN_LABEL_CACHE_SECONDS <= 0:
+            return
+        expires_at = time.monotonic() + settings.SCAN_LABEL_CACHE_SECONDS
+        with cls._lock:
+            for key, value in found.items():
+                entries[key] = (expires_at, value)
+
+    @classmethod
+    def box_ids(cls, db: Session, labels: Iterable[str]) -> Dict[str, int]:
+        hits, misses = cls._split(cls._boxes, set(labels))
+        found = {}
+        for chunk in _chunks(misses):
+            found.update(db.execute(
+                select(PhysicalBox.label, PhysicalBox.box_id).where(PhysicalBox.label.in_(chunk))
+            ).all())
+        cls._store(cls._boxes, found)
+        return {**hits, **found}
+
+    @classmethod
+    def rack_ids(cls, db: Session, keys: Iterable[Tuple[Optional[int], str]]) -> Dict[tuple, int]:
+        hits, misses = cls._split(cls._racks, set(keys))
+        found = {}
+        for chunk in _chunks(misses):
+            rows = db.execute(
+                select(PhysicalRack.hospital_id, PhysicalRack.label, PhysicalRack.rack_id)
+                .where(PhysicalRack.label.in_({label for _, label in chunk}))
+                .order_by(PhysicalRack.rack_id)
+            ).all()
+            for hospital_id, label, rack_id in rows:
+                found.setdefault((hospital_id, label), rack_id)
+        cls._store(cls._racks, found)
+        return {**hits, **found}
+
+    @classmethod
+    def evict(cls, box_ids: Iterable[int] = (), rack_ids: Iterable[int] = ()):
+        box_ids, rack_ids = set(box_ids), set(rack_ids)
+        with cls._lock:
+            for label in [k for k, (_, v) in cls._boxes.items() if v in box_ids]:
+                del cls._boxes[label]
+            for key in [k for k, (_, v) in cls._racks.items() if v in rack_ids]:
+                del cls._racks[key]
+
+    @classmethod
+    def forget(cls, box_labels: Iterable[str]):
+        with cls._lock:
+            for label in box_labels:
+                cls._boxes.pop(label, None)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._boxes.clear()
+            cls._racks.clear()
+
+
+@event.listens_for(Session, "before_flush")
+def _evict_relabelled(session, flush_context, instances):
+    box_ids, rack_ids = [], []
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, PhysicalBox):
+            state = inspect(obj)
+            if obj in session.deleted or state.attrs.label.history.has_changes():
+                box_ids.append(obj.box_id)
+        elif isinstance(obj, PhysicalRack):
+            state = inspect(obj)
+            if obj in session.deleted or state.attrs.label.history.has_changes() or state.attrs.hospital_id.history.has_changes():
+                rack_ids.append(obj.rack_id)
+    if box_ids or rack_ids:
+        LabelCache.evict(box_ids, rack_ids)
+
+
+class _Batch:
+    """Everything one batch refers to, loaded up front."""
+
+    def __init__(self, db: Session, events: list, hospital_id: Optional[int]):
+        self.db = db
+        self.hospital_id = hospital_id
+        codes = {e.code.strip() for e in events}
+        box_labels = codes | {parse_location(e.location)[0] for e in events if e.location}
+        box_labels.discard(None)
+
+        ids = LabelCache.box_ids(db, box_labels)
+        self.boxes: Dict[str, PhysicalBox] = self._load_boxes(ids)
+        stale = [label for label in ids if label not in self.boxes]
+        if stale:
+            # Cached ids whose box was relabelled or deleted by another worker
+            LabelCache.forget(stale)
+            self.boxes.update(self._load_boxes(LabelCache.box_ids(db, stale)))
+
+        self.patients = BulkAssignService.resolve(db, [c for c in codes if c not in self.boxes], hospital_id)
+        self._patient_rows: Dict[int, Patient] = {}
+        self.racks: Dict[tuple, PhysicalRack] = {}
+        self._slots: Dict[int, int] = {}  # rack_id -> occupied bits, for racks receiving moves
+        self.added: Dict[int, int] = {}  # box_id -> patients moved in by this batch
+
+    def _load_boxes(self, ids: Dict[str, int]) -> Dict[str, PhysicalBox]:
+        boxes = {}
+        for chunk in _chunks(list(set(ids.values()))):
+            for box in self.db.query(PhysicalBox).filter(PhysicalBox.box_id.in_(chunk)):
+                boxes[box.label] = box
+        return {label: boxes[label] for label in ids if label in boxes}
+
+    def load_racks(self, events: list):
+        keys = set()
+        for e in events:
+            box = self.boxes.get(e.code.strip())
+            label = parse_location(e.location)[0]
+            if box is not None and label:
+                keys.update({(box.hospital_id, label), (None, label)})
+        ids = LabelCache.rack_ids(self.db, keys)
+        racks = {}
+        for chunk in _chunks(list(set(ids.values()))):
+            for rack in self.db.query(PhysicalRack).filter(PhysicalRack.rack_id.in_(chunk)):
+                racks[rack.rack_id] = rack
+        for key, rack_id in ids.items():
+            rack = racks.get(rack_id)
+            if rack is not None and (rack.hospital_id, rack.label) == key:
+                self.racks[key] = rack
+
+    def rack_for(self, box: PhysicalBox, label: str) -> Optional[PhysicalRack]:
+        return self.racks.get((box.hospital_id, label)) or self.racks.get((None, label))
+
+    def occupied(self, rack: PhysicalRack) -> int:
+        if rack.rack_id not in self._slots:
+            self.db.refresh(rack, with_for_update=True)  # concurrent movers queue per rack
+            self._slots[rack.rack_id] = RackSlotIndex.occupied(self.db, rack)
+        return self._slots[rack.rack_id]
+
+    def patient_row(self, record_id: int) -> Patient:
+        if record_id not in self._patient_rows:
+            self._patient_rows[record_id] = self.db.get(Patient, record_id)
+        return self._patient_rows[record_id]
+
+    def preload_patients(self, record_ids: List[int]):
+        for chunk in _chunks(record_ids):
+            for patient in self.db.query(Patient).filter(Patient.record_id.in_(chunk)):
+                self._patient_rows[patient.record_id] = patient
+
+
+def _location_code(rack: PhysicalRack, row: int, column: int) -> str:
+    return f"{rack.label}-R{row}-C{column}"
+
+
+class ScanIngestService:
+    @staticmethod
+    def _box_event(batch: _Batch, e, box: PhysicalBox, action: str) -> Tuple[str, str, Optional[str]]:
+        """(log status, outcome, error) for a box scan, applying moves."""
+        rack_label, row, column = parse_location(e.location)
+        if action in ("CHECK-IN", "CHECK-OUT"):
+            return "Success", action.lower(), None
+        if not rack_label:
+            if action == "MOVE":
+                return "Failed", "error", "Location required"
+            return "Success", "seen", None
+
+        rack = batch.rack_for(box, rack_label)
+        if action == "AUDIT":
+            if rack is None:
+                return "Mismatch", "unknown_location", None
+            same = rack.rack_id == box.rack_id and (row is None or (row, column) == (box.rack_row, box.rack_column))
+            return ("Match", "match", None) if same else ("Mismatch", "mismatch", None)
+
+        # MOVE
+        if rack is None:
+            return "Failed", "error", f"Rack '{rack_label}' not found"
+        if rack.hospital_id not in (None, box.hospital_id):
+            return "Failed", "error", "Rack belongs to another hospital"
+        bits = batch.occupied(rack)
+        own_bit = RackSlotIndex.slot_bit(rack, box.rack_row, box.rack_column) if box.rack_id == rack.rack_id else None
+        if own_bit is not None:
+            bits &= ~(1 << own_bit)
+        if row is None:
+            rows, columns = RackSlotIndex.dimensions(rack)
+            free = ((1 << rows * columns) - 1) & ~bits
+            if not free:
+                return "Failed", "error", "Rack is full"
+            row, column = RackSlotIndex.slot_at(rack, _lowest_bit(free))
+        bit = RackSlotIndex.slot_bit(rack, row, column)
+        if bit is None:
+            return "Failed", "error", f"Slot R{row}-C{column} is outside rack {rack.label}"
+        if bits & (1 << bit):
+            return "Failed", "error", f"Slot R{row}-C{column} of {rack.label} is occupied"
+
+        if box.rack_id and box.rack_id in batch._slots:
+            old_rack = batch.db.get(PhysicalRack, box.rack_id)
+            old_bit = RackSlotIndex.slot_bit(old_rack, box.rack_row, box.rack_column)
+            if old_bit is not None:
+                batch._slots[box.rack_id] &= ~(1 << old_bit)
+        batch._slots[rack.rack_id] = batch._slots[rack.rack_id] | (1 << bit)
+        box.rack_id, box.rack_row, box.rack_column = rack.rack_id, row, column
+        box.location_code = _location_code(rack, row, column)
+        return "Success", "moved", None
+
+    @staticmethod
+    def _patient_event(batch: _Batch, e, p: dict, action: str) -> Tuple[str, str, Optional[str]]:
+        box_label = parse_location(e.location)[0]
+        if action in ("CHECK-IN", "CHECK-OUT"):
+            return "Success", action.lower(), None
+        if not box_label:
+            if action == "MOVE":
+                return "Failed", "error", "Target box required"
+            return "Success", "seen", None
+
+        box = batch.boxes.get(box_label)
+        patient = batch.patient_row(p["record_id"])
+        if action == "AUDIT":
+            if box is None:
+                return "Mismatch", "unknown_location", None
+            return ("Match", "match", None) if patient.physical_box_id == box.box_id else ("Mismatch", "mismatch", None)
+
+        # MOVE
+        if box is None:
+            return "Failed", "error", f"Box '{box_label}' not found"
+        if box.hospital_id != patient.hospital_id:
+            return "Failed", "error", "Box belongs to another hospital"
+        if patient.physical_box_id == box.box_id:
+            return "Success", "unchanged", None
+        capacity = box.capacity or DEFAULT_CAPACITY
+        if box.current_count + batch.added.get(box.box_id, 0) >= capacity:
+            return "Failed", "error", f"Box is FULL (capacity: {capacity})"
+        if patient.physical_box_id:
+            batch.added[patient.physical_box_id] = batch.added.get(patient.physical_box_id, 0) - 1
+        batch.added[box.box_id] = batch.added.get(box.box_id, 0) + 1
+        patient.physical_box_id = box.box_id
+        return "Success", "moved", None
+
+    @staticmethod
+    def ingest(
+        db: Session,
+        events: list,
+        user_id: int,
+        hospital_id: Optional[int] = None,
+        batch_id: Optional[str] = None,
+        device_id: Optional[str] = None
+    ) -> List[dict]:
+        """
+        Applies a batch of scan events (objects with code, action, location, scanned_at,
+        device_id) in one transaction. `hospital_id` limits it to one hospital's items.
+        Returns one result per event, in order.
+        """
+        if not events:
+            return []
+        batch = _Batch(db, events, hospital_id)
+        batch.load_racks(events)
+        batch.preload_patients([
+            p["record_id"] for p in batch.patients.values() if p is not None
+        ])
+
+        results, logs = [], []
+        now = datetime.utcnow()
+        for index, e in enumerate(events):
+            code = e.code.strip()
+            action = (e.action or "AUDIT").upper()
+            box = batch.boxes.get(code)
+            p = batch.patients.get(code) if box is None else None
+            if box is not None and hospital_id is not None and box.hospital_id != hospital_id:
+                box = None
+
+            error = None
+            if action not in ACTIONS:
+                status, outcome, error = "Failed", "error", f"Unknown action '{action}'"
+            elif box is not None:
+                status, outcome, error = ScanIngestService._box_event(batch, e, box, action)
+            elif p is not None:
+                status, outcome, error = ScanIngestService._patient_event(batch, e, p, action)
+            else:
+                status, outcome, error = "Not Found", "error", "Unknown label"
+
+            kind = "box" if box is not None else "patient" if p is not None else None
+            if box is not None:
+                action_type, uhid, name = f"BOX-{action}", box.label, None
+            elif p is not None:
+                action_type, uhid, name = ("BOX-ASSIGN" if action == "MOVE" else action), p["uhid"] or p["patient_u_id"], p["full_name"]
+            else:
+                action_type, uhid, name = action, code, None
+            logs.append({
+                "action_type": action_type,
+                "uhid": uhid,
+                "patient_name": name,
+                "destination": e.location,
+                "performed_by_user_id": user_id,
+                "status": status,
+                "timestamp": e.scanned_at or now,
+                "device_id": e.device_id or device_id,
+                "batch_id": batch_id,
+            })
+            result = {"index": index, "code": code, "kind": kind, "outcome": outcome,
+                      "status": "error" if error else "ok"}
+            if error:
+                result["detail"] = error
+            if outcome in ("mismatch", "unknown_location"):
+                if box is not None:
+                    result["expected"] = box.location_code
+                else:
+                    result["expected_box_id"] = batch.patient_row(p["record_id"]).physical_box_id
+            results.append(result)
+
+        for chunk in _chunks(logs):
+            db.execute(insert(PhysicalMovementLog), chunk)
+        db.commit()
+        return results
+
+    @staticmethod
+    def reconcile(db: Session, batch_id: str, hospital_id: Optional[int] = None) -> dict:
+        """
+        Audited vs recorded locations for a batch: matched and misplaced boxes, boxes
+        recorded in an audited rack but not scanned there, unknown labels and files found
+        in the wrong box.
+        """
+        logs = db.execute(
+            select(
+                PhysicalMovementLog.action_type, PhysicalMovementLog.uhid, PhysicalMovementLog.destination,
+                PhysicalMovementLog.status, PhysicalMovementLog.timestamp
+            )
+            .where(PhysicalMovementLog.batch_id == batch_id)
+            .order_by(PhysicalMovementLog.timestamp, PhysicalMovementLog.log_id)
+        ).all()
+
+        seen: Dict[str, Optional[str]] = {}  # box label -> last audited (or moved-to) location
+        unknown, misplaced_files = [], {}
+        for log in logs:
+            if log.action_type == "BOX-AUDIT" or (log.action_type == "BOX-MOVE" and log.status == "Success"):
+                seen[log.uhid] = log.destination
+            elif log.status == "Not Found":
+                unknown.append(log.uhid)
+            elif log.action_type == "AUDIT":
+                if log.status == "Mismatch":
+                    misplaced_files[log.uhid] = log.destination
+                else:
+                    misplaced_files.pop(log.uhid, None)
+
+        boxes = {}
+        for label, box_id in LabelCache.box_ids(db, seen).items():
+            boxes[box_id] = label
+        rows = {}
+        for chunk in _chunks(list(boxes)):
+            for box in db.query(PhysicalBox).filter(PhysicalBox.box_id.in_(chunk)):
+                if box.label in seen and (hospital_id is None or box.hospital_id == hospital_id):
+                    rows[box.label] = box
+
+        rack_keys = set()
+        for label, location in seen.items():
+            rack_label = parse_location(location)[0]
+            if rack_label and label in rows:
+                rack_keys.update({(rows[label].hospital_id, rack_label), (None, rack_label)})
+        rack_ids = LabelCache.rack_ids(db, rack_keys)
+
+        matched, misplaced, audited_racks = [], [], set()
+        for label, location in seen.items():
+            box = rows.get(label)
+            if box is None:
+                continue
+            rack_label, row, column = parse_location(location)
+            rack_id = rack_ids.get((box.hospital_id, rack_label)) or rack_ids.get((None, rack_label))
+            if rack_id:
+                audited_racks.add(rack_id)
+            if rack_id is not None and rack_id == box.rack_id and (row is None or (row, column) == (box.rack_row, box.rack_column)):
+                matched.append(label)
+            else:
+                misplaced.append({"box_label": label, "recorded": box.location_code, "audited": location})
+
+        missing = []
+        if audited_racks:
+            query = db.query(PhysicalBox.label, PhysicalBox.location_code).filter(
+                PhysicalBox.rack_id.in_(audited_racks)
+            )
+            if hospital_id is not None:
+                query = query.filter(PhysicalBox.hospital_id == hospital_id)
+            missing = [
+                {"box_label": label, "recorded": location_code}
+                for label, location_code in query.order_by(PhysicalBox.location_code)
+                if label not in seen
+            ]
+
+        unknown += [label for label in seen if label not in rows]
+        return {
+            "batch_id": batch_id,
+            "summary": {
+                "scans": len(logs),
+                "boxes_audited": len(seen),
+                "matched": len(matched),
+                "misplaced": len(misplaced),
+                "missing": len(missing),
+                "unknown": len(unknown),
+                "misplaced_files": len(misplaced_files),
+            },
+            "matched": matched,
+            "misplaced": misplaced,
+            "missing": missing,
+            "unknown": sorted(set(unknown)),
+            "misplaced_files": [{"uhid": uhid, "audited": location} for uhid, location in misplaced_files.items()],
+        }
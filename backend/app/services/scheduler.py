@@ -0,0 +1,206 @@
+"""
+Periodic jobs shared by all web workers.
+
+Every worker runs the same poll loop, but a job only runs where a worker wins its row in
+`scheduled_jobs` with a conditional UPDATE (due, and no unexpired lease). The winner holds
+the lease for the whole run (renewed while the job is still going), so there is never more
+than one copy in flight; if its worker dies the lease expires and another worker picks the
+job up. Each run records its start/finish/status and schedules the next one with jitter.
+"""
+import asyncio
+import calendar
+import os
+import random
+import socket
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from ..core.config import settings
+from ..database import SessionLocal
+from ..models import ScheduledJob
+
+
+def every(seconds: int) -> Callable[[datetime], datetime]:
+    return lambda now: now + timedelta(seconds=seconds)
+
+
+def monthly(day: int = 1, hour: int = 0) -> Callable[[datetime], datetime]:
+    """Next `day` of a month at `hour`:00 UTC."""
+    def next_run(now: datetime) -> datetime:
+        year, month = now.year, now.month
+        candidate = datetime(year, month, min(day, calendar.monthrange(year, month)[1]), hour)
+        if candidate <= now:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            candidate = datetime(year, month, min(day, calendar.monthrange(year, month)[1]), hour)
+        return candidate
+    return next_run
+
+
+@dataclass
+class PeriodicJob:
+    name: str
+    func: Callable[[], object]  # opens its own session (see services/tasks.py)
+    schedule: Callable[[datetime], datetime]
+    lease_seconds: int = 600
+    jitter_seconds: int = 300
+
+
+class Scheduler:
+    JOBS: Dict[str, PeriodicJob] = {}
+    OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+    @classmethod
+    def register(cls, name: str, func, schedule, lease_seconds: int = 600, jitter_seconds: int = 300):
+        cls.JOBS[name] = PeriodicJob(name, func, schedule, lease_seconds, jitter_seconds)
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.utcnow()
+
+    @classmethod
+    def _ensure_rows(cls, db):
+        """First boot of a new job: due after a random delay so workers don't all see it at once."""
+        known = {name for (name,) in db.query(ScheduledJob.name)}
+        for job in cls.JOBS.values():
+            if job.name in known:
+                continue
+            db.add(ScheduledJob(
+                name=job.name,
+                next_run_at=cls._now() + timedelta(seconds=random.uniform(0, job.jitter_seconds))
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # another worker created it first
+
+    @classmethod
+    def _claim(cls, db, job: PeriodicJob) -> bool:
+        """Atomically take the lease of a due job. Only one worker's UPDATE can match."""
+        now = cls._now()
+        result = db.execute(
+            update(ScheduledJob)
+            .where(
+                ScheduledJob.name == job.name,
+                ScheduledJob.next_run_at <= now,
+                or_(ScheduledJob.lease_until.is_(None), ScheduledJob.lease_until < now)
+            )
+            .values(
+                lease_owner=cls.OWNER,
+                lease_until=now + timedelta(seconds=job.lease_seconds),
+                last_started_at=now
+            )
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    def _renew(cls, db, job: PeriodicJob):
+        db.execute(
+            update(ScheduledJob)
+            .where(and_(ScheduledJob.name == job.name, ScheduledJob.lease_owner == cls.OWNER))
+            .values(lease_until=cls._now() + timedelta(seconds=job.lease_seconds))
+        )
+        db.commit()
+
+    @classmethod
+    def _finish(cls, db, job: PeriodicJob, started: float, error: str = None):
+        now = cls._now()
+        next_run = job.schedule(now) + timedelta(seconds=random.uniform(0, job.jitter_seconds))
+        db.execute(
+            update(ScheduledJob)
+            .where(and_(ScheduledJob.name == job.name, ScheduledJob.lease_owner == cls.OWNER))
+            .values(
+                next_run_at=next_run,
+                lease_owner=None,
+                lease_until=None,
+                last_finished_at=now,
+                last_status="failed" if error else "success",
+                last_error=error,
+                last_duration_ms=int((time.monotonic() - started) * 1000),
+                run_count=ScheduledJob.run_count + 1
+            )
+        )
+        db.commit()
+
+    @classmethod
+    def run_job(cls, job: PeriodicJob):
+        """Run a claimed job in this thread and record the outcome."""
+        started = time.monotonic()
+        print(f"⏰ [Scheduler] {job.name} started on {cls.OWNER}")
+        error = None
+        try:
+            job.func()
+        except Exception as e:
+            error = f"{e}\n{traceback.format_exc()}"[-4000:]
+            print(f"❌ [Scheduler] {job.name} failed: {e}")
+
+        db = SessionLocal()
+        try:
+            cls._finish(db, job, started, error)
+        finally:
+            db.close()
+        if not error:
+            print(f"✅ [Scheduler] {job.name} finished in {time.monotonic() - started:.1f}s")
+
+    @classmethod
+    def claim_due(cls) -> List[PeriodicJob]:
+        db = SessionLocal()
+        try:
+            cls._ensure_rows(db)
+            return [job for job in cls.JOBS.values() if cls._claim(db, job)]
+        finally:
+            db.close()
+
+    @classmethod
+    async def _run_with_lease(cls, job: PeriodicJob):
+        loop = asyncio.get_running_loop()
+        running = loop.run_in_executor(None, cls.run_job, job)
+        while True:
+            done, _ = await asyncio.wait({running}, timeout=job.lease_seconds / 3)
+            if done:
+                return
+            # Still running: keep the lease so no other worker starts a second copy
+            await loop.run_in_executor(None, cls._renew_once, job)
+
+    @classmethod
+    def _renew_once(cls, job: PeriodicJob):
+        db = SessionLocal()
+        try:
+            cls._renew(db, job)
+        except Exception as e:
+            print(f"⚠️ [Scheduler] Could not renew lease for {job.name}: {e}")
+        finally:
+            db.close()
+
+    @classmethod
+    async def loop(cls):
+        """Poll forever (one per worker); due jobs run in the threadpool of whichever worker wins them."""
+        loop = asyncio.get_running_loop()
+        running: Dict[str, asyncio.Task] = {}
+        await asyncio.sleep(random.uniform(0, settings.SCHEDULER_POLL_SECONDS))
+        while True:
+            try:
+                for job in await loop.run_in_executor(None, cls.claim_due):
+                    running[job.name] = asyncio.create_task(cls._run_with_lease(job))
+            except Exception as e:
+                print(f"Scheduler Loop Error: {e}")
+            for name in [n for n, t in running.items() if t.done()]:
+                running.pop(name)
+            await asyncio.sleep(settings.SCHEDULER_POLL_SECONDS * random.uniform(0.8, 1.2))
+
+
+def register_default_jobs():
+    from . import tasks
+
+    Scheduler.register("retention_cleanup", tasks.run_retention_policy, every(86400), lease_seconds=3600, jitter_seconds=1800)
+    Scheduler.register("storage_tiering", tasks.run_storage_tiering, every(86400), lease_seconds=3600, jitter_seconds=1800)
+    Scheduler.register("restore_tracker", tasks.poll_restores, every(settings.RESTORE_POLL_SECONDS), lease_seconds=600, jitter_seconds=10)
+    Scheduler.register("pharma_expiry_alerts", tasks.refresh_expiry_alerts, every(86400), jitter_seconds=1800)
+    Scheduler.register("monthly_bandwidth_reset", tasks.reset_monthly_bandwidth, monthly(day=1))
+    Scheduler.register("close_ledger_month", tasks.close_ledger_month, monthly(day=1, hour=1))
@@ -0,0 +1,240 @@
+"""
+Identifier sequences (box labels, MRD numbers, dental UHID / OPD numbers).
+
+One `SequenceCounter` row per (tenant, namespace, period) holds the last number issued
+in a series, so "next number" is a single-row read and allocating is one atomic
+UPDATE ... RETURNING instead of loading every identifier and parsing it in Python.
+
+- `allocate` reserves a number (or a block) for identifiers the server generates. It
+  runs in its own short transaction, like NumberingService, so two allocators never
+  get the same number and the caller's transaction never holds the counter lock.
+- `peek` previews the next number for forms where staff type or confirm the
+  identifier, without consuming it. Creates that leave the identifier blank
+  allocate it, so concurrent forms showing the same preview never share a number.
+- Identifiers inserted (or renamed) through the ORM advance their series after commit,
+  so typed-in numbers are never suggested again.
+
+A missing counter is seeded once from the existing identifiers (the old full scan),
+so no separate backfill step is needed after deploying.
+"""
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models import DentalPatient, Patient, PhysicalBox, SequenceCounter
+
+_TRAILING_NUMBER = re.compile(r"(\d+)$")
+_LABEL_NUMBER = re.compile(r"^(.*?)(\d+)$")
+_OPD_NUMBER = re.compile(r"^OPD-(\d{4})-(\d+)$")
+
+DENTAL_UHID_START = 10001
+
+
+def _max_suffix(values, prefix: str = "") -> Tuple[int, Optional[str]]:
+    """(largest trailing number, identifier holding it) among `values` starting with `prefix`."""
+    best, best_label = 0, None
+    for value in values:
+        if not value or not value.startswith(prefix):
+            continue
+        match = _TRAILING_NUMBER.search(value[len(prefix):])
+        if match and int(match.group(1)) > best:
+            best, best_label = int(match.group(1)), value
+    return best, best_label
+
+
+def mrd_prefix(last_uid: Optional[str]) -> str:
+    """Prefix of an MRD series (e.g. "MRD-" from "MRD-1042")."""
+    match = _TRAILING_NUMBER.search(last_uid or "")
+    return last_uid[:match.start()] if match else ""
+
+
+def _seed_box_label(db: Session, tenant_id: int, period: str):
+    labels = db.execute(
+        select(PhysicalBox.label).where(
+            PhysicalBox.hospital_id == tenant_id,
+            PhysicalBox.label.like(f"{period}%")
+        )
+    ).scalars()
+    return _max_suffix((label for label in labels if label[len(period):].isdigit()), period)
+
+
+def _seed_mrd(db: Session, tenant_id: int, period: str):
+    return _max_suffix(db.execute(
+        select(Patient.patient_u_id).where(Patient.hospital_id == tenant_id)
+    ).scalars())
+
+
+def _seed_dental_uhid(db: Session, tenant_id: int, period: str):
+    value, label = _max_suffix(db.execute(
+        select(DentalPatient.uhid).where(DentalPatient.hospital_id == tenant_id)
+    ).scalars())
+    return max(value, DENTAL_UHID_START - 1), label
+
+
+def _seed_dental_opd(db: Session, tenant_id: int, period: str):
+    return _max_suffix(db.execute(
+        select(DentalPatient.opd_number).where(
+            DentalPatient.hospital_id == tenant_id,
+            DentalPatient.opd_number.like(f"OPD-{period}-%")
+        )
+    ).scalars(), f"OPD-{period}-")
+
+
+# namespace -> seed(db, tenant_id, period) -> (last value, identifier holding it)
+SEEDERS: Dict[str, Callable] = {
+    "box_label": _seed_box_label,
+    "mrd": _seed_mrd,
+    "dental_uhid": _seed_dental_uhid,
+    "dental_opd": _seed_dental_opd,
+}
+
+
+def _key(namespace: str, tenant_id: int, period: str):
+    t = SequenceCounter.__table__.c
+    return (t.tenant_id == tenant_id, t.namespace == namespace, t.period == period)
+
+
+class SequenceService:
+    @staticmethod
+    def _ensure(session: Session, namespace: str, tenant_id: int, period: str):
+        """Create (and seed) the counter if it does not exist yet."""
+        exists = session.execute(
+            select(SequenceCounter.counter_id).where(*_key(namespace, tenant_id, period))
+        ).scalar()
+        if exists is not None:
+            return
+        last_value, last_label = SEEDERS[namespace](session, tenant_id, period)
+        try:
+            with session.begin_nested():
+                session.add(SequenceCounter(
+                    tenant_id=tenant_id, namespace=namespace, period=period,
+                    last_value=last_value, last_label=last_label
+                ))
+        except IntegrityError:
+            pass  # seeded concurrently by another worker
+
+    @staticmethod
+    def allocate(db: Session, namespace: str, tenant_id: int, period: str = "", count: int = 1) -> List[int]:
+        """Reserve the next `count` numbers of a series (committed immediately)."""
+        if count <= 0:
+            return []
+        counters = SequenceCounter.__table__
+        with Session(bind=db.get_bind()) as alloc:
+            SequenceService._ensure(alloc, namespace, tenant_id, period)
+            last = alloc.execute(
+                update(counters)
+                .where(*_key(namespace, tenant_id, period))
+                .values(last_value=counters.c.last_value + count, updated_at=datetime.utcnow())
+                .returning(counters.c.last_value)
+            ).scalar()
+            alloc.commit()
+        return list(range(last - count + 1, last + 1))
+
+    @staticmethod
+    def allocate_next(db: Session, namespace: str, tenant_id: int, period: str = "") -> int:
+        return SequenceService.allocate(db, namespace, tenant_id, period)[0]
+
+    @staticmethod
+    def allocate_mrd(db: Session, hospital_id: int) -> str:
+        """Reserve the next MRD number, keeping the prefix of the current series."""
+        _, last_uid = SequenceService.peek(db, "mrd", hospital_id)
+        return f"{mrd_prefix(last_uid)}{SequenceService.allocate_next(db, 'mrd', hospital_id)}"
+
+    @staticmethod
+    def peek(db: Session, namespace: str, tenant_id: int, period: str = "") -> Tuple[int, Optional[str]]:
+        """(last issued number, identifier that holds it) without consuming anything."""
+        row = db.execute(
+            select(SequenceCounter.last_value, SequenceCounter.last_label)
+            .where(*_key(namespace, tenant_id, period))
+        ).first()
+        if row is None:
+            with Session(bind=db.get_bind()) as alloc:
+                SequenceService._ensure(alloc, namespace, tenant_id, period)
+                alloc.commit()
+                row = alloc.execute(
+                    select(SequenceCounter.last_value, SequenceCounter.last_label)
+                    .where(*_key(namespace, tenant_id, period))
+                ).first()
+        return row.last_value, row.last_label
+
+    @staticmethod
+    def observe(db: Session, namespace: str, tenant_id: int, period: str, value: int, label: Optional[str] = None):
+        """Advance a series past an identifier issued outside `allocate` (no-op if already past it)."""
+        counters = SequenceCounter.__table__
+        db.execute(
+            update(counters)
+            .where(*_key(namespace, tenant_id, period), counters.c.last_value < value)
+            .values(last_value=value, last_label=label, updated_at=datetime.utcnow())
+        )
+
+
+def issued_identifiers(obj) -> List[tuple]:
+    """(namespace, tenant_id, period, value, label) for each numbered identifier on `obj`."""
+    found = []
+    if isinstance(obj, PhysicalBox):
+        match = _LABEL_NUMBER.match(obj.label or "")
+        if match and obj.hospital_id:
+            found.append(("box_label", obj.hospital_id, match.group(1), int(match.group(2)), obj.label))
+    elif isinstance(obj, Patient):
+        match = _TRAILING_NUMBER.search(obj.patient_u_id or "")
+        if match and obj.hospital_id:
+            found.append(("mrd", obj.hospital_id, "", int(match.group(1)), obj.patient_u_id))
+    elif isinstance(obj, DentalPatient) and obj.hospital_id:
+        match = _TRAILING_NUMBER.search(obj.uhid or "")
+        if match:
+            found.append(("dental_uhid", obj.hospital_id, "", int(match.group(1)), obj.uhid))
+        match = _OPD_NUMBER.match(obj.opd_number or "")
+        if match:
+            found.append(("dental_opd", obj.hospital_id, match.group(1), int(match.group(2)), obj.opd_number))
+    return found
+
+
+_IDENTIFIER_ATTRS = {PhysicalBox: ("label",), Patient: ("patient_u_id",), DentalPatient: ("uhid", "opd_number")}
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_identifiers(session, flush_context, instances):
+    """Remember identifiers inserted or renamed in this transaction."""
+    issued = []
+    for obj in session.new:
+        issued.extend(issued_identifiers(obj))
+    for obj in session.dirty:
+        attrs = _IDENTIFIER_ATTRS.get(type(obj))
+        if attrs and any(inspect(obj).attrs[a].history.has_changes() for a in attrs):
+            issued.extend(issued_identifiers(obj))
+    if issued:
+        session.info.setdefault("issued_identifiers", []).extend(issued)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_identifiers(session, previous_transaction):
+    session.info.pop("issued_identifiers", None)
+
+
+@event.listens_for(Session, "after_commit")
+def _advance_sequences(session):
+    """
+    Advance the series in a separate short transaction once the identifiers are
+    committed, so rolled-back inserts don't burn numbers and the counter row is never
+    locked for the length of the caller's transaction.
+    """
+    issued = session.info.pop("issued_identifiers", None)
+    if not issued:
+        return
+    highest = defaultdict(lambda: (0, None))
+    for namespace, tenant_id, period, value, label in issued:
+        if value > highest[(namespace, tenant_id, period)][0]:
+            highest[(namespace, tenant_id, period)] = (value, label)
+    try:
+        with Session(bind=session.get_bind()) as advance:
+            for (namespace, tenant_id, period), (value, label) in highest.items():
+                SequenceService.observe(advance, namespace, tenant_id, period, value, label)
+            advance.commit()
+    except Exception as e:
+        # The next allocation / unique constraint still guards against duplicates
+        print(f"⚠️ Failed to advance identifier sequences: {e}")
@@ -1,8 +1,12 @@
 from datetime import datetime
+from typing import Optional
 
 from sqlalchemy.orm import Session, joinedload
 
-from ..models import Hospital, Patient, PhysicalBox, PhysicalRack
+from ..models import Hospital, Patient, PhysicalBox
+from .box_fill import BoxFill
+from .rack_slots import RackSlotIndex
+from .sequence_service import SequenceService
 
 
 class StorageService:
@@ -19,55 +23,22 @@ class StorageService:
         month = now.strftime("%m")
         
         prefix = f"{city_code}/{year}/{month}/"
-        pattern = f"{prefix}%"
-        
-        # Find max sequence
-        boxes = db.query(PhysicalBox).filter(
-            PhysicalBox.hospital_id == hospital_id,
-            PhysicalBox.label.like(pattern)
-        ).all()
-        
-        max_seq = 0
-        for b in boxes:
-            try:
-                parts = b.label.split('/')
-                seq = int(parts[-1])
-                if seq > max_seq: max_seq = seq
-            except: pass
-            
-        next_seq = str(max_seq + 1).zfill(4)
-        return f"{prefix}{next_seq}"
+        seq = SequenceService.allocate_next(db, "box_label", hospital_id, prefix)
+        return f"{prefix}{str(seq).zfill(4)}"
 
     @staticmethod
-    def find_open_rack_slot(db: Session, hospital_id: int):
+    def find_open_rack_slot(db: Session, hospital_id: int, near_aisle: Optional[int] = None):
         """
         Finds the first available slot (Row, Col) in any Rack with available space.
         Returns: (rack_id, row, col, location_code) or None
         """
-        racks = db.query(PhysicalRack).filter(PhysicalRack.hospital_id == hospital_id).all()
-        
-        for rack in racks:
-            # Check capacity in memory for simplicity (optimize with SQL for scale)
-            # Find used slots
-            used_slots = db.query(PhysicalBox.rack_row, PhysicalBox.rack_column).filter(
-                PhysicalBox.rack_id == rack.rack_id
-            ).all()
-            used_set = set(used_slots) # {(1,1), (1,2)...}
-            
-            # Iterate Grid
-            rows = rack.total_rows or 5
-            cols = rack.total_columns or 10
-            
-            for r in range(1, rows + 1):
-                for c in range(1, cols + 1):
-                    if (r, c) not in used_set:
-                        # Found empty slot!
-                        # Location Code: Rack-Row-Col (e.g. R01-01-02)
-                        # Padding Row/Col to 2 digits
-                        loc_code = f"{rack.label}-{str(r).zfill(2)}-{str(c).zfill(2)}"
-                        return rack.rack_id, r, c, loc_code
-                        
-        return None
+        found = RackSlotIndex.find_slot(db, hospital_id, near_aisle=near_aisle)
+        if not found:
+            return None
+        rack, r, c = found
+        # Location Code: Rack-Row-Col (e.g. R01-01-02)
+        loc_code = f"{rack.label}-{str(r).zfill(2)}-{str(c).zfill(2)}"
+        return rack.rack_id, r, c, loc_code
 
     @staticmethod
     def auto_assign_patient(db: Session, patient: Patient):
@@ -80,28 +51,15 @@ class StorageService:
         if patient.physical_box_id:
             return # Already assigned
             
-        # 1. Try to find an existing box with space
-        # We need to count patients per box. 
-        # Ideally, we should denormalize 'current_count' on Box, but for now we query.
-        
-        # Get all boxes "In Storage"
-        boxes = db.query(PhysicalBox).filter(
-            PhysicalBox.hospital_id == patient.hospital_id,
-            PhysicalBox.status == 'In Storage'
-        ).all()
-        
-        selected_box = None
-        
-        for box in boxes:
-            count = db.query(Patient).filter(Patient.physical_box_id == box.box_id).count()
-            capacity = box.capacity if box.capacity else 50
-            if count < capacity:
-                selected_box = box
-                break
+        # 1. Try to find an existing box with space (locked until commit)
+        selected_box = BoxFill.pick_box(db, patient.hospital_id)
                 
         # 2. If no box found, Create New
         if not selected_box:
-            # A. Find Rack Slot
+            # A. Generate Label (own short transaction, before the rack row is locked)
+            label = StorageService.get_next_box_label(db, patient.hospital_id)
+
+            # B. Find Rack Slot
             slot = StorageService.find_open_rack_slot(db, patient.hospital_id)
             if not slot:
                 print("No API Racks Available! Creating fallback unassigned box.")
@@ -111,9 +69,6 @@ class StorageService:
             else:
                 rack_id, r, c, loc_code = slot
                 
-            # B. Generate Label
-            label = StorageService.get_next_box_label(db, patient.hospital_id)
-            
             # C. Create Box
             new_box = PhysicalBox(
                 hospital_id=patient.hospital_id,
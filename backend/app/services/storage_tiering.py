@@ -0,0 +1,323 @@
+"""
+Access-driven storage tiering for stored files.
+
+Serving, downloading, OCR and restore deliveries record one access event per read
+(write-behind, batched like audit rows). A daily job then picks each confirmed file's
+storage class from how recently and how often it was read, and from its group
+(hospital x patient category):
+
+- read TIERING_HOT_ACCESSES times within TIERING_WINDOW_DAYS, or within the last
+  TIERING_WARM_DAYS -> STANDARD; idle longer -> STANDARD_IA, then GLACIER_IR, then an
+  archive class after TIERING_ARCHIVE_DAYS;
+- archive classes (GLACIER, DEEP_ARCHIVE) are only used when their retrieval time fits
+  the category's retrieval SLA (CATEGORY_SLA_HOURS, else TIERING_RETRIEVAL_SLA_HOURS),
+  and never for groups whose files keep coming back (more than TIERING_GROUP_HOT_RATIO
+  of them read within the window);
+- INTELLIGENT_TIERING objects already move between the instant tiers on their own, so
+  only archive targets move them; files are not moved colder while under 128 KB or
+  inside their class's minimum storage duration, and are only warmed out of an instant
+  class when they are read often (one read of a cold file is cheaper than two copies).
+
+Transitions are in-place copies with the new StorageClass. Warming an archived object
+starts a Bulk restore; the copy is made by a later run once the restore has finished.
+`StorageTiering.plan` is the dry run: projected monthly storage and retrieval cost,
+one-off transition cost and expected archive retrievals, before and after.
+"""
+import atexit
+import datetime
+import queue
+import threading
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, case, delete, exists, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models import FileAccessEvent, Patient, PDFFile
+from .audit_writer import AuditWriter
+from .bulk_assign import normalize_category
+from .s3_handler import S3Manager
+
+# USD, S3 us-east-1 list prices. transition = PUT / COPY request into the class,
+# retrieval_hours = Standard retrieval, min_days = minimum billed storage duration
+ClassInfo = namedtuple("ClassInfo", "price_gb_month transition_per_1000 retrieval_per_gb retrieval_hours min_days")
+STORAGE_CLASSES: Dict[str, ClassInfo] = {
+    "STANDARD": ClassInfo(0.023, 0.005, 0.0, 0, 0),
+    "INTELLIGENT_TIERING": ClassInfo(0.0125, 0.005, 0.0, 0, 0),  # blended frequent / infrequent tiers
+    "STANDARD_IA": ClassInfo(0.0125, 0.01, 0.01, 0, 30),
+    "GLACIER_IR": ClassInfo(0.004, 0.02, 0.03, 0, 90),
+    "GLACIER": ClassInfo(0.0036, 0.03, 0.01, 5, 90),
+    "DEEP_ARCHIVE": ClassInfo(0.00099, 0.05, 0.02, 12, 180),
+}
+LADDER = ["STANDARD", "STANDARD_IA", "GLACIER_IR", "GLACIER", "DEEP_ARCHIVE"]  # warm -> cold
+_RANK = {**{name: i for i, name in enumerate(LADDER)}, "INTELLIGENT_TIERING": 0.5}
+ARCHIVE_CLASSES = {"GLACIER", "DEEP_ARCHIVE"}
+ARCHIVED_ERRORS = {"InvalidObjectState", "ObjectNotInActiveTierError"}  # copy source needs a restore
+MIN_COLD_BYTES = 128 * 1024  # IA / Glacier IR bill smaller objects as 128 KB
+
+# Retrieval SLA by patient category code (see bulk_assign.normalize_category); other
+# categories use TIERING_RETRIEVAL_SLA_HOURS
+CATEGORY_SLA_HOURS = {
+    normalize_category("MLC"): 0,     # medico-legal copies are demanded by courts / police at short notice
+    normalize_category("BIRTH"): 24,  # certificate reissues can wait a day
+}
+
+EXECUTE_CHUNK = 500
+RESTORE_DAYS = 3  # restored copy only has to outlive the next daily run
+SAMPLE_MOVES = 50
+
+
+class AccessLogWriter(AuditWriter):
+    """Write-behind for file access events (same batching and backpressure as audit rows)."""
+    table = FileAccessEvent.__table__
+    thread_name = "access-writer"
+    _queue: "queue.Queue[dict]" = queue.Queue(maxsize=settings.AUDIT_QUEUE_SIZE)
+    _lock = threading.Lock()
+    _retry: List[dict] = []
+    _attempts = 0
+    _thread: Optional[threading.Thread] = None
+
+
+atexit.register(AccessLogWriter.flush)
+
+
+def _utc(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """Naive UTC (access events are stored naive; file timestamps may be aware)."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def target_class(
+    current: str,
+    size_bytes: Optional[int],
+    hits: int,
+    idle_days: float,
+    days_in_class: float,
+    sla_hours: float,
+    group_hot: bool
+) -> str:
+    """Storage class a file should be in (`current` when it should stay)."""
+    if hits >= settings.TIERING_HOT_ACCESSES or idle_days < settings.TIERING_WARM_DAYS:
+        wanted = "STANDARD"
+    elif idle_days < settings.TIERING_COLD_DAYS:
+        wanted = "STANDARD_IA"
+    elif idle_days < settings.TIERING_ARCHIVE_DAYS or group_hot:
+        wanted = "GLACIER_IR"
+    else:
+        archives = [c for c in ("DEEP_ARCHIVE", "GLACIER") if STORAGE_CLASSES[c].retrieval_hours <= sla_hours]
+        wanted = archives[0] if archives else "GLACIER_IR"
+
+    if wanted == current:
+        return current
+    if current == "INTELLIGENT_TIERING" and wanted not in ARCHIVE_CLASSES:
+        return current
+    if _RANK[wanted] > _RANK[current]:
+        if (size_bytes is not None and size_bytes < MIN_COLD_BYTES) or days_in_class < STORAGE_CLASSES[current].min_days:
+            return current
+    elif current not in ARCHIVE_CLASSES and hits < settings.TIERING_HOT_ACCESSES:
+        return current
+    return wanted
+
+
+def _priority(move: dict):
+    """Hot records stuck in cold storage first, then the biggest savings."""
+    if _RANK[move["to"]] < _RANK[move["from"]]:
+        return (0, -move["reads_in_window"])
+    return (1, -(move["size_bytes"] or 0))
+
+
+class StorageTiering:
+    @staticmethod
+    def record_access(file_id: int, hospital_id: Optional[int], source: str):
+        """Queue one read of a stored file (serve, download, ocr, restore)."""
+        AccessLogWriter.enqueue({
+            "file_id": file_id, "hospital_id": hospital_id, "source": source,
+            "accessed_at": datetime.datetime.utcnow()
+        })
+
+    @staticmethod
+    def _access_stats(db: Session, now: datetime.datetime) -> Dict[int, tuple]:
+        """file_id -> (reads within the window, last read) in one grouped query."""
+        window_start = now - datetime.timedelta(days=settings.TIERING_WINDOW_DAYS)
+        rows = db.execute(
+            select(
+                FileAccessEvent.file_id,
+                func.sum(case((FileAccessEvent.accessed_at >= window_start, 1), else_=0)),
+                func.max(FileAccessEvent.accessed_at)
+            ).group_by(FileAccessEvent.file_id)
+        )
+        return {file_id: (int(hits or 0), _utc(last)) for file_id, hits, last in rows}
+
+    @staticmethod
+    def _files(db: Session, hospital_id: Optional[int] = None):
+        hospital = func.coalesce(PDFFile.hospital_id, Patient.hospital_id)
+        query = (
+            select(
+                PDFFile.file_id, PDFFile.s3_key, hospital.label("hospital_id"), Patient.patient_category,
+                PDFFile.file_size, PDFFile.file_size_mb, PDFFile.storage_class,
+                PDFFile.storage_class_changed_at, PDFFile.confirmed_at, PDFFile.upload_date
+            )
+            .join(Patient, Patient.record_id == PDFFile.record_id)
+            .where(PDFFile.upload_status == "confirmed", PDFFile.s3_key.isnot(None))
+            .order_by(PDFFile.file_id)
+        )
+        if hospital_id is not None:
+            query = query.where(hospital == hospital_id)
+        return db.execute(query).all()
+
+    @staticmethod
+    def _plan(db: Session, hospital_id: Optional[int] = None):
+        now = datetime.datetime.utcnow()
+        stats = StorageTiering._access_stats(db, now)
+        files = StorageTiering._files(db, hospital_id)
+
+        groups: Dict[tuple, dict] = {}
+        for f in files:
+            group = groups.setdefault((f.hospital_id, normalize_category(f.patient_category)), {
+                "hospital_id": f.hospital_id, "category": normalize_category(f.patient_category),
+                "files": 0, "files_read": 0, "reads": 0, "idle_days": []
+            })
+            hits, last = stats.get(f.file_id, (0, None))
+            since = last or _utc(f.confirmed_at) or _utc(f.upload_date) or now
+            group["files"] += 1
+            group["files_read"] += 1 if hits else 0
+            group["reads"] += hits
+            group["idle_days"].append((now - since).total_seconds() / 86400)
+        for group in groups.values():
+            idle = sorted(group.pop("idle_days"))
+            group["median_idle_days"] = round(idle[len(idle) // 2], 1)
+            group["read_ratio"] = round(group["files_read"] / group["files"], 3)
+            group["hot"] = group["read_ratio"] > settings.TIERING_GROUP_HOT_RATIO
+            group["sla_hours"] = CATEGORY_SLA_HOURS.get(normalize_category(group["category"]), settings.TIERING_RETRIEVAL_SLA_HOURS)
+
+        cost = dict.fromkeys((
+            "storage_monthly_now", "storage_monthly_planned", "retrieval_monthly_now",
+            "retrieval_monthly_planned", "transition_one_off"
+        ), 0.0)
+        archive_reads = {"now": 0.0, "planned": 0.0}
+        max_hours = 0
+        moves = []
+        for f in files:
+            group = groups[(f.hospital_id, normalize_category(f.patient_category))]
+            hits, last = stats.get(f.file_id, (0, None))
+            uploaded = _utc(f.confirmed_at) or _utc(f.upload_date) or now
+            idle_days = (now - (last or uploaded)).total_seconds() / 86400
+            days_in_class = (now - (_utc(f.storage_class_changed_at) or uploaded)).total_seconds() / 86400
+            size = f.file_size or (int(f.file_size_mb * 1024 * 1024) if f.file_size_mb else None)
+            current = f.storage_class or settings.S3_UPLOAD_STORAGE_CLASS
+            if current not in STORAGE_CLASSES:
+                continue  # a class this engine does not manage (e.g. REDUCED_REDUNDANCY)
+            target = target_class(current, size, hits, idle_days, days_in_class, group["sla_hours"], group["hot"])
+
+            gb = (size or 0) / 1024 ** 3
+            monthly_reads = hits * 30 / settings.TIERING_WINDOW_DAYS
+            before, after = STORAGE_CLASSES[current], STORAGE_CLASSES[target]
+            cost["storage_monthly_now"] += gb * before.price_gb_month
+            cost["storage_monthly_planned"] += gb * after.price_gb_month
+            cost["retrieval_monthly_now"] += monthly_reads * gb * before.retrieval_per_gb
+            cost["retrieval_monthly_planned"] += monthly_reads * gb * after.retrieval_per_gb
+            archive_reads["now"] += monthly_reads if current in ARCHIVE_CLASSES else 0
+            archive_reads["planned"] += monthly_reads if target in ARCHIVE_CLASSES else 0
+            max_hours = max(max_hours, after.retrieval_hours)
+            if target == current:
+                continue
+
+            cost["transition_one_off"] += after.transition_per_1000 / 1000
+            if current in ARCHIVE_CLASSES:
+                cost["transition_one_off"] += gb * before.retrieval_per_gb  # restore before the copy
+            moves.append({
+                "file_id": f.file_id, "s3_key": f.s3_key, "hospital_id": f.hospital_id,
+                "category": group["category"], "from": current, "to": target,
+                "reads_in_window": hits, "idle_days": round(idle_days, 1), "size_bytes": size
+            })
+
+        moves.sort(key=_priority)
+        by_target: Dict[str, int] = {}
+        for move in moves:
+            by_target[move["to"]] = by_target.get(move["to"], 0) + 1
+        summary = {
+            "generated_at": now,
+            "files": len(files),
+            "transitions": {
+                "total": len(moves),
+                "colder": sum(1 for m in moves if _RANK[m["to"]] > _RANK[m["from"]]),
+                "warmer": sum(1 for m in moves if _RANK[m["to"]] < _RANK[m["from"]]),
+                "by_target": by_target
+            },
+            "cost_usd": {key: round(value, 4) for key, value in cost.items()},
+            "latency": {
+                "archive_reads_monthly_now": round(archive_reads["now"], 2),
+                "archive_reads_monthly_planned": round(archive_reads["planned"], 2),
+                "max_retrieval_hours_planned": max_hours
+            },
+            "groups": sorted(groups.values(), key=lambda g: (g["hospital_id"] or 0, g["category"])),
+        }
+        return summary, moves
+
+    @staticmethod
+    def plan(db: Session, hospital_id: Optional[int] = None) -> dict:
+        """Dry run: what would move, and the projected cost / latency effect."""
+        summary, moves = StorageTiering._plan(db, hospital_id)
+        return {"dry_run": True, **summary, "sample": moves[:SAMPLE_MOVES]}
+
+    @staticmethod
+    def run(db: Session, hospital_id: Optional[int] = None, limit: Optional[int] = None) -> dict:
+        """Plan and execute up to TIERING_MAX_TRANSITIONS_PER_RUN transitions (daily job)."""
+        print(f"🧊 [Storage Tiering] Started at {datetime.datetime.now()}")
+        s3_manager = S3Manager()
+        if s3_manager.mode != "s3":
+            print("⚠️ [Storage Tiering] Storage is in local mode; nothing to transition.")
+            return {"executed": False, "reason": "Storage is in local mode"}
+
+        # Events of deleted files, and events too old to matter
+        history_start = datetime.datetime.utcnow() - datetime.timedelta(days=settings.TIERING_HISTORY_DAYS)
+        pruned = db.execute(delete(FileAccessEvent).where(or_(
+            FileAccessEvent.accessed_at < history_start,
+            ~exists().where(PDFFile.file_id == FileAccessEvent.file_id)
+        ))).rowcount
+        db.commit()
+
+        summary, moves = StorageTiering._plan(db, hospital_id)
+        limit = settings.TIERING_MAX_TRANSITIONS_PER_RUN if limit is None else limit
+        moves = moves[:limit] if limit else moves
+
+        files = PDFFile.__table__
+        set_class = (
+            update(files)
+            .where(files.c.file_id == bindparam("b_file_id"))
+            .values(storage_class=bindparam("b_storage_class"), storage_class_changed_at=func.now())
+        )
+        moved = restoring = failed = 0
+        for start in range(0, len(moves), EXECUTE_CHUNK):
+            chunk = moves[start:start + EXECUTE_CHUNK]
+            errors = s3_manager.change_storage_classes(
+                {m["s3_key"]: m["to"] for m in chunk}, max_workers=settings.TIERING_WORKERS
+            )
+            done = [m for m in chunk if m["s3_key"] not in errors]
+            for m in chunk:
+                error = errors.get(m["s3_key"])
+                if error in ARCHIVED_ERRORS:
+                    # Archived: restore now, copy on a later run
+                    ok, msg = s3_manager.initiate_restoration(m["s3_key"], days=RESTORE_DAYS, tier="Bulk")
+                    restoring += 1 if ok else 0
+                    failed += 0 if ok else 1
+                elif error:
+                    print(f"⚠️ [Storage Tiering] {m['s3_key']} -> {m['to']} failed: {error}")
+                    failed += 1
+            if done:
+                db.execute(set_class, [{"b_file_id": m["file_id"], "b_storage_class": m["to"]} for m in done])
+                db.commit()
+            moved += len(done)
+
+        print(f"✅ [Storage Tiering] Moved {moved} files, {restoring} restoring, {failed} failed.")
+        return {
+            "executed": True,
+            "moved": moved,
+            "restoring": restoring,
+            "failed": failed,
+            "deferred": summary["transitions"]["total"] - len(moves),
+            "events_pruned": pruned,
+            "cost_usd": summary["cost_usd"],
+        }
@@ -56,3 +56,99 @@ def reset_monthly_bandwidth():
         pass
     finally:
         db.close()
+
+
+@celery_app.task
+def close_ledger_month():
+    """
+    Runs on the 1st of every month.
+    Checkpoints every party's ledger balance so statements and the dashboard
+    only sum transactions dated after the latest closed month.
+    """
+    from .ledger_service import LedgerService
+
+    db: Session = SessionLocal()
+    try:
+        return LedgerService.close_period(db)
+    finally:
+        db.close()
+
+
+@celery_app.task
+def run_retention_policy():
+    """
+    Runs daily. Hard-deletes records past their hospital's retention period.
+    """
+    from .cleanup_service import CleanupService
+
+    db: Session = SessionLocal()
+    try:
+        return CleanupService.run_retention_policy(db)
+    finally:
+        db.close()
+
+
+@celery_app.task
+def run_storage_tiering():
+    """
+    Runs daily. Moves files between S3 storage classes by how often they are read.
+    """
+    from .storage_tiering import StorageTiering
+
+    db: Session = SessionLocal()
+    try:
+        return StorageTiering.run(db)
+    finally:
+        db.close()
+
+
+@celery_app.task
+def poll_restores():
+    """
+    Runs every minute. Checks due archive restores and emails the finished ones.
+    """
+    from .restore_tracker import RestoreTracker
+
+    db: Session = SessionLocal()
+    try:
+        return RestoreTracker.poll(db)
+    finally:
+        db.close()
+
+
+@celery_app.task
+def refresh_expiry_alerts(days: int = 90):
+    """
+    Runs daily. Keeps one 'pharma_expiry_alerts' row per in-stock batch expiring within
+    `days`, with current days-to-expiry and quantity.
+    """
+    from datetime import timedelta
+    from ..models import PharmaExpiry, PharmaStock
+
+    db: Session = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        expiring = db.query(PharmaStock).filter(
+            PharmaStock.expiry_date <= now + timedelta(days=days),
+            PharmaStock.quantity_remaining > 0
+        ).all()
+        alerts = {
+            a.stock_id: a for a in db.query(PharmaExpiry).filter(
+                PharmaExpiry.stock_id.in_([s.stock_id for s in expiring])
+            )
+        } if expiring else {}
+
+        created = 0
+        for stock in expiring:
+            alert = alerts.get(stock.stock_id)
+            if alert is None:
+                alert = PharmaExpiry(stock_id=stock.stock_id, medicine_id=stock.medicine_id)
+                db.add(alert)
+                created += 1
+            alert.expiry_date = stock.expiry_date
+            alert.days_to_expiry = (stock.expiry_date - now).days
+            alert.quantity = stock.quantity_remaining
+        db.commit()
+        return {"expiring": len(expiring), "new_alerts": created}
+    finally:
+        db.close()
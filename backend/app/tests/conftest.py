@@ -0,0 +1,56 @@
+"""
+Query budgets: fail a test when code under it runs more SQL statements than allowed.
+
+    def test_patient_list(client, query_budget):
+        with query_budget(6):
+            client.get("/patients/")
+
+    @pytest.mark.query_budget(10)
+    def test_dashboard(client): ...
+
+Counts every statement on an instrumented engine (see core/sql_instrumentation.py),
+from any thread, while the budget is open.
+"""
+from contextlib import contextmanager
+
+import pytest
+
+from app.core.sql_instrumentation import QueryStats, statement_shape
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "query_budget(max_queries): fail if the test runs more SQL statements")
+
+
+def _check(trace, max_queries: int):
+    if trace.queries <= max_queries:
+        return
+    counts = {}
+    for statement, (count, _) in trace.shapes.items():
+        shape = statement_shape(statement)
+        counts[shape] = counts.get(shape, 0) + count
+    worst = "\n".join(
+        f"  {count}x {shape[:160]}" for shape, count in sorted(counts.items(), key=lambda i: -i[1])[:5]
+    )
+    pytest.fail(f"{trace.queries} SQL queries, budget is {max_queries}. Most repeated:\n{worst}", pytrace=False)
+
+
+@pytest.fixture
+def query_budget():
+    @contextmanager
+    def budget(max_queries: int):
+        with QueryStats.capture() as trace:
+            yield trace
+        _check(trace, max_queries)
+    return budget
+
+
+@pytest.fixture(autouse=True)
+def _query_budget_marker(request):
+    marker = request.node.get_closest_marker("query_budget")
+    if marker is None:
+        yield
+        return
+    with QueryStats.capture() as trace:
+        yield
+    _check(trace, marker.args[0])
@@ -0,0 +1,116 @@
+import ast
+import asyncio
+import os
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.loop_monitor import LoopBlockMonitor
+
+# Longest acceptable event-loop stall caused by a single request
+MAX_BLOCK_MS = 50
+
+ROUTERS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "routers")
+
+# Blocking calls that must not run directly inside an `async def` route handler
+BLOCKING_CALLS = {
+    "open", "sleep", "query", "commit", "refresh", "execute",
+    "verify_password", "get_password_hash", "compress_pdf", "process_document",
+    "upload_file", "download_to_temp_cache",
+}
+BLOCKING_OWNERS = {"EmailService", "requests", "subprocess"}
+
+
+def build_app(monitor):
+    app = FastAPI()
+
+    @app.on_event("startup")
+    async def start_monitor():
+        monitor.register_routes(app)
+        monitor.start()
+
+    @app.get("/blocking")
+    async def blocking():
+        time.sleep(0.2)
+        return {}
+
+    @app.get("/offloaded")
+    def offloaded():
+        time.sleep(0.2)
+        return {}
+
+    @app.get("/cooperative")
+    async def cooperative():
+        await asyncio.sleep(0.2)
+        return {}
+
+    return app
+
+
+def test_blocking_endpoint_is_detected_and_attributed():
+    monitor = LoopBlockMonitor(threshold_ms=MAX_BLOCK_MS, interval_ms=10)
+    with TestClient(build_app(monitor)) as client:
+        client.get("/blocking")
+        client.get("/cooperative")  # lets the heartbeat record the stall
+        monitor.stop()
+
+    stats = monitor.by_endpoint.get("GET /blocking")
+    assert stats and stats["max_ms"] >= MAX_BLOCK_MS
+    assert any("blocking" in (b["location"] or "") for b in monitor.blocks)
+
+
+def test_threadpool_and_async_endpoints_do_not_block():
+    monitor = LoopBlockMonitor(threshold_ms=MAX_BLOCK_MS, interval_ms=10)
+    with TestClient(build_app(monitor)) as client:
+        for _ in range(3):
+            client.get("/offloaded")
+            client.get("/cooperative")
+        monitor.stop()
+
+    assert "GET /offloaded" not in monitor.by_endpoint
+    assert "GET /cooperative" not in monitor.by_endpoint
+
+
+def _blocking_calls(func):
+    # Awaited calls are async-native (AsyncSession.execute, UploadFile.read, ...)
+    awaited = {id(node.value) for node in ast.walk(func) if isinstance(node, ast.Await)}
+    for node in ast.walk(func):
+        if not isinstance(node, ast.Call) or id(node) in awaited:
+            continue
+        target = node.func
+        if isinstance(target, ast.Name) and target.id in BLOCKING_CALLS:
+            yield target.id
+        elif isinstance(target, ast.Attribute):
+            owner = target.value.id if isinstance(target.value, ast.Name) else None
+            if target.attr in BLOCKING_CALLS or owner in BLOCKING_OWNERS:
+                yield f"{owner or '...'}.{target.attr}"
+
+
+def test_async_route_handlers_do_not_do_sync_io():
+    """Sync DB/file/SMTP work belongs in `def` handlers (run in the threadpool)."""
+    offenders = []
+    for name in sorted(os.listdir(ROUTERS_DIR)):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(ROUTERS_DIR, name), encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        for func in ast.walk(tree):
+            if not isinstance(func, ast.AsyncFunctionDef):
+                continue
+            is_route = any(
+                isinstance(d, ast.Call) and isinstance(d.func, ast.Attribute)
+                and isinstance(d.func.value, ast.Name) and d.func.value.id == "router"
+                for d in func.decorator_list
+            )
+            if not is_route:
+                continue
+            takes_session = any(
+                isinstance(a.annotation, ast.Name) and a.annotation.id == "Session"  # sync Session
+                for a in func.args.args
+            )
+            calls = sorted(set(_blocking_calls(func)))
+            if takes_session or calls:
+                offenders.append(f"{name}:{func.lineno} {func.name} {calls or 'db: Session'}")
+
+    assert not offenders, "async route handlers doing blocking I/O:\n" + "\n".join(offenders)
@@ -0,0 +1,40 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import Hospital, Patient
+from app.services.sequence_service import SequenceService
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    hospital = Hospital(legal_name="H", email="h@example.com")
+    session.add(hospital)
+    session.flush()
+    session.add(Patient(hospital_id=hospital.hospital_id, patient_u_id="MRD-7", full_name="Existing"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_blank_mrds_created_at_once_get_different_numbers(db):
+    hospital_id = db.query(Hospital).one().hospital_id
+    last, _ = SequenceService.peek(db, "mrd", hospital_id)
+    assert last == 7  # both forms preview MRD-8
+
+    # Both creates leave the MRD blank, so each allocates its own
+    first = SequenceService.allocate_mrd(db, hospital_id)
+    second = SequenceService.allocate_mrd(db, hospital_id)
+    assert (first, second) == ("MRD-8", "MRD-9")
+
+
+def test_typed_in_mrd_is_not_allocated_again(db):
+    hospital_id = db.query(Hospital).one().hospital_id
+    db.add(Patient(hospital_id=hospital_id, patient_u_id="MRD-20", full_name="Typed"))
+    db.commit()
+    assert SequenceService.allocate_mrd(db, hospital_id) == "MRD-21"
@@ -0,0 +1,25 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import SystemSetting
+from app.services.principal_cache import MaintenanceFlag
+
+
+def test_saved_setting_is_published_to_other_workers(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    published = []
+    monkeypatch.setattr(MaintenanceFlag, "publish", classmethod(lambda cls: published.append(cls._version) or True))
+    monkeypatch.setattr(MaintenanceFlag, "_listen", classmethod(lambda cls: None))
+
+    with Session(bind=engine) as db:
+        assert MaintenanceFlag.is_enabled(db) is False  # cached for the TTL
+        db.add(SystemSetting(key="maintenance_mode", value="true"))
+        db.flush()
+        assert published == []  # nothing announced before the commit
+        db.commit()
+
+        assert len(published) == 1
+        assert MaintenanceFlag.is_enabled(db) is True
@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import AccountingConfig, AccountingTransaction
+from app.services.numbering_service import NumberingService
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    session.add(AccountingConfig(current_fy="2025-26"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_same_transaction_number_rolls_back_with_the_insert(db):
+    first = NumberingService.next_numbers(db, "receipt", same_transaction=True)[0]
+    db.add(AccountingTransaction(party_type="HOSPITAL", party_id=1, voucher_type="RECEIPT",
+                                 voucher_number=first, debit=0.0, credit=10.0))
+    db.rollback()  # the insert failed
+
+    # The number was never consumed, so the next receipt reuses it
+    assert NumberingService.next_numbers(db, "receipt", same_transaction=True)[0] == first
+    db.commit()
+    assert NumberingService.next_numbers(db, "receipt", same_transaction=True)[0] != first
+
+
+def test_separate_transaction_numbers_stay_reserved(db):
+    first = NumberingService.allocate(db, "expense")[0]
+    db.rollback()
+    assert NumberingService.allocate(db, "expense")[0] == first + 1
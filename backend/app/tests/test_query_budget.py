@@ -0,0 +1,87 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, relationship, selectinload, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.sql_instrumentation import QueryStats
+from app.middleware.pipeline import MiddlewarePipeline
+from app.middleware.query_stats import QueryStatsHook
+
+Base = declarative_base()
+
+
+class Box(Base):
+    __tablename__ = "boxes"
+    box_id = Column(Integer, primary_key=True)
+    patients = relationship("Patient", back_populates="box")
+
+
+class Patient(Base):
+    __tablename__ = "patients"
+    record_id = Column(Integer, primary_key=True)
+    name = Column(String)
+    box_id = Column(Integer, ForeignKey("boxes.box_id"))
+    box = relationship("Box", back_populates="patients")
+
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+QueryStats.instrument(engine)
+Base.metadata.create_all(engine)
+SessionLocal = sessionmaker(bind=engine)
+
+with SessionLocal() as db:
+    for box_id in range(1, 11):
+        db.add(Box(box_id=box_id, patients=[Patient(name=f"P{box_id}-{i}") for i in range(3)]))
+    db.commit()
+
+
+app = FastAPI()
+app.add_middleware(MiddlewarePipeline, hooks=[QueryStatsHook()])
+
+
+@app.get("/boxes/lazy")
+def boxes_lazy():
+    with SessionLocal() as db:
+        return [{"box_id": b.box_id, "patients": len(b.patients)} for b in db.query(Box).all()]
+
+
+@app.get("/boxes/eager")
+def boxes_eager():
+    with SessionLocal() as db:
+        boxes = db.query(Box).options(selectinload(Box.patients)).all()
+        return [{"box_id": b.box_id, "patients": len(b.patients)} for b in boxes]
+
+
+@pytest.fixture
+def client():
+    QueryStats.reset()
+    with TestClient(app) as client:
+        yield client
+
+
+def test_lazy_loop_is_flagged_as_n_plus_one(client):
+    response = client.get("/boxes/lazy")
+    assert response.status_code == 200
+    assert '"11 queries"' in response.headers["server-timing"]
+
+    client.get("/boxes/eager")
+    flagged = {r["route"]: r for r in QueryStats.summary()["n_plus_one"]}
+    assert "GET /boxes/eager" not in flagged
+    offender = flagged["GET /boxes/lazy"]["n_plus_one"][0]
+    assert offender["max_repeats"] == 10 and "FROM patients" in offender["statement"]
+
+
+def test_query_budget_fixture(client, query_budget):
+    with query_budget(2):
+        client.get("/boxes/eager")
+
+    with pytest.raises(pytest.fail.Exception, match="11 SQL queries, budget is 2"):
+        with query_budget(2):
+            client.get("/boxes/lazy")
+
+
+@pytest.mark.query_budget(2)
+def test_query_budget_marker(client):
+    client.get("/boxes/eager")
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import Hospital, Patient, PhysicalBox, PhysicalRack
+from app.services import box_fill, rack_slots  # noqa: F401  (flush listeners)
+from app.services.rack_slots import RackSlotIndex
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    hospital = Hospital(legal_name="H", email="h@example.com")
+    session.add(hospital)
+    session.flush()
+    rack = PhysicalRack(hospital_id=hospital.hospital_id, label="R1", total_rows=1, total_columns=3)
+    session.add(rack)
+    session.flush()
+    RackSlotIndex.rebuild(session, rack)
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_deleting_a_box_after_commit_frees_its_slot(db):
+    rack = db.query(PhysicalRack).one()
+    box = PhysicalBox(hospital_id=rack.hospital_id, label="B1", rack_id=rack.rack_id, rack_row=1, rack_column=2)
+    db.add(box)
+    db.commit()
+    db.refresh(rack)
+    assert rack.free_slots == 2
+
+    # As in storage.delete_box: an earlier commit expires the box before it is deleted
+    db.commit()
+    db.delete(box)
+    db.commit()
+
+    db.refresh(rack)
+    assert rack.free_slots == 3
+    assert int.from_bytes(rack.slot_bitmap, "little") == 0
+
+
+def test_deleting_a_patient_after_commit_updates_box_fill(db):
+    rack = db.query(PhysicalRack).one()
+    box = PhysicalBox(hospital_id=rack.hospital_id, label="B1", rack_id=rack.rack_id, rack_row=1, rack_column=1)
+    db.add(box)
+    db.flush()
+    patient = Patient(hospital_id=rack.hospital_id, patient_u_id="M1", full_name="P", physical_box_id=box.box_id)
+    db.add(patient)
+    db.commit()
+    db.refresh(box)
+    assert box.current_count == 1
+
+    db.delete(patient)
+    db.commit()
+    db.refresh(box)
+    assert box.current_count == 0
+
+
+def test_moving_a_box_keeps_a_concurrent_allocation(tmp_path):
+    # Two connections, so each session has its own view of the rack row
+    engine = create_engine(f"sqlite:///{tmp_path / 'racks.db'}")
+    Base.metadata.create_all(engine)
+    with Session(bind=engine) as setup:
+        hospital = Hospital(legal_name="H", email="h@example.com")
+        setup.add(hospital)
+        setup.flush()
+        rack = PhysicalRack(hospital_id=hospital.hospital_id, label="R1", total_rows=1, total_columns=3)
+        setup.add(rack)
+        setup.flush()
+        RackSlotIndex.rebuild(setup, rack)
+        setup.add(PhysicalBox(hospital_id=hospital.hospital_id, label="B1", rack_id=rack.rack_id, rack_row=1, rack_column=1))
+        setup.commit()
+        rack_id = rack.rack_id
+
+    mover, allocator = Session(bind=engine), Session(bind=engine)
+    box = mover.query(PhysicalBox).one()
+    stale = mover.get(PhysicalRack, rack_id)  # held, so it stays in the mover's identity map
+    assert stale.free_slots == 2
+
+    allocator.add(PhysicalBox(hospital_id=box.hospital_id, label="B2", rack_id=rack_id, rack_row=1, rack_column=2))
+    allocator.commit()
+
+    # As in storage.update_box: the move must not write back the bitmap it read before B2
+    box.rack_column = 3
+    mover.commit()
+
+    rack = allocator.get(PhysicalRack, rack_id, populate_existing=True)
+    assert int.from_bytes(rack.slot_bitmap, "little") == 0b110
+    assert rack.free_slots == 1
+    mover.close()
+    allocator.close()
@@ -0,0 +1,128 @@
+import datetime
+import io
+
+import pytest
+
+from app.core.config import settings
+from app.services.storage_tiering import target_class
+
+
+def test_idle_files_get_colder():
+    assert target_class("STANDARD", 5_000_000, 0, idle_days=60, days_in_class=60, sla_hours=6, group_hot=False) == "STANDARD_IA"
+    assert target_class("STANDARD_IA", 5_000_000, 0, idle_days=200, days_in_class=140, sla_hours=6, group_hot=False) == "GLACIER_IR"
+    assert target_class("GLACIER_IR", 5_000_000, 0, idle_days=800, days_in_class=400, sla_hours=6, group_hot=False) == "GLACIER"
+    assert target_class("GLACIER_IR", 5_000_000, 0, idle_days=800, days_in_class=400, sla_hours=24, group_hot=False) == "DEEP_ARCHIVE"
+
+
+def test_archive_respects_sla_and_hot_groups():
+    # Instant-retrieval SLA (MLC) and groups whose files keep being read never leave instant classes
+    assert target_class("GLACIER_IR", 5_000_000, 0, idle_days=800, days_in_class=400, sla_hours=0, group_hot=False) == "GLACIER_IR"
+    assert target_class("GLACIER_IR", 5_000_000, 0, idle_days=800, days_in_class=400, sla_hours=24, group_hot=True) == "GLACIER_IR"
+
+
+def test_transitions_avoid_churn():
+    # Small objects and objects inside their minimum storage duration stay put
+    assert target_class("STANDARD", 50_000, 0, idle_days=60, days_in_class=60, sla_hours=6, group_hot=False) == "STANDARD"
+    assert target_class("STANDARD_IA", 5_000_000, 0, idle_days=120, days_in_class=10, sla_hours=6, group_hot=False) == "STANDARD_IA"
+    # Intelligent-Tiering handles the instant tiers itself
+    assert target_class("INTELLIGENT_TIERING", 5_000_000, 0, idle_days=200, days_in_class=200, sla_hours=6, group_hot=False) == "INTELLIGENT_TIERING"
+    # One read of a cold instant-class file is not worth a copy; frequent reads are
+    assert target_class("GLACIER_IR", 5_000_000, 1, idle_days=1, days_in_class=200, sla_hours=6, group_hot=False) == "GLACIER_IR"
+    assert target_class("GLACIER_IR", 5_000_000, 5, idle_days=1, days_in_class=200, sla_hours=6, group_hot=False) == "STANDARD"
+    # Archived files are warmed as soon as they are read again
+    assert target_class("GLACIER", 5_000_000, 1, idle_days=1, days_in_class=200, sla_hours=6, group_hot=False) == "STANDARD"
+
+
+def test_change_storage_classes_against_moto(monkeypatch, tmp_path):
+    moto = pytest.importorskip("moto")
+    from app.services.s3_handler import S3Manager
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setattr(settings, "AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(settings, "AWS_BUCKET_NAME", "tiering-test")
+    with moto.mock_aws():
+        s3 = S3Manager()
+        s3.s3_client.create_bucket(Bucket="tiering-test")
+        for key in ("a.pdf", "b.pdf"):
+            s3.upload_file(io.BytesIO(b"%PDF"), key)
+
+        assert s3.change_storage_classes({"a.pdf": "GLACIER_IR", "b.pdf": "DEEP_ARCHIVE"}) == {}
+        assert s3.get_object_info("a.pdf")["StorageClass"] == "GLACIER_IR"
+        assert s3.get_object_info("b.pdf")["IsGlacier"]
+
+        # Archived objects have to be restored before they can be copied warmer
+        failed = s3.change_storage_classes({"b.pdf": "STANDARD"})
+        assert failed["b.pdf"] in ("InvalidObjectState", "ObjectNotInActiveTierError")
+
+
+@pytest.fixture
+def tiering_db():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from sqlalchemy.pool import StaticPool
+
+    from app.database import Base
+    from app.models import FileAccessEvent, Hospital, Patient, PDFFile
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = Session(bind=engine)
+    now = datetime.datetime.utcnow()
+    hospital = Hospital(legal_name="H", email="h@example.com")
+    db.add(hospital)
+    db.flush()
+    files = {}
+    for category in ("MCL", "STANDARD"):
+        patient = Patient(hospital_id=hospital.hospital_id, patient_u_id=category, full_name=category, patient_category=category)
+        db.add(patient)
+        db.flush()
+        f = PDFFile(
+            record_id=patient.record_id, hospital_id=hospital.hospital_id, filename=f"{category}.pdf",
+            file_path=f"{category}.pdf", s3_key=f"{category}.pdf", upload_status="confirmed",
+            file_size=5_000_000, storage_class="GLACIER_IR", confirmed_at=now - datetime.timedelta(days=900),
+            storage_class_changed_at=now - datetime.timedelta(days=400)
+        )
+        db.add(f)
+        db.flush()
+        # Read once long ago: history, but outside the access window
+        db.add(FileAccessEvent(file_id=f.file_id, hospital_id=hospital.hospital_id, source="serve",
+                               accessed_at=now - datetime.timedelta(days=500)))
+        files[category] = f.file_id
+    db.commit()
+    yield db, files
+    db.close()
+
+
+def test_plan_keeps_medico_legal_files_instant(tiering_db):
+    from app.services.storage_tiering import StorageTiering
+
+    db, files = tiering_db
+    summary, moves = StorageTiering._plan(db)
+    targets = {m["file_id"]: m["to"] for m in moves}
+    assert targets.get(files["STANDARD"]) == "GLACIER"
+    assert files["MCL"] not in targets  # stays in GLACIER_IR
+    mcl = next(g for g in summary["groups"] if g["category"] == "MCL")
+    assert mcl["sla_hours"] == 0
+
+
+def test_run_keeps_medico_legal_files_instant(tiering_db, monkeypatch, tmp_path):
+    moto = pytest.importorskip("moto")
+    from app.services.s3_handler import S3Manager
+    from app.services.storage_tiering import StorageTiering
+
+    db, files = tiering_db
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setattr(settings, "AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(settings, "AWS_BUCKET_NAME", "tiering-test")
+    with moto.mock_aws():
+        s3 = S3Manager()
+        s3.s3_client.create_bucket(Bucket="tiering-test")
+        for key in ("MCL.pdf", "STANDARD.pdf"):
+            s3.s3_client.put_object(Bucket="tiering-test", Key=key, Body=b"%PDF", StorageClass="GLACIER_IR")
+
+        result = StorageTiering.run(db)
+        assert result["moved"] == 1
+        assert s3.get_object_info("MCL.pdf")["StorageClass"] == "GLACIER_IR"
+        assert s3.get_object_info("STANDARD.pdf")["StorageClass"] == "GLACIER"
@@ -1,11 +1,14 @@
 
 import multiprocessing
+import os
 
 # Binding
 bind = "0.0.0.0:8001"
 
 # Worker Options
-workers = multiprocessing.cpu_count() * 2 + 1
+# The single source of the worker count: exported to the workers as WEB_CONCURRENCY (below),
+# which sizes each worker's DB pool and rate limit share (see app/database.py, middleware/security.py)
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count() * 2 + 1)
 worker_class = "uvicorn.workers.UvicornWorker"
 timeout = 120
 keepalive = 5
@@ -16,7 +19,8 @@ accesslog = "-"  # stdout
 errorlog = "-"   # stderr
 
 # Environment
+# ENVIRONMENT comes from the compose / env files, so the dev stack is not run as production
 raw_env = [
-    "ENVIRONMENT=production",
+    f"WEB_CONCURRENCY={workers}", # Per-worker DB pool and rate limit share
     # "SECRET_KEY=SetThisInEnvironmentVar",
 ]
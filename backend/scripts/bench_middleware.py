@@ -0,0 +1,96 @@
+"""
+Before/after benchmark for the request middleware.
+
+"before" runs the same hooks as one BaseHTTPMiddleware layer each (the previous layout:
+latency, security headers, rate limit, bandwidth); "after" runs them through the single
+pure-ASGI MiddlewarePipeline. Requests go in-process through httpx's ASGI transport, so
+the numbers isolate middleware overhead.
+
+Usage: python scripts/bench_middleware.py [requests]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import MutableHeaders
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware.pipeline import LatencyHook, MiddlewarePipeline, RequestContext
+from app.middleware.security import RateLimitHook, SecurityHeadersHook
+
+
+def build_app():
+    app = FastAPI()
+    app.state.total_requests = 0
+    app.state.total_latency = 0.0
+
+    @app.get("/ping")
+    def ping():
+        return {"ok": True}
+
+    @app.get("/download")
+    def download():
+        return StreamingResponse(iter([b"x" * 65536] * 16))
+
+    return app
+
+
+def hooks_for(app):
+    # Generous limits so the benchmark measures plumbing, not 429s
+    return [
+        RateLimitHook(requests_per_minute=10**9, auth_requests_per_minute=10**9, backend="local"),
+        SecurityHeadersHook(),
+        LatencyHook(app.state),
+    ]
+
+
+def layered(app):
+    """Previous layout: one BaseHTTPMiddleware per concern."""
+    for hook in reversed(hooks_for(app)):
+        class Layer(BaseHTTPMiddleware):
+            async def dispatch(self, request, call_next, hook=hook):
+                ctx = RequestContext(request.scope)
+                early = await hook.on_request(ctx)
+                response = early or await call_next(request)
+                hook.on_response_start(ctx, MutableHeaders(raw=response.raw_headers))
+                await hook.on_complete(ctx)
+                return response
+        app.add_middleware(Layer)
+    return app
+
+
+def pipelined(app):
+    app.add_middleware(MiddlewarePipeline, hooks=hooks_for(app))
+    return app
+
+
+async def run(app, path, n):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(50):
+            await client.get(path)
+        start = time.perf_counter()
+        for _ in range(n):
+            response = await client.get(path)
+            response.raise_for_status()
+        return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'endpoint':<10} {'before (us/req)':>16} {'after (us/req)':>16} {'speedup':>8}")
+    for path in ("/ping", "/download"):
+        before = asyncio.run(run(layered(build_app()), path, n))
+        after = asyncio.run(run(pipelined(build_app()), path, n))
+        print(f"{path:<10} {before:>16.1f} {after:>16.1f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Worker boot benchmark: time from a fresh interpreter to `app.main` imported (tables
+checked, routers registered), i.e. what each gunicorn worker pays before serving.
+
+Usage: python scripts/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def boot_once() -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import app.main"],
+        cwd=BACKEND_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    boot_once()  # warm the filesystem cache / .pyc files
+    times = [boot_once() for _ in range(runs)]
+    print(f"app.main boot over {runs} runs: "
+          f"median {statistics.median(times):.2f}s, min {min(times):.2f}s, max {max(times):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
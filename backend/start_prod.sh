@@ -1,8 +1,11 @@
 #!/bin/sh
 set -e
 
-# Run migrations (if any)
-# python app/main.py migrate  <-- if you had a migration command
+# Run migrations once, before any worker boots (workers only check the schema version).
+# A failed migration exits non-zero, so set -e stops here instead of booting on a stale schema
+python -m app.migrations
 
-# Start Gunicorn with Uvicorn workers
-exec gunicorn app.main:app -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000
+# Start Gunicorn with Uvicorn workers. The worker count is set only here (WEB_CONCURRENCY);
+# gunicorn_conf.py passes it on so each worker takes its share of the DB connection budget
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-4}"
+exec gunicorn app.main:app -c gunicorn_conf.py -b 0.0.0.0:8000
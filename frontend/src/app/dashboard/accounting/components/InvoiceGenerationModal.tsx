@@ -43,6 +43,9 @@ interface CustomItem {
     hsn_code: string;
 }
 
+// Unbilled files are loaded a page at a time (GET /accounting/unbilled is paginated)
+const UNBILLED_PAGE_SIZE = 200;
+
 interface InvoiceGenerationModalProps {
     isOpen: boolean;
     onClose: () => void;
@@ -55,6 +58,10 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
     const [selectedHospital, setSelectedHospital] = useState<Hospital | null>(null);
     const [unbilledFiles, setUnbilledFiles] = useState<UnbilledFile[]>([]);
     const [selectedFileIds, setSelectedFileIds] = useState<number[]>([]);
+    const [allSelected, setAllSelected] = useState(false); // Every unbilled file, loaded or not (billed server-side)
+    const [unbilledTotal, setUnbilledTotal] = useState(0);
+    const [unbilledTotalAmount, setUnbilledTotalAmount] = useState(0);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [loading, setLoading] = useState(false);
     const [searchHospital, setSearchHospital] = useState('');
     const [billDate, setBillDate] = useState<string>(format(new Date(), 'yyyy-MM-dd'));
@@ -123,9 +130,13 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
     const fetchUnbilledFiles = async (hospitalId: number) => {
         setLoading(true);
         try {
-            const data = await apiFetch(`/accounting/unbilled/${hospitalId}`);
-            setUnbilledFiles(data);
+            // First page only; totals for the whole backlog come with it
+            const data = await apiFetch(`/accounting/unbilled/${hospitalId}?skip=0&limit=${UNBILLED_PAGE_SIZE}`);
+            setUnbilledFiles(data.items);
+            setUnbilledTotal(data.total);
+            setUnbilledTotalAmount(data.total_amount);
             setSelectedFileIds([]); // Default uncheck all
+            setAllSelected(false);
         } catch (error) {
             console.error("Error fetching unbilled files:", error);
         } finally {
@@ -133,23 +144,54 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
         }
     };
 
+    const loadMoreFiles = async () => {
+        if (!selectedHospital) return;
+        setLoadingMore(true);
+        try {
+            // Totals came with the first page; skip the summary aggregate here
+            const data = await apiFetch(`/accounting/unbilled/${selectedHospital.hospital_id}?skip=${unbilledFiles.length}&limit=${UNBILLED_PAGE_SIZE}&include_totals=false`);
+            setUnbilledFiles(prev => prev.concat(data.items));
+            if (data.items.length < UNBILLED_PAGE_SIZE) {
+                // Files billed since the first page: nothing further to load
+                setUnbilledTotal(unbilledFiles.length + data.items.length);
+            }
+        } catch (error) {
+            console.error("Error fetching unbilled files:", error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const handleSelectHospital = (hospital: Hospital) => {
         setSelectedHospital(hospital);
         fetchUnbilledFiles(hospital.hospital_id);
         setStep(2);
     };
 
+    const isFileSelected = (id: number) => allSelected || selectedFileIds.includes(id);
+
     const toggleFileSelection = (id: number) => {
+        if (allSelected) {
+            // Leaving select-all: keep the loaded files except this one
+            setAllSelected(false);
+            setSelectedFileIds(unbilledFiles.map(f => f.file_id).filter(fid => fid !== id));
+            return;
+        }
         setSelectedFileIds(prev =>
             prev.includes(id) ? prev.filter(fid => fid !== id) : [...prev, id]
         );
     };
 
+    const toggleSelectAll = () => {
+        setAllSelected(!allSelected);
+        setSelectedFileIds([]);
+    };
+
     const handleGenerate = async () => {
         if (!selectedHospital) return;
 
         // Validation check for empty invoice
-        const hasFiles = selectedFileIds.length > 0;
+        const hasFiles = allSelected ? unbilledTotal > 0 : selectedFileIds.length > 0;
         const hasCustomItems = customItems.length > 0;
         const hasRegFee = includeRegFee && parseFloat(regFeeAmount) > 0;
 
@@ -164,7 +206,8 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
                 method: 'POST',
                 body: JSON.stringify({
                     hospital_id: selectedHospital.hospital_id,
-                    file_ids: selectedFileIds,
+                    file_ids: allSelected ? [] : selectedFileIds,
+                    all_unbilled: allSelected,
                     custom_items: customItems,
                     due_date: new Date(dueDate).toISOString(),
                     bill_date: new Date(billDate).toISOString(),
@@ -179,6 +222,7 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
             setStep(1);
             setSelectedHospital(null);
             setSelectedFileIds([]);
+            setAllSelected(false);
             setCustomItems([]);
         } catch (error) {
             console.error("Error generating invoice:", error);
@@ -195,7 +239,8 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
         h.city.toLowerCase().includes(searchHospital.toLowerCase())
     );
 
-    const filesTotal = unbilledFiles
+    const selectedCount = allSelected ? unbilledTotal : selectedFileIds.length;
+    const filesTotal = allSelected ? unbilledTotalAmount : unbilledFiles
         .filter(f => selectedFileIds.includes(f.file_id))
         .reduce((sum, f) => sum + f.suggested_amount, 0);
 
@@ -335,13 +380,13 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
                                             <h3 className="text-lg font-bold text-slate-800 flex items-center gap-2">
                                                 <FileText size={20} className="text-slate-400" />
                                                 Billable Records
-                                                <span className="bg-slate-100 text-slate-600 px-2 py-0.5 rounded-md text-xs">{unbilledFiles.length}</span>
+                                                <span className="bg-slate-100 text-slate-600 px-2 py-0.5 rounded-md text-xs">{unbilledTotal}</span>
                                             </h3>
                                             <button
-                                                onClick={() => setSelectedFileIds(selectedFileIds.length === unbilledFiles.length ? [] : unbilledFiles.map(f => f.file_id))}
+                                                onClick={toggleSelectAll}
                                                 className="text-sm font-bold text-indigo-600 hover:bg-indigo-50 px-3 py-1 rounded-lg transition"
                                             >
-                                                {selectedFileIds.length === unbilledFiles.length ? 'Deselect All' : 'Select All'}
+                                                {allSelected ? 'Deselect All' : `Select All (${unbilledTotal})`}
                                             </button>
                                         </div>
 
@@ -366,11 +411,11 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
                                                         <tr
                                                             key={file.file_id}
                                                             onClick={() => toggleFileSelection(file.file_id)}
-                                                            className={`cursor-pointer transition-colors ${selectedFileIds.includes(file.file_id) ? 'bg-indigo-50/60' : 'hover:bg-slate-50'}`}
+                                                            className={`cursor-pointer transition-colors ${isFileSelected(file.file_id) ? 'bg-indigo-50/60' : 'hover:bg-slate-50'}`}
                                                         >
                                                             <td className="px-3 py-2 text-center">
-                                                                <div className={`w-4 h-4 rounded border-2 flex items-center justify-center transition-all ${selectedFileIds.includes(file.file_id) ? 'bg-indigo-600 border-indigo-600' : 'bg-white border-slate-300'}`}>
-                                                                    {selectedFileIds.includes(file.file_id) && <Check size={10} className="text-white" strokeWidth={4} />}
+                                                                <div className={`w-4 h-4 rounded border-2 flex items-center justify-center transition-all ${isFileSelected(file.file_id) ? 'bg-indigo-600 border-indigo-600' : 'bg-white border-slate-300'}`}>
+                                                                    {isFileSelected(file.file_id) && <Check size={10} className="text-white" strokeWidth={4} />}
                                                                 </div>
                                                             </td>
                                                             <td className="px-3 py-2">
@@ -383,6 +428,16 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
                                                     ))}
                                                 </tbody>
                                             </table>
+                                            {!loading && unbilledFiles.length < unbilledTotal && (
+                                                <button
+                                                    onClick={loadMoreFiles}
+                                                    disabled={loadingMore}
+                                                    className="w-full py-2 text-sm font-bold text-indigo-600 hover:bg-indigo-50 border-t border-slate-100 transition flex items-center justify-center gap-2"
+                                                >
+                                                    {loadingMore && <Loader2 className="animate-spin" size={14} />}
+                                                    Load more ({unbilledFiles.length} of {unbilledTotal})
+                                                </button>
+                                            )}
                                         </div>
                                     </div>
 
@@ -498,7 +553,7 @@ export default function InvoiceGenerationModal({ isOpen, onClose, onSuccess }: I
                                         {/* Totals */}
                                         <div className="bg-slate-50 rounded-2xl p-2 space-y-2 border border-slate-100">
                                             <div className="flex justify-between text-xs text-slate-600">
-                                                <span>Records ({selectedFileIds.length})</span>
+                                                <span>Records ({selectedCount})</span>
                                                 <span className="font-bold text-slate-900">₹{filesTotal.toLocaleString()}</span>
                                             </div>
                                             <div className="flex justify-between text-xs text-slate-600">
@@ -60,6 +60,7 @@ export default function DentalDashboard() {
         medications: '',
         chief_complaint: ''
     });
+    const [suggestedIds, setSuggestedIds] = useState({ uhid: '', opd_number: '' }); // Previews from next-ids, not reserved
     const [suggestions, setSuggestions] = useState<any[]>([]);
     const [showSuggestions, setShowSuggestions] = useState(false);
 
@@ -69,6 +70,7 @@ export default function DentalDashboard() {
         try {
             const data = await apiFetch(`dental/next-ids`);
             if (data) {
+                setSuggestedIds({ uhid: data.next_uhid, opd_number: data.next_opd });
                 setNewPatientData(prev => ({
                     ...prev,
                     uhid: data.next_uhid,
@@ -197,6 +199,11 @@ export default function DentalDashboard() {
                 email: newPatientData.email || null,
                 gender: newPatientData.gender || null
             };
+            // Untouched previews are sent blank so the server allocates the numbers (no duplicates)
+            if (!editingId) {
+                if (payload.uhid === suggestedIds.uhid) payload.uhid = '';
+                if (payload.opd_number === suggestedIds.opd_number) payload.opd_number = '';
+            }
 
             const url = editingId
                 ? `dental/patients/${editingId}`
@@ -241,6 +241,7 @@ export default function RecordsList() {
 
     const [lastMRD, setLastMRD] = useState<string | null>(null);
     const [lastAssignedMRD, setLastAssignedMRD] = useState<string | null>(null);
+    const [suggestedMRD, setSuggestedMRD] = useState<string | null>(null); // Preview from next-id, not reserved
 
     const handleAIExtraction = async (file: File) => {
         setIsExtracting(true);
@@ -360,6 +361,7 @@ export default function RecordsList() {
             if (data) {
                 if (data.next_id) {
                     setNewPatient(prev => ({ ...prev, patient_u_id: data.next_id }));
+                    setSuggestedMRD(data.next_id);
                 }
                 if (data.last_id) {
                     setLastAssignedMRD(data.last_id);
@@ -610,6 +612,10 @@ export default function RecordsList() {
             body.discharge_date = newPatient.discharge_date || null;
             body.mother_record_id = newPatient.mother_record_id || null;
             body.uhid = newPatient.uhid || null;
+            // An untouched preview is sent blank so the server allocates the number (no duplicates)
+            if (!isEditing && newPatient.patient_u_id === suggestedMRD) {
+                body.patient_u_id = null;
+            }
             // Append Unit to Age
             body.age = `${newPatient.age} ${ageUnit}`;
 